@@ -7,6 +7,8 @@ import os
 from tkinter import ttk, filedialog, messagebox
 from openai import OpenAI
 
+from grade_core import LEVEL_NAMES, LEVEL_TITLES, build_record_index, compute_grades, get_level
+
 
 class GradeSystemApp:
     def __init__(self, root):
@@ -17,6 +19,8 @@ class GradeSystemApp:
 
         # 所有记录
         self.all_records = []
+        # (班级, 课程) → 该班该课程的记录（按文件中的顺序），加载文件时一次建好
+        self.record_index = {}
         # 当前筛选后的记录
         self.current_records = []
 
@@ -194,8 +198,7 @@ class GradeSystemApp:
 
         # 各等级统计
         self.stat_labels = {}
-        level_names = ["优(100-90)", "良(89-80)", "中(79-70)", "及格(69-60)", "不及格(<60)"]
-        for name in level_names:
+        for name in reversed(LEVEL_TITLES):
             lbl = ttk.Label(stat_frame, text=f"{name}：0 人，占 0.0%", style="TLabel")
             lbl.pack(anchor="w", pady=1)
             self.stat_labels[name] = lbl
@@ -238,9 +241,10 @@ class GradeSystemApp:
             return
 
         self.all_records = data
-        # 提取所有班级、课程
-        classes = sorted({rec.get("class", "") for rec in self.all_records if "class" in rec})
-        courses = sorted({rec.get("course", "") for rec in self.all_records if "course" in rec})
+        # 一次遍历建立 (班级, 课程) 索引，同时提取所有班级、课程
+        self.record_index, classes, courses = build_record_index(self.all_records)
+        classes = sorted(classes)
+        courses = sorted(courses)
 
         self.class_combo["values"] = classes
         self.course_combo["values"] = courses
@@ -264,36 +268,27 @@ class GradeSystemApp:
             messagebox.showwarning("提示", "请选择班级和课程。")
             return
 
-        # 按班级+课程筛选记录
-        self.current_records = [
-            rec for rec in self.all_records
-            if rec.get("class") == cls and rec.get("course") == cour
-        ]
+        # 按班级+课程取出记录：直接查索引，不再遍历全部记录
+        self.current_records = list(self.record_index.get((cls, cour), ()))
 
         if not self.current_records:
             messagebox.showwarning("提示", f"没有找到 {cls} 班 {cour} 课程的成绩记录。")
             self.clear_results()
             return
 
-        # 计算总评、等级
-        for rec in self.current_records:
-            try:
-                daily = float(rec.get("daily", 0))
-                mid = float(rec.get("mid", 0))
-                final = float(rec.get("final", 0))
-            except ValueError:
-                daily = mid = final = 0.0
-
-            total = 0.3 * daily + 0.3 * mid + 0.4 * final
-            total = round(total, 2)
-            rec["total"] = total
-            rec["level"] = self.get_level(total)
+        # 按列计算总评、等级和统计
+        stats = compute_grades(self.current_records)
 
-        # 更新表格
+        # 更新表格，同时按等级分组（保持表格中的先后顺序）
         for item in self.tree.get_children():
             self.tree.delete(item)
 
-        for rec in self.current_records:
+        level_students = {title: [] for title in LEVEL_TITLES}
+        for rec, total, level in zip(self.current_records, stats.totals, stats.levels):
+            rec["total"] = total
+            rec["level"] = LEVEL_NAMES[level]
+            if total == total:
+                level_students[LEVEL_TITLES[level]].append(rec)
             self.tree.insert(
                 "",
                 tk.END,
@@ -309,37 +304,17 @@ class GradeSystemApp:
             )
 
         # 平均分
-        totals = [rec["total"] for rec in self.current_records]
-        avg = sum(totals) / len(totals)
-        self.avg_label.config(text=f"平均分：{avg:.2f}")
+        self.avg_label.config(text=f"平均分：{stats.average:.2f}")
 
         # 各等级统计
         count = len(self.current_records)
-        level_ranges = {
-            "优(100-90)": lambda x: x >= 90,
-            "良(89-80)": lambda x: 80 <= x <= 89.9999,
-            "中(79-70)": lambda x: 70 <= x <= 79.9999,
-            "及格(69-60)": lambda x: 60 <= x <= 69.9999,
-            "不及格(<60)": lambda x: x < 60,
-        }
-
-        level_students = {key: [] for key in level_ranges}
-
-        for rec in self.current_records:
-            total = rec["total"]
-            for key, cond in level_ranges.items():
-                if cond(total):
-                    level_students[key].append(rec)
-                    break
-
-        for key, lbl in self.stat_labels.items():
-            num = len(level_students[key])
+        for title, num in zip(LEVEL_TITLES, stats.counts):
             pct = num / count * 100
-            lbl.config(text=f"{key}：{num} 人，占 {pct:.1f}%")
+            self.stat_labels[title].config(text=f"{title}：{num} 人，占 {pct:.1f}%")
 
         # 下方文本区：按等级输出学号和成绩
         self.text_output.delete("1.0", tk.END)
-        for key in ["优(100-90)", "良(89-80)", "中(79-70)", "及格(69-60)", "不及格(<60)"]:
+        for key in reversed(LEVEL_TITLES):
             self.text_output.insert(tk.END, f"{key}：\n")
             students = level_students[key]
             if not students:
@@ -421,19 +396,8 @@ class GradeSystemApp:
         self.text_output.insert(tk.END, analysis_text + "\n")
         self.text_output.see(tk.END)
 
-    # ===== 根据总评返回等级 =====
-    @staticmethod
-    def get_level(total: float) -> str:
-        if total >= 90:
-            return "优"
-        elif total >= 80:
-            return "良"
-        elif total >= 70:
-            return "中"
-        elif total >= 60:
-            return "及格"
-        else:
-            return "不及格"
+    # ===== 根据总评返回等级（按 LEVEL_THRESHOLDS 划分，见 grade_core）=====
+    get_level = staticmethod(get_level)
 
     # ===== 清空结果显示（不清空文件数据）=====
     def clear_results(self):
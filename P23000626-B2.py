@@ -1,255 +1,253 @@
+import argparse
 import json
 import os
-import math
+import queue
+import time
 import tkinter as tk
-from tkinter import ttk, messagebox
-
-# -------------------- 文件路径设置 --------------------
-
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-USERS_FILE = os.path.join(BASE_DIR, "users.json")
-RATES_FILE = os.path.join(BASE_DIR, "rates.json")
-CALLS_FILE = os.path.join(BASE_DIR, "calls.json")
-FEES_FILE = os.path.join(BASE_DIR, "fees.json")
-
-
-# -------------------- 初始化示例数据 --------------------
-
-def init_sample_data():
-    """如果 JSON 文件不存在，则创建一些示例数据，方便测试。"""
-    if not os.path.exists(USERS_FILE):
-        users = {
-            "users": [
-                {"userId": "U001", "userName": "张三", "phoneNumber": "13800000001"},
-                {"userId": "U002", "userName": "李四", "phoneNumber": "13800000002"},
-                {"userId": "U003", "userName": "王五", "phoneNumber": "01088880000"},
-                {"userId": "U004", "userName": "张三丰", "phoneNumber": "13900000003"}
-            ]
-        }
-        with open(USERS_FILE, "w", encoding="utf-8") as f:
-            json.dump(users, f, ensure_ascii=False, indent=4)
-
-    if not os.path.exists(RATES_FILE):
-        rates = {
-            "longDistanceRates": [
-                {"areaCode": "010", "areaName": "北京", "ratePerMinute": 0.60},
-                {"areaCode": "021", "areaName": "上海", "ratePerMinute": 0.65},
-                {"areaCode": "020", "areaName": "广州", "ratePerMinute": 0.70}
-            ]
-        }
-        with open(RATES_FILE, "w", encoding="utf-8") as f:
-            json.dump(rates, f, ensure_ascii=False, indent=4)
-
-    if not os.path.exists(CALLS_FILE):
-        calls = {
-            "callRecords": [
-                {
-                    "callId": "C001",
-                    "callerNumber": "13800000001",
-                    "calleeNumber": "01088880000",
-                    "startTime": "2025-11-18 09:00:10",
-                    "durationSeconds": 125,  # 2分5秒 -> 3分钟
-                    "callType": "long-distance",
-                    "longDistanceAreaCode": "010"
-                },
-                {
-                    "callId": "C002",
-                    "callerNumber": "13800000001",
-                    "calleeNumber": "13800000002",
-                    "startTime": "2025-11-18 10:15:05",
-                    "durationSeconds": 170,  # 2分50秒 -> 3分钟
-                    "callType": "local",
-                    "longDistanceAreaCode": None
-                },
-                {
-                    "callId": "C003",
-                    "callerNumber": "13800000002",
-                    "calleeNumber": "02166668888",
-                    "startTime": "2025-11-18 11:20:30",
-                    "durationSeconds": 59,   # 0分59秒 -> 1分钟
-                    "callType": "long-distance",
-                    "longDistanceAreaCode": "021"
-                }
-            ]
-        }
-        with open(CALLS_FILE, "w", encoding="utf-8") as f:
-            json.dump(calls, f, ensure_ascii=False, indent=4)
-
-
-# -------------------- 计费核心逻辑 --------------------
-
-def calc_local_fee(minutes: int) -> float:
+from collections import OrderedDict
+from tkinter import ttk, messagebox, filedialog
+
+from billing_core import (
+    BILLING_STORAGE,
+    FEES_FORMAT,
+    FEES_FORMATS,
+    PROFILE_ENV,
+    RatingWorker,
+    create_billing_system,
+    month_period,
+    parse_profile_modes,
+)
+
+ALL_PERIODS = "全部时间"
+# 输入姓名时即时查询：停止输入这么久（毫秒）后再查，以及最多列出的用户数
+TYPEAHEAD_DELAY = 150
+TYPEAHEAD_LIMIT = 200
+# “或姓名”输入框下拉列表中最多列出的候选用户数
+NAME_SUGGESTION_LIMIT = 20
+# “性能诊断”页显示时每隔多久（毫秒）刷新一次统计
+DIAGNOSTICS_REFRESH = 2000
+# 各阶段的中文说明
+STAGE_LABELS = {
+    "computeAllFees": "计费一轮",
+    "loadReferenceData": "加载用户 / 费率",
+    "readNewCalls": "续读新增通话",
+    "parseCalls": "解析通话记录",
+    "parseFees": "解析费用记录",
+    "rateCalls": "计费运算",
+    "rateCallsParallel": "多进程计费",
+    "indexCalls": "更新索引",
+    "insertCalls": "写入通话表",
+    "writeFees": "写出费用",
+    "queryFeeSummary": "话费查询",
+    "queryCallRecords": "话单查询",
+    "countCallRecords": "话单计数",
+    "queryBillingMonths": "计费月份",
+    "findUsersByName": "姓名查询",
+    "exportBills": "批量出账",
+}
+
+
+# -------------------- 虚拟表格 --------------------
+
+# 虚拟表格每次向数据源取的行数，以及最多缓存的页数
+VIRTUAL_PAGE_SIZE = 200
+VIRTUAL_CACHED_PAGES = 8
+# 鼠标滚轮每格滚动的行数
+WHEEL_ROWS = 3
+
+
+class VirtualTable(ttk.Frame):
     """
-    本地电话费计算：
-    - 3 分钟以内 0.5 元
-    - 超过 3 分钟以后，每 3 分钟递增 0.2 元（不足 3 分钟按 3 分钟算）
+    只把可见的一屏行放进 Tk 的表格。
+    数据源为 fetch(offset, count)，返回从第 offset 行起最多 count 行（每行是各列的值），
+    按页取用并缓存最近几页；滚动时只改写这一屏条目的内容，不逐行插入和删除。
+    选中状态按数据行号记录，滚动后仍对应原来的数据行。
     """
-    if minutes <= 3:
-        return 0.5
-    else:
-        extra_minutes = minutes - 3
-        extra_blocks = math.ceil(extra_minutes / 3)
-        return 0.5 + extra_blocks * 0.2
-
-
-class BillingSystem:
-    def __init__(self):
-        init_sample_data()
-        self.users = self._load_json(USERS_FILE)
-        self.rates = self._load_json(RATES_FILE)
-        self.calls = self._load_json(CALLS_FILE)
-
-        if os.path.exists(FEES_FILE):
-            self.fees = self._load_json(FEES_FILE)
+
+    def __init__(self, master, columns, height=15):
+        """columns：[(列名, 标题, 宽度), ...]"""
+        super().__init__(master)
+        self.tree = ttk.Treeview(self, columns=[c[0] for c in columns], show="headings",
+                                 height=height, selectmode=tk.EXTENDED)
+        for name, heading, width in columns:
+            self.tree.heading(name, text=heading)
+            self.tree.column(name, width=width, anchor=tk.CENTER)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        self.total = 0
+        self.offset = 0
+        self.visible_rows = height
+        self._fetch = lambda offset, count: []
+        self._pages = OrderedDict()
+        self._items = []
+        self._selected = set()
+
+        self.tree.bind("<Configure>", lambda event: self._fit_rows())
+        self.tree.bind("<<TreeviewSelect>>", self._on_select)
+        self.tree.bind("<Button-1>", self._on_click)
+        self.tree.bind("<MouseWheel>", self._on_mousewheel)
+        self.tree.bind("<Button-4>", lambda event: self._scroll_by(-WHEEL_ROWS))
+        self.tree.bind("<Button-5>", lambda event: self._scroll_by(WHEEL_ROWS))
+        self.tree.bind("<Up>", lambda event: self._on_arrow(-1))
+        self.tree.bind("<Down>", lambda event: self._on_arrow(1))
+        self.tree.bind("<Prior>", lambda event: self._scroll_by(-self.visible_rows))
+        self.tree.bind("<Next>", lambda event: self._scroll_by(self.visible_rows))
+        self.tree.bind("<Home>", lambda event: self._scroll_by(-self.total))
+        self.tree.bind("<End>", lambda event: self._scroll_by(self.total))
+
+    # ---------- 数据源 ----------
+
+    def set_source(self, total, fetch):
+        """显示共 total 行的数据，由 fetch(offset, count) 按需取出，并回到第一行。"""
+        self.total = total
+        self._fetch = fetch
+        self._pages.clear()
+        self._selected.clear()
+        self.offset = 0
+        self._refresh()
+        self.after_idle(self._fit_rows)
+
+    def set_rows(self, rows):
+        """数据已全部在内存中时（如用户查询结果）直接给出各行。"""
+        self.set_source(len(rows), lambda offset, count: rows[offset:offset + count])
+
+    def clear(self):
+        self.set_rows([])
+
+    def selected_rows(self):
+        """按数据顺序返回选中的各行（包括已滚出可见范围的）。"""
+        return [self._row(index) for index in sorted(self._selected)]
+
+    def _row(self, index):
+        page_no, k = divmod(index, VIRTUAL_PAGE_SIZE)
+        page = self._pages.get(page_no)
+        if page is None:
+            page = self._fetch(page_no * VIRTUAL_PAGE_SIZE, VIRTUAL_PAGE_SIZE)
+            self._pages[page_no] = page
+            if len(self._pages) > VIRTUAL_CACHED_PAGES:
+                self._pages.popitem(last=False)
         else:
-            self.fees = {"fees": []}
-            self.compute_all_fees()
-
-    @staticmethod
-    def _load_json(path):
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-
-    @staticmethod
-    def _save_json(path, data):
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
-
-    # ---------- 用户相关 ----------
-
-    def get_user_name(self, phone_number: str) -> str:
-        """根据手机号返回用户名，找不到则返回“未知用户”"""
-        for u in self.users.get("users", []):
-            if u.get("phoneNumber") == phone_number:
-                return u.get("userName", "未知用户")
-        return "未知用户"
-
-    def find_users_by_name(self, name: str):
-        """
-        根据姓名（支持模糊匹配）查询所有用户。
-        返回列表，每项为用户字典。
-        """
-        result = []
-        name = name.strip()
-        if not name:
-            return result
-        for u in self.users.get("users", []):
-            if name in u.get("userName", ""):
-                result.append(u)
-        return result
-
-    # ---------- 费率 & 计费 ----------
-
-    def get_rate(self, area_code: str) -> float:
-        if not area_code:
-            return 0.0
-        for r in self.rates.get("longDistanceRates", []):
-            if r.get("areaCode") == area_code:
-                return float(r.get("ratePerMinute", 0.0))
-        return 0.0
-
-    def compute_all_fees(self):
-        """根据通话记录和长途费率计算所有通话费用，并保存到 fees.json。"""
-        # 重新加载通话记录，防止外部脚本更新 calls.json 后这里还是旧数据
-        self.calls = self._load_json(CALLS_FILE)
-
-        fees_list = []
-        for call in self.calls.get("callRecords", []):
-            call_id = call.get("callId")
-            caller_number = call.get("callerNumber")
-            callee_number = call.get("calleeNumber")
-            duration_seconds = int(call.get("durationSeconds", 0))
-            call_type = call.get("callType", "local")
-            area_code = call.get("longDistanceAreaCode")
-
-            # 通话时长（分钟），不满 1 分钟按 1 分钟算
-            minutes = math.ceil(duration_seconds / 60.0)
-            # 本地话费
-            local_fee = calc_local_fee(minutes)
-            # 长途话费
-            long_fee = 0.0
-            if call_type == "long-distance":
-                rate = self.get_rate(area_code)
-                long_fee = rate * minutes
-
-            local_fee = round(local_fee, 2)
-            long_fee = round(long_fee, 2)
-            total_fee = round(local_fee + long_fee, 2)
-
-            caller_name = self.get_user_name(caller_number)
-
-            fees_list.append({
-                "callId": call_id,
-                "callerNumber": caller_number,
-                "calleeNumber": callee_number,
-                "userName": caller_name,
-                "localFee": local_fee,
-                "longDistanceFee": long_fee,
-                "totalFee": total_fee
-            })
-
-        self.fees = {"fees": fees_list}
-        self._save_json(FEES_FILE, self.fees)
-
-    # ---------- 查询接口 ----------
-
-    def query_fee_summary(self, phone_number: str):
-        """
-        话费查询：返回 userName, local_sum, long_sum, total_sum
-        """
-        user_name = self.get_user_name(phone_number)
-        local_sum = 0.0
-        long_sum = 0.0
-
-        for fee in self.fees.get("fees", []):
-            if fee.get("callerNumber") == phone_number:
-                local_sum += float(fee.get("localFee", 0.0))
-                long_sum += float(fee.get("longDistanceFee", 0.0))
-
-        local_sum = round(local_sum, 2)
-        long_sum = round(long_sum, 2)
-        total_sum = round(local_sum + long_sum, 2)
-
-        return user_name, local_sum, long_sum, total_sum
-
-    def query_call_records(self, phone_number: str):
-        caller_name = self.get_user_name(phone_number)
-        records = []
-        for call in self.calls.get("callRecords", []):
-            if call.get("callerNumber") == phone_number:
-                callee_number = call.get("calleeNumber")
-                callee_name = self.get_user_name(callee_number)
-                records.append({
-                    "userName": caller_name,
-                    "callerNumber": call.get("callerNumber"),
-                    "calleeNumber": callee_number,
-                    "calleeName": callee_name,
-                    "durationSeconds": call.get("durationSeconds"),
-                    "callType": call.get("callType", "local")
-                })
-        return records
+            self._pages.move_to_end(page_no)
+        return page[k] if k < len(page) else ()
+
+    # ---------- 显示 ----------
+
+    def _refresh(self):
+        self.offset = max(0, min(self.offset, self.total - self.visible_rows))
+        count = max(0, min(self.visible_rows, self.total - self.offset))
+        while len(self._items) < count:
+            self._items.append(self.tree.insert("", tk.END))
+        while len(self._items) > count:
+            self.tree.delete(self._items.pop())
+        selected = []
+        for k, item in enumerate(self._items):
+            self.tree.item(item, values=self._row(self.offset + k))
+            if self.offset + k in self._selected:
+                selected.append(item)
+        self.tree.selection_set(selected)
+        if self.total:
+            self.scrollbar.set(self.offset / self.total, (self.offset + count) / self.total)
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def _fit_rows(self):
+        """按表格当前高度重新计算一屏能显示的行数。"""
+        if not self._items:
+            return
+        bbox = self.tree.bbox(self._items[0])
+        if not bbox:
+            return
+        _, top, _, row_height = bbox
+        rows = max(1, (self.tree.winfo_height() - top) // max(1, row_height))
+        if rows != self.visible_rows:
+            self.visible_rows = rows
+            self._refresh()
+
+    # ---------- 滚动 ----------
+
+    def _scroll_by(self, rows):
+        self.offset += rows
+        self._refresh()
+        return "break"
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self.offset = int(float(amount) * self.total)
+            self._refresh()
+        elif action == "scroll":
+            step = self.visible_rows if unit == "pages" else 1
+            self._scroll_by(int(amount) * step)
+
+    def _on_mousewheel(self, event):
+        return self._scroll_by(-WHEEL_ROWS if event.delta > 0 else WHEEL_ROWS)
+
+    def _on_arrow(self, step):
+        """在可见范围的首、末行继续按上下键时滚动一行，并选中新露出的行。"""
+        focus = self.tree.focus()
+        if focus not in self._items:
+            return None
+        k = self._items.index(focus) + step
+        if 0 <= k < len(self._items):
+            return None
+        self._scroll_by(step)
+        k = 0 if step < 0 else len(self._items) - 1
+        self._selected = {self.offset + k}
+        self.tree.focus(self._items[k])
+        self.tree.selection_set(self._items[k])
+        return "break"
+
+    # ---------- 选中 ----------
+
+    def _on_click(self, event):
+        # 不按 Shift / Ctrl 单击时，已滚出可见范围的选中行也一并取消
+        if not event.state & 0x0005:
+            self._selected.clear()
+
+    def _on_select(self, event):
+        chosen = set(self.tree.selection())
+        for k, item in enumerate(self._items):
+            if item in chosen:
+                self._selected.add(self.offset + k)
+            else:
+                self._selected.discard(self.offset + k)
 
 
 # -------------------- 图形界面 --------------------
 
 class BillingApp(tk.Tk):
-    def __init__(self):
+    def __init__(self, storage=BILLING_STORAGE, workers=1, profile=None, fees_format=None):
         super().__init__()
         self.title("模拟电信计费系统")
         self.geometry("1000x650")
         self.resizable(False, False)
 
-        self.billing = BillingSystem()
+        self.billing = create_billing_system(storage, workers, profile=profile, fees_format=fees_format)
+        self.rating_worker = None
+        # 最近一次由后台计费线程发布的状态
+        self.rating_status = None
+        # 即时查询：待执行的 after 任务和上次查询的文字（按输入框区分）
+        self._typeahead_jobs = {}
+        self._typeahead_texts = {}
 
         self._create_widgets()
 
-        # 启动时就开启 5 秒一次的自动计费轮询
+        # 启动时就开启后台自动计费：通话记录、用户或费率文件一有变化就计费
         self.start_auto_recompute()
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def _create_widgets(self):
+        # 底部状态栏：显示后台计费的时间、延迟和速度
+        self.status_label = ttk.Label(self, text="后台计费已启动，等待第一轮结果……",
+                                      anchor=tk.W, relief=tk.SUNKEN, padding=(8, 2))
+        self.status_label.pack(side=tk.BOTTOM, fill=tk.X)
+
         # 使用 Notebook 创建多页面
         notebook = ttk.Notebook(self)
         notebook.pack(fill=tk.BOTH, expand=True)
+        self.notebook = notebook
 
         # 页面 1：用户信息查询
         self.page_user = ttk.Frame(notebook)
@@ -259,17 +257,58 @@ class BillingApp(tk.Tk):
         self.page_billing = ttk.Frame(notebook)
         notebook.add(self.page_billing, text="话费与话单查询")
 
+        # 页面 3：性能诊断
+        self.page_diagnostics = ttk.Frame(notebook)
+        notebook.add(self.page_diagnostics, text="性能诊断")
+
         self._build_page_user()
         self._build_page_billing()
+        self._build_page_diagnostics()
 
-    # ---------- 自动轮询计费 ----------
+    # ---------- 后台自动计费 ----------
 
     def start_auto_recompute(self):
+        """启动后台计费线程，并开始轮询它发布的计费状态。"""
+        self.rating_worker = RatingWorker(self.billing)
+        self.rating_worker.start()
+        self.after(200, self._poll_rating_status)
+
+    def _poll_rating_status(self):
+        status = None
+        try:
+            while True:
+                status = self.rating_worker.status_queue.get_nowait()
+        except queue.Empty:
+            pass
+        if status is not None:
+            self.rating_status = status
+            self._show_rating_status(status)
+        self.after(200, self._poll_rating_status)
+
+    def _show_rating_status(self, status):
+        rated_at = time.strftime("%H:%M:%S", time.localtime(status.rated_at))
+        if status.error:
+            self.status_label.config(text=f"上次计费：{rated_at}    出错：{status.error}",
+                                     foreground="red")
+            return
+        self.status_label.config(
+            text=f"上次计费：{rated_at}    本轮 {status.records} 条    "
+                 f"耗时 {status.seconds:.2f} 秒    {status.records_per_sec:.0f} 条/秒    "
+                 f"延迟 {status.lag:.1f} 秒",
+            foreground="black"
+        )
+
+    def on_close(self):
+        if self.rating_worker is not None:
+            self.rating_worker.stop()
+            # 等待正在进行的一轮写完费用文件，避免留下写了一半的文件
+            self.rating_worker.join(timeout=5)
         try:
-            self.billing.compute_all_fees()
+            # 费用文件由后台线程写出，等它把已经计费的费用写完再退出
+            self.billing.flush()
         except Exception as e:
-            print("自动计算费用出错：", e)
-        self.after(5000, self.start_auto_recompute)
+            messagebox.showerror("错误", f"写出费用文件时发生错误：{e}")
+        self.destroy()
 
     # ---------- 页面 1：用户信息查询 ----------
 
@@ -280,6 +319,9 @@ class BillingApp(tk.Tk):
         ttk.Label(frame_top, text="姓名：").grid(row=0, column=0, padx=5, pady=5, sticky=tk.W)
         self.name_entry = ttk.Entry(frame_top, width=25)
         self.name_entry.grid(row=0, column=1, padx=5, pady=5)
+        # 边输入边查询，回车与“查询用户”按钮相同
+        self.name_entry.bind("<KeyRelease>", lambda e: self._schedule_typeahead(self.name_entry, self._typeahead_users))
+        self.name_entry.bind("<Return>", lambda e: self.on_search_user_by_name())
 
         btn_search_name = ttk.Button(frame_top, text="查询用户", command=self.on_search_user_by_name)
         btn_search_name.grid(row=0, column=2, padx=10, pady=5)
@@ -290,34 +332,60 @@ class BillingApp(tk.Tk):
         frame_table = ttk.LabelFrame(self.page_user, text="查询结果（用户及名下手机号）", padding=10)
         frame_table.pack(side=tk.TOP, fill=tk.BOTH, expand=True, padx=10, pady=10)
 
-        columns = ("userId", "userName", "phoneNumber")
-        self.user_tree = ttk.Treeview(frame_table, columns=columns, show="headings", height=15)
-        self.user_tree.heading("userId", text="用户ID")
-        self.user_tree.heading("userName", text="用户名")
-        self.user_tree.heading("phoneNumber", text="手机号")
-
-        self.user_tree.column("userId", width=100, anchor=tk.CENTER)
-        self.user_tree.column("userName", width=150, anchor=tk.CENTER)
-        self.user_tree.column("phoneNumber", width=200, anchor=tk.CENTER)
-
-        self.user_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-
-        scrollbar = ttk.Scrollbar(frame_table, orient=tk.VERTICAL, command=self.user_tree.yview)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.user_tree.configure(yscrollcommand=scrollbar.set)
+        self.user_table = VirtualTable(
+            frame_table,
+            [("userId", "用户ID", 100), ("userName", "用户名", 150), ("phoneNumber", "手机号", 200)]
+        )
+        self.user_table.pack(fill=tk.BOTH, expand=True)
 
         # 绑定 Ctrl + C 复制选中行中的“手机号”
-        self.user_tree.bind("<Control-c>", self.on_copy_user_row)
+        self.user_table.tree.bind("<Control-c>", self.on_copy_user_row)
 
         # 底部提示
         self.user_hint_label = ttk.Label(
             self.page_user,
-            text="提示：支持模糊查询，例如输入“张”可列出所有姓名中包含“张”的用户；"
+            text="提示：支持模糊查询，例如输入“张”可列出所有姓名中包含“张”的用户，输入时会即时列出；"
                  "选中一行后按 Ctrl + C 只会复制该行的手机号。",
             foreground="gray"
         )
         self.user_hint_label.pack(side=tk.BOTTOM, anchor=tk.W, padx=15, pady=5)
 
+    # ---------- 输入时即时查询 ----------
+
+    def _schedule_typeahead(self, entry, callback):
+        """输入框内容变化后等 TYPEAHEAD_DELAY 毫秒再查询，连续输入时只查最后一次；内容没变（如方向键）不查。"""
+        job = self._typeahead_jobs.pop(entry, None)
+        if job is not None:
+            self.after_cancel(job)
+
+        def run():
+            self._typeahead_jobs.pop(entry, None)
+            text = entry.get().strip()
+            if text != self._typeahead_texts.get(entry):
+                self._typeahead_texts[entry] = text
+                callback(text)
+
+        self._typeahead_jobs[entry] = self.after(TYPEAHEAD_DELAY, run)
+
+    def _typeahead_users(self, name):
+        if not name:
+            self.on_clear_user_table()
+            return
+        try:
+            users = self.billing.find_users_by_name(name, limit=TYPEAHEAD_LIMIT)
+        except Exception as e:
+            self.user_hint_label.config(text=f"查询用户时发生错误：{e}", foreground="red")
+            return
+        self._fill_user_tree(users)
+        if len(users) >= TYPEAHEAD_LIMIT:
+            hint = f"姓名包含“{name}”的用户很多，只列出前 {TYPEAHEAD_LIMIT} 个，请继续输入以缩小范围。"
+        else:
+            hint = f"姓名包含“{name}”的用户共 {len(users)} 个。"
+        self.user_hint_label.config(text=hint, foreground="gray")
+
+    def _fill_user_tree(self, users):
+        self.user_table.set_rows([(u.get("userId"), u.get("userName"), u.get("phoneNumber")) for u in users])
+
     def on_search_user_by_name(self):
         name = self.name_entry.get().strip()
         if not name:
@@ -326,39 +394,29 @@ class BillingApp(tk.Tk):
 
         try:
             users = self.billing.find_users_by_name(name)
-            # 清空表格
-            for item in self.user_tree.get_children():
-                self.user_tree.delete(item)
+            self._fill_user_tree(users)
 
             if not users:
                 messagebox.showinfo("提示", f"未找到姓名包含“{name}”的用户。")
                 return
-
-            for u in users:
-                self.user_tree.insert(
-                    "",
-                    tk.END,
-                    values=(u.get("userId"), u.get("userName"), u.get("phoneNumber"))
-                )
+            self.user_hint_label.config(text=f"姓名包含“{name}”的用户共 {len(users)} 个。", foreground="gray")
         except Exception as e:
             messagebox.showerror("错误", f"查询用户时发生错误：{e}")
 
     def on_clear_user_table(self):
-        for item in self.user_tree.get_children():
-            self.user_tree.delete(item)
+        self.user_table.clear()
         self.user_hint_label.config(
-            text="提示：支持模糊查询，例如输入“张”可列出所有姓名中包含“张”的用户；"
+            text="提示：支持模糊查询，例如输入“张”可列出所有姓名中包含“张”的用户，输入时会即时列出；"
                  "选中一行后按 Ctrl + C 只会复制该行的手机号。",
             foreground="gray"
         )
 
     def on_copy_user_row(self, event):
-        selected = self.user_tree.selection()
+        selected = self.user_table.selected_rows()
         if not selected:
             return
         phones = []
-        for item in selected:
-            values = self.user_tree.item(item, "values")
+        for values in selected:
             # values: (userId, userName, phoneNumber)
             if len(values) >= 3:
                 phones.append(str(values[2]))
@@ -395,8 +453,15 @@ class BillingApp(tk.Tk):
 
         # 第二行：新增“按姓名查号码”
         ttk.Label(top_frame, text="或姓名：").grid(row=1, column=0, padx=5, pady=5, sticky=tk.W)
-        self.name_for_fee_entry = ttk.Entry(top_frame, width=25)
+        # 输入时在下拉列表中列出候选用户，选中即填入电话号码
+        self.name_for_fee_entry = ttk.Combobox(top_frame, width=23)
         self.name_for_fee_entry.grid(row=1, column=1, padx=5, pady=5)
+        self.name_for_fee_entry.bind(
+            "<KeyRelease>",
+            lambda e: self._schedule_typeahead(self.name_for_fee_entry, self._suggest_users_for_fee)
+        )
+        self.name_for_fee_entry.bind("<<ComboboxSelected>>", self.on_name_suggestion_selected)
+        self._name_suggestions = []
 
         btn_name_to_phone = ttk.Button(
             top_frame,
@@ -405,6 +470,23 @@ class BillingApp(tk.Tk):
         )
         btn_name_to_phone.grid(row=1, column=2, padx=10, pady=5, columnspan=2, sticky=tk.W)
 
+        # 第三行：计费周期。选择月份会填入起止时间，也可以直接修改起止时间查询任意时间段
+        ttk.Label(top_frame, text="计费周期：").grid(row=2, column=0, padx=5, pady=5, sticky=tk.W)
+        self.period_combo = ttk.Combobox(
+            top_frame, width=23, state="readonly", values=(ALL_PERIODS,),
+            postcommand=self._refresh_billing_months
+        )
+        self.period_combo.set(ALL_PERIODS)
+        self.period_combo.grid(row=2, column=1, padx=5, pady=5)
+        self.period_combo.bind("<<ComboboxSelected>>", self.on_period_selected)
+
+        ttk.Label(top_frame, text="起始时间：").grid(row=2, column=2, padx=5, pady=5, sticky=tk.E)
+        self.period_start_entry = ttk.Entry(top_frame, width=20)
+        self.period_start_entry.grid(row=2, column=3, padx=5, pady=5)
+        ttk.Label(top_frame, text="结束时间（不含）：").grid(row=2, column=4, padx=5, pady=5, sticky=tk.E)
+        self.period_end_entry = ttk.Entry(top_frame, width=20)
+        self.period_end_entry.grid(row=2, column=5, padx=5, pady=5)
+
         # 中间：话费查询结果（文本显示）
         summary_frame = ttk.LabelFrame(self.page_billing, text="话费查询结果", padding=10)
         summary_frame.pack(side=tk.TOP, fill=tk.X, padx=10, pady=10)
@@ -413,7 +495,8 @@ class BillingApp(tk.Tk):
             summary_frame,
             text="在上方输入电话号码，然后点击“话费查询”或“话单查询”。\n"
                  "也可以先在此页输入姓名，通过“根据姓名查号码并填入”按钮获取电话号码。\n"
-                 "提示：系统每 5 秒自动刷新一次费用文件。",
+                 "选择计费周期或填写起止时间（YYYY-MM-DD [HH:MM:SS]）可只查询该时间段，留空表示不限。\n"
+                 "提示：通话记录、用户或费率文件有变化时系统会自动刷新费用。",
             font=("微软雅黑", 11)
         )
         self.summary_label.pack(anchor=tk.W)
@@ -422,31 +505,46 @@ class BillingApp(tk.Tk):
         records_frame = ttk.LabelFrame(self.page_billing, text="话单查询结果", padding=10)
         records_frame.pack(side=tk.TOP, fill=tk.BOTH, expand=True, padx=10, pady=10)
 
-        # 新增 calleeName 列
-        columns = ("userName", "callerNumber", "calleeNumber", "calleeName",
-                   "durationSeconds", "callType")
-        self.tree = ttk.Treeview(records_frame, columns=columns, show="headings", height=15)
-        self.tree.heading("userName", text="主叫用户名")
-        self.tree.heading("callerNumber", text="主叫号码")
-        self.tree.heading("calleeNumber", text="被叫号码")
-        self.tree.heading("calleeName", text="被叫用户名")
-        self.tree.heading("durationSeconds", text="通话时长(秒)")
-        self.tree.heading("callType", text="通话类型")
-
-        self.tree.column("userName", width=110, anchor=tk.CENTER)
-        self.tree.column("callerNumber", width=150, anchor=tk.CENTER)
-        self.tree.column("calleeNumber", width=150, anchor=tk.CENTER)
-        self.tree.column("calleeName", width=110, anchor=tk.CENTER)
-        self.tree.column("durationSeconds", width=120, anchor=tk.CENTER)
-        self.tree.column("callType", width=100, anchor=tk.CENTER)
+        # 新增 calleeName 列；话单可能很多，只把可见的一屏放进表格
+        self.call_table = VirtualTable(records_frame, [
+            ("userName", "主叫用户名", 110),
+            ("callerNumber", "主叫号码", 150),
+            ("calleeNumber", "被叫号码", 150),
+            ("calleeName", "被叫用户名", 110),
+            ("startTime", "开始时间", 160),
+            ("durationSeconds", "通话时长(秒)", 120),
+            ("callType", "通话类型", 100),
+        ])
+        self.call_table.pack(fill=tk.BOTH, expand=True)
 
-        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+    # ---------- 页面 2：姓名→号码 ----------
 
-        scrollbar = ttk.Scrollbar(records_frame, orient=tk.VERTICAL, command=self.tree.yview)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.tree.configure(yscrollcommand=scrollbar.set)
+    def _suggest_users_for_fee(self, name):
+        try:
+            users = self.billing.find_users_by_name(name, limit=NAME_SUGGESTION_LIMIT) if name else []
+        except Exception as e:
+            print("查询候选用户失败：", e)
+            return
+        self._name_suggestions = users
+        self.name_for_fee_entry.configure(
+            values=[f"{u.get('userName')} - {u.get('phoneNumber')}" for u in users]
+        )
 
-    # ---------- 页面 2：姓名→号码 ----------
+    def on_name_suggestion_selected(self, event=None):
+        index = self.name_for_fee_entry.current()
+        if not 0 <= index < len(self._name_suggestions):
+            return
+        u = self._name_suggestions[index]
+        phone = u.get("phoneNumber", "")
+        # 输入框恢复为姓名，避免再次触发查询时把“姓名 - 号码”当作姓名
+        self.name_for_fee_entry.set(u.get("userName", ""))
+        self._typeahead_texts[self.name_for_fee_entry] = u.get("userName", "").strip()
+        self.phone_entry.delete(0, tk.END)
+        self.phone_entry.insert(0, phone)
+        self.summary_label.config(
+            text=f"已根据姓名找到用户：{u.get('userName')}，电话号码：{phone}\n"
+                 f"你可以现在点击“话费查询”或“话单查询”。"
+        )
 
     def on_name_to_phone(self):
         name = self.name_for_fee_entry.get().strip()
@@ -479,6 +577,36 @@ class BillingApp(tk.Tk):
         except Exception as e:
             messagebox.showerror("错误", f"根据姓名查号码时发生错误：{e}")
 
+    # ---------- 页面 2：计费周期 ----------
+
+    def _refresh_billing_months(self):
+        """下拉列表展开前刷新可选的月份（通话记录可能已经增加）。"""
+        try:
+            months = self.billing.query_billing_months()
+        except Exception as e:
+            print("读取计费月份失败：", e)
+            return
+        self.period_combo.configure(values=(ALL_PERIODS, *months))
+
+    def on_period_selected(self, event=None):
+        period = self.period_combo.get()
+        start, end = ("", "") if period == ALL_PERIODS else month_period(period)
+        self.period_start_entry.delete(0, tk.END)
+        self.period_start_entry.insert(0, start)
+        self.period_end_entry.delete(0, tk.END)
+        self.period_end_entry.insert(0, end)
+
+    def _selected_period(self):
+        """返回输入框中的 (起始时间, 结束时间, 显示用的说明)，留空的一端为 None。"""
+        start = self.period_start_entry.get().strip() or None
+        end = self.period_end_entry.get().strip() or None
+        if start is None and end is None:
+            return None, None, ALL_PERIODS
+        period = self.period_combo.get()
+        if period != ALL_PERIODS and (start, end) == month_period(period):
+            return start, end, f"{period} 月"
+        return start, end, f"{start or '不限'} 至 {end or '不限'}"
+
     # ---------- 页面 2 按钮事件 ----------
 
     def on_query_fee(self):
@@ -487,19 +615,23 @@ class BillingApp(tk.Tk):
             messagebox.showwarning("提示", "请先输入电话号码（或先用姓名查号码并填入）！")
             return
 
+        start, end, period_text = self._selected_period()
         try:
-            user_name, local_sum, long_sum, total_sum = self.billing.query_fee_summary(phone)
+            user_name, local_sum, long_sum, total_sum = self.billing.query_fee_summary(phone, start, end)
             if local_sum == 0.0 and long_sum == 0.0:
-                msg = f"用户名：{user_name}    电话号码：{phone}\n该号码没有通话记录。"
+                msg = f"用户名：{user_name}    电话号码：{phone}    计费周期：{period_text}\n该号码在此期间没有话费。"
             else:
                 msg = (
-                    f"用户名：{user_name}    电话号码：{phone}\n"
+                    f"用户名：{user_name}    电话号码：{phone}    计费周期：{period_text}\n"
                     f"本地话费合计：{local_sum:.2f} 元    "
                     f"长途话费合计：{long_sum:.2f} 元    "
                     f"话费总计：{total_sum:.2f} 元\n"
-                    f"（费用文件会每 5 秒自动刷新一次）"
+                    f"（文件有变化时费用会自动刷新）"
                 )
             self.summary_label.config(text=msg)
+        except ValueError as e:
+            # 起止时间格式不对
+            messagebox.showwarning("提示", str(e))
         except Exception as e:
             messagebox.showerror("错误", f"查询话费时发生错误：{e}")
 
@@ -509,35 +641,158 @@ class BillingApp(tk.Tk):
             messagebox.showwarning("提示", "请先输入电话号码（或先用姓名查号码并填入）！")
             return
 
+        start, end, _ = self._selected_period()
         try:
-            records = self.billing.query_call_records(phone)
-            # 清空表格
-            for item in self.tree.get_children():
-                self.tree.delete(item)
-
-            if not records:
-                messagebox.showinfo("提示", "该号码没有通话记录。")
+            total = self.billing.count_call_records(phone, start, end)
+            if not total:
+                self.call_table.clear()
+                messagebox.showinfo("提示", "该号码在此期间没有通话记录。")
                 return
 
-            for rec in records:
-                self.tree.insert(
-                    "",
-                    tk.END,
-                    values=(
+            def fetch(offset, count):
+                # 表格滚动到哪一页才取哪一页
+                return [
+                    (
                         rec["userName"],         # 主叫用户名
                         rec["callerNumber"],     # 主叫号码
                         rec["calleeNumber"],     # 被叫号码
                         rec["calleeName"],       # 被叫用户名（新增）
+                        rec["startTime"],        # 开始时间
                         rec["durationSeconds"],  # 通话时长
                         "长途" if rec["callType"] == "long-distance" else "本地"
                     )
-                )
+                    for rec in self.billing.query_call_records(phone, start, end, offset, count)
+                ]
+
+            self.call_table.set_source(total, fetch)
+        except ValueError as e:
+            messagebox.showwarning("提示", str(e))
         except Exception as e:
             messagebox.showerror("错误", f"查询话单时发生错误：{e}")
 
+    # ---------- 页面 3：性能诊断 ----------
+
+    def _build_page_diagnostics(self):
+        top_frame = ttk.Frame(self.page_diagnostics, padding=10)
+        top_frame.pack(side=tk.TOP, fill=tk.X)
+
+        ttk.Button(top_frame, text="刷新", command=self.refresh_diagnostics).pack(side=tk.LEFT, padx=5)
+        ttk.Button(top_frame, text="清零", command=self.on_reset_metrics).pack(side=tk.LEFT, padx=5)
+        ttk.Button(top_frame, text="导出 JSON…", command=self.on_export_metrics).pack(side=tk.LEFT, padx=5)
+
+        modes = "、".join(sorted(self.billing.metrics.profile))
+        profile_text = (f"剖析：已打开 {modes}" if modes else
+                        f"剖析：未打开（启动时加 --profile all 或设置环境变量 {PROFILE_ENV}=all 打开）")
+        ttk.Label(top_frame, text=profile_text, foreground="gray").pack(side=tk.LEFT, padx=15)
+
+        stages_frame = ttk.LabelFrame(self.page_diagnostics, text="各阶段耗时（启动以来累计）", padding=10)
+        stages_frame.pack(side=tk.TOP, fill=tk.BOTH, expand=True, padx=10, pady=5)
+
+        columns = [("stage", "阶段", 200), ("calls", "次数", 70), ("totalMs", "总耗时(毫秒)", 110),
+                   ("meanMs", "平均(毫秒)", 100), ("maxMs", "最长(毫秒)", 100), ("records", "记录数", 100),
+                   ("recordsPerSecond", "条/秒", 100), ("peakBytes", "内存峰值(MB)", 110)]
+        self.metrics_tree = ttk.Treeview(stages_frame, columns=[c[0] for c in columns], show="headings", height=9)
+        for name, heading, width in columns:
+            self.metrics_tree.heading(name, text=heading)
+            self.metrics_tree.column(name, width=width, anchor=tk.CENTER)
+        self.metrics_tree.pack(fill=tk.BOTH, expand=True)
+
+        profile_frame = ttk.LabelFrame(self.page_diagnostics, text="剖析结果", padding=10)
+        profile_frame.pack(side=tk.TOP, fill=tk.BOTH, expand=True, padx=10, pady=5)
+        self.profile_text = tk.Text(profile_frame, height=10, wrap=tk.NONE, font=("Consolas", 9))
+        scrollbar = ttk.Scrollbar(profile_frame, orient=tk.VERTICAL, command=self.profile_text.yview)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.profile_text.configure(yscrollcommand=scrollbar.set)
+        self.profile_text.pack(fill=tk.BOTH, expand=True)
+
+        # 切换到这一页时立即刷新，停留在这一页时定时刷新
+        self.notebook.bind("<<NotebookTabChanged>>", lambda e: self._on_tab_changed())
+        self.after(DIAGNOSTICS_REFRESH, self._refresh_diagnostics_periodically)
+
+    def _diagnostics_visible(self):
+        return self.notebook.select() == str(self.page_diagnostics)
+
+    def _on_tab_changed(self):
+        if self._diagnostics_visible():
+            self.refresh_diagnostics()
+
+    def _refresh_diagnostics_periodically(self):
+        if self._diagnostics_visible():
+            self.refresh_diagnostics()
+        self.after(DIAGNOSTICS_REFRESH, self._refresh_diagnostics_periodically)
+
+    def refresh_diagnostics(self):
+        for item in self.metrics_tree.get_children():
+            self.metrics_tree.delete(item)
+        for row in self.billing.metrics.snapshot():
+            label = STAGE_LABELS.get(row["stage"])
+            peak = row["peakBytes"]
+            self.metrics_tree.insert("", tk.END, values=(
+                f"{label}（{row['stage']}）" if label else row["stage"],
+                row["calls"],
+                f"{row['totalMs']:.1f}",
+                f"{row['meanMs']:.3f}",
+                f"{row['maxMs']:.3f}",
+                row["records"] or "",
+                row["recordsPerSecond"] or "",
+                "" if peak is None else f"{peak / 1048576:.1f}",
+            ))
+
+        report = self.billing.metrics.report()
+        lines = []
+        if report.get("cprofile"):
+            lines.append(report["cprofile"])
+        if "topAllocations" in report:
+            lines.append(f"tracemalloc：当前 {report['tracedBytes'] / 1048576:.1f} MB，"
+                         f"峰值 {report['tracedPeakBytes'] / 1048576:.1f} MB；分配最多的代码行：")
+            for stat in report["topAllocations"]:
+                lines.append(f"  {stat['sizeBytes'] / 1024:10.1f} KB  {stat['count']:8d} 块  {stat['location']}")
+        if not lines:
+            lines.append("未打开剖析，只统计各阶段耗时。")
+        self.profile_text.delete("1.0", tk.END)
+        self.profile_text.insert("1.0", "\n".join(lines))
+
+    def on_reset_metrics(self):
+        self.billing.metrics.reset()
+        self.refresh_diagnostics()
+
+    def on_export_metrics(self):
+        path = filedialog.asksaveasfilename(title="导出性能统计", defaultextension=".json",
+                                            filetypes=[("JSON 文件", "*.json")])
+        if not path:
+            return
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(self.billing.metrics.report(), f, ensure_ascii=False, indent=4)
+        except OSError as e:
+            messagebox.showerror("错误", f"导出性能统计时发生错误：{e}")
+
+
+# -------------------- 命令行 --------------------
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="模拟电信计费系统",
+                                     epilog="不打开图形界面批量重新计费请使用 python billing_cli.py rate --full --workers N")
+    parser.add_argument("--storage", choices=["auto", "json", "jsonl", "sqlite"], default=BILLING_STORAGE,
+                        help="通话记录与费用的存储方式")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="全量重算（首次计费、资费数据变化后）时并行计费的进程数，默认 1 即不启用多进程")
+    parser.add_argument("--profile", metavar="MODES",
+                        help="打开剖析：cprofile、tracemalloc（逗号分隔）或 all，结果在“性能诊断”页查看；"
+                             "未给出时取环境变量 BILLING_PROFILE")
+    parser.add_argument("--fees-format", choices=FEES_FORMATS, default=FEES_FORMAT,
+                        help="写出 fees.json 时的编码：indent 缩进、compact 不缩进、zlib 不缩进再压缩")
+    args = parser.parse_args(argv)
+    try:
+        profile = parse_profile_modes(args.profile if args.profile is not None else os.environ.get(PROFILE_ENV))
+    except ValueError as e:
+        parser.error(str(e))
+
+    app = BillingApp(args.storage, max(1, args.workers), profile, args.fees_format)
+    app.mainloop()
+
 
 # -------------------- 主程序入口 --------------------
 
 if __name__ == "__main__":
-    app = BillingApp()
-    app.mainloop()
+    main()
@@ -0,0 +1,543 @@
+# -*- coding: utf-8 -*-
+"""
+计费系统的性能测试，数据在内存中随机生成，不读写 users.json / calls.json 等数据文件。
+
+- memory：比较通话记录和费用记录以字典列表存放（每条一个 dict）与按列存放（CallTable / FeeTable）
+  时每条记录占用的内存
+- rating：比较原来写死在 rate_call 中的计费规则与编译后的资费方案逐条计费的速度，
+  包括默认套餐和一个分档、分峰谷时段的套餐
+- pipeline：在数据目录中生成 users.json / rates.json / calls.json（可选 10^3 ~ 10^7 条通话），
+  分别测量读写通话记录文件、建立 BillingSystem、compute_all_fees 全量计费、后台写完费用文件的吞吐量，
+  query_fee_summary、query_call_records、find_users_by_name 的延迟分位数，以及峰值内存（RSS）；
+  每种规模在单独的子进程中运行 --repeat 次（默认 3 次），峰值内存互不影响，各项指标取中位数；
+  结果输出为 JSON，可保存下来与以后的结果比较
+- compare：比较两次 pipeline 的结果，吞吐量下降或延迟、内存上升超过阈值时列出并以状态码 1 退出；
+  延迟相差不到计时误差时既不算退步也不算改善
+
+只有 pipeline 读写数据文件，且只在 --data-dir 指定的目录（默认为临时目录，测完删除）中读写。
+
+用法示例：
+    python billing_bench.py memory --records 100000
+    python billing_bench.py rating --records 200000
+    python billing_bench.py pipeline --sizes 1000,100000,1000000 --output bench-before.json
+    python billing_bench.py compare bench-before.json bench-after.json
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import billing_core
+from billing_core import (
+    FEES_FORMAT,
+    FEES_FORMATS,
+    BillingSystem,
+    CallTable,
+    FeeTable,
+    RecordStream,
+    calc_local_fee,
+    create_billing_system,
+    set_data_dir,
+    write_json_records,
+)
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块，不统计峰值内存
+    resource = None
+
+# rating 测试中使用的分档、分峰谷时段套餐
+TIERED_TARIFFS = {
+    "plans": {
+        "night": {
+            "local": {"baseMinutes": 3, "baseFee": 0.5,
+                      "tiers": [{"uptoMinutes": 30, "blockMinutes": 3, "blockFee": 0.2},
+                                {"blockMinutes": 3, "blockFee": 0.1}]},
+            "longDistance": {"tiers": [{"uptoMinutes": 10, "multiplier": 1.0}, {"multiplier": 0.8}]},
+            "offPeak": {"from": "22:00", "to": "07:00", "localMultiplier": 0.5, "longDistanceMultiplier": 0.5}
+        }
+    }
+}
+
+AREAS = [("010", "北京", 0.60), ("021", "上海", 0.65), ("020", "广州", 0.70),
+         ("022", "天津", 0.55), ("023", "重庆", 0.62), ("024", "沈阳", 0.58)]
+SURNAMES = "张王李赵刘陈杨黄周吴"
+GIVEN_NAMES = "伟芳娜敏静丽强磊军洋勇艳杰涛明超"
+
+
+# -------------------- 测试数据 --------------------
+
+def make_reference_data(user_count, seed=0):
+    """生成 users / rates 数据，格式与 users.json / rates.json 相同。"""
+    rng = random.Random(seed)
+    users = [
+        {"userId": f"U{i:06d}",
+         "userName": rng.choice(SURNAMES) + "".join(rng.choices(GIVEN_NAMES, k=rng.randint(1, 2))),
+         "phoneNumber": f"13{rng.randint(0, 9)}{i:08d}"}
+        for i in range(user_count)
+    ]
+    rates = [{"areaCode": code, "areaName": name, "ratePerMinute": rate} for code, name, rate in AREAS]
+    return {"users": users}, {"longDistanceRates": rates}
+
+
+def iter_calls(count, users, seed=0):
+    """逐条生成 count 条通话记录，格式与 calls.json 相同；种子相同时生成的记录相同。"""
+    rng = random.Random(seed)
+    phones = [u["phoneNumber"] for u in users["users"]]
+    for i in range(count):
+        is_long = rng.random() < 0.3
+        yield {
+            "callId": f"C{i:08d}",
+            "callerNumber": rng.choice(phones),
+            "calleeNumber": rng.choice(phones),
+            "startTime": f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} "
+                         f"{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}",
+            "durationSeconds": rng.randint(1, 3600),
+            "callType": "long-distance" if is_long else "local",
+            "longDistanceAreaCode": rng.choice(AREAS)[0] if is_long else None
+        }
+
+
+def make_calls(count, users, seed=0):
+    """
+    生成 count 条通话记录的列表。
+    记录先序列化再解析一遍，字符串与从文件读入时一样是各自独立的对象。
+    """
+    return json.loads(json.dumps(list(iter_calls(count, users, seed)), ensure_ascii=False))
+
+
+# -------------------- 内存占用 --------------------
+
+def _traced_bytes(build):
+    """返回 build() 构造的对象占用的字节数（按 tracemalloc 统计的新增分配）。"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del result
+    return used
+
+
+def bench_memory(count, user_count=10000, seed=0):
+    """比较两种存放方式下每条通话记录（连同其费用记录）占用的内存，返回结果字典。"""
+    users, rates = make_reference_data(user_count, seed)
+    rater = BillingSystem.for_rating(users, rates)
+
+    def as_dicts():
+        calls = make_calls(count, users, seed)
+        return calls, rater.rate_calls(calls)
+
+    def as_tables():
+        calls = CallTable()
+        fees = FeeTable(calls)
+        batch = make_calls(count, users, seed)
+        calls.extend(batch)
+        fees.extend(rater.rate_calls(batch))
+        del batch
+        return calls, fees
+
+    dict_bytes = _traced_bytes(as_dicts)
+    table_bytes = _traced_bytes(as_tables)
+    return {
+        "records": count,
+        "dictBytesPerRecord": round(dict_bytes / count, 1),
+        "tableBytesPerRecord": round(table_bytes / count, 1),
+        "ratio": round(dict_bytes / table_bytes, 2),
+    }
+
+
+# -------------------- 计费速度 --------------------
+
+def hard_coded_rate_call(rater, call):
+    """资费方案引入之前 rate_call 的写法（本地话费调用 calc_local_fee，长途为费率 × 分钟数），作为对照。"""
+    duration_seconds = int(call.get("durationSeconds", 0))
+    caller_number = call.get("callerNumber")
+    minutes = math.ceil(duration_seconds / 60.0)
+    local_fee = calc_local_fee(minutes)
+    long_fee = 0.0
+    if call.get("callType", "local") == "long-distance":
+        long_fee = rater.get_rate(call.get("longDistanceAreaCode")) * minutes
+    local_fee = round(local_fee, 2)
+    long_fee = round(long_fee, 2)
+    return {
+        "callId": call.get("callId"),
+        "callerNumber": caller_number,
+        "calleeNumber": call.get("calleeNumber"),
+        "userName": rater.get_user_name(caller_number),
+        "localFee": local_fee,
+        "longDistanceFee": long_fee,
+        "totalFee": round(local_fee + long_fee, 2)
+    }
+
+
+def _best_rates(rate_funcs, calls, repeat):
+    """
+    用每种计费方式逐条计费 repeat 轮，返回各自最快一轮的每秒计费条数。
+    各方式轮流进行，机器负载的波动对它们的影响大致相同。
+    """
+    best = dict.fromkeys(rate_funcs)
+    for _ in range(repeat):
+        for name, rate_one in rate_funcs.items():
+            started = time.perf_counter()
+            for call in calls:
+                rate_one(call)
+            seconds = time.perf_counter() - started
+            best[name] = seconds if best[name] is None else min(best[name], seconds)
+    return {name: round(len(calls) / seconds) for name, seconds in best.items()}
+
+
+def bench_rating(count, user_count=10000, seed=0, repeat=5):
+    """比较三种计费方式的逐条计费速度（每秒条数），返回结果字典。"""
+    users, rates = make_reference_data(user_count, seed)
+    calls = make_calls(count, users, seed)
+    rater = BillingSystem.for_rating(users, rates)
+    tiered_users = {"users": [dict(u, plan="night") for u in users["users"]]}
+    tiered = BillingSystem.for_rating(tiered_users, rates, TIERED_TARIFFS)
+
+    # 默认套餐的结果应与原来的规则完全一致
+    assert [rater.rate_call(c) for c in calls[:10000]] == [hard_coded_rate_call(rater, c) for c in calls[:10000]]
+
+    rates_per_second = _best_rates({
+        "hardCodedPerSecond": lambda call: hard_coded_rate_call(rater, call),
+        "defaultPlanPerSecond": rater.rate_call,
+        "tieredPlanPerSecond": tiered.rate_call,
+    }, calls, repeat)
+    return {
+        "records": count,
+        **rates_per_second,
+        "defaultPlanRatio": round(rates_per_second["defaultPlanPerSecond"] / rates_per_second["hardCodedPerSecond"], 2),
+    }
+
+
+# -------------------- 计费流程 --------------------
+
+# pipeline 默认测试的通话记录条数，以及每种查询测量的次数
+DEFAULT_PIPELINE_SIZES = "1000,10000,100000"
+DEFAULT_QUERY_SAMPLES = 200
+# pipeline 每种规模默认运行的次数，各项指标取中位数，减少单次运行的抖动
+DEFAULT_PIPELINE_REPEATS = 3
+# 正式计时前先调用几次查询，排除首次调用时建缓存等的影响
+WARMUP_QUERIES = 10
+# compare 默认的判定阈值：吞吐量下降或延迟、内存上升超过 20% 算作退步
+DEFAULT_REGRESSION_THRESHOLD = 0.2
+# 延迟相差不到这么多（毫秒）时视为计时误差，既不算退步也不算改善
+LATENCY_NOISE_MS = 0.1
+# compare 比较的指标：越大越好的、越小越好的（opsPerSecond 只是平均延迟的倒数，不重复比较）
+HIGHER_IS_BETTER = ("recordsPerSecond",)
+LOWER_IS_BETTER = ("p50Ms", "p90Ms", "p99Ms", "peakRssBytes", "feesFileBytes")
+
+
+def _peak_rss_bytes():
+    """本进程到目前为止的峰值常驻内存（字节）；没有 resource 模块时返回 None。"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss 在 macOS 上以字节为单位，在 Linux 上以 KB 为单位
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _throughput(records, seconds):
+    return {
+        "records": records,
+        "seconds": round(seconds, 4),
+        "recordsPerSecond": round(records / seconds) if seconds > 0 else None,
+    }
+
+
+def _timed(func, *args):
+    """调用 func(*args)，返回 (结果, 用时秒数)。"""
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def _latencies(func, args_list):
+    """对每组参数调用一次 func 并分别计时，返回调用次数、每秒次数和延迟分位数（毫秒）。"""
+    for args in args_list[:WARMUP_QUERIES]:
+        func(*args)
+    samples = sorted(_timed(func, *args)[1] for args in args_list)
+    if not samples:
+        return {"samples": 0}
+
+    def percentile(p):
+        # 最近秩法：不小于 p 比例样本的最小值
+        return round(samples[max(0, math.ceil(p * len(samples)) - 1)] * 1000, 3)
+
+    total = sum(samples)
+    return {
+        "samples": len(samples),
+        "opsPerSecond": round(len(samples) / total) if total > 0 else None,
+        "meanMs": round(total / len(samples) * 1000, 3),
+        "p50Ms": percentile(0.50),
+        "p90Ms": percentile(0.90),
+        "p99Ms": percentile(0.99),
+        "maxMs": round(samples[-1] * 1000, 3),
+    }
+
+
+def write_pipeline_data(data_dir, count, user_count, seed=0, storage="json"):
+    """在 data_dir 中写出 users.json、rates.json 和 count 条通话记录（边生成边写出），返回 users 数据。"""
+    users, rates = make_reference_data(user_count, seed)
+    write_json_records(os.path.join(data_dir, "users.json"), "users", users["users"])
+    write_json_records(os.path.join(data_dir, "rates.json"), "longDistanceRates", rates["longDistanceRates"])
+    calls_name = "calls.jsonl" if storage == "jsonl" else "calls.json"
+    write_json_records(os.path.join(data_dir, calls_name), "callRecords", iter_calls(count, users, seed))
+    return users
+
+
+def bench_pipeline_size(data_dir, count, user_count, storage="json", in_memory=True, queries=DEFAULT_QUERY_SAMPLES,
+                        workers=1, seed=0, fees_format=FEES_FORMAT):
+    """在 data_dir 中测试 count 条通话记录的计费流程，返回结果字典。应在单独的进程中调用（会改动数据目录）。"""
+    os.makedirs(data_dir, exist_ok=True)
+    set_data_dir(data_dir)
+    users, generate_seconds = _timed(write_pipeline_data, data_dir, count, user_count, seed, storage)
+    calls_file = billing_core.CALLS_JSONL_FILE if storage == "jsonl" else billing_core.CALLS_FILE
+    result = {
+        "calls": count,
+        "users": user_count,
+        "callsFileBytes": os.path.getsize(calls_file),
+        "generate": _throughput(count, generate_seconds),
+    }
+
+    def read_calls():
+        return sum(len(batch) for batch in RecordStream(calls_file, "callRecords").batches(10000))
+
+    result["jsonLoad"] = _throughput(*_timed(read_calls))
+
+    billing, seconds = _timed(create_billing_system, storage, workers, in_memory, None, fees_format)
+    # 打开时没有费用文件会先计费一次，等它写完，免得与下面的全量计费争用磁盘
+    billing.flush()
+    result["open"] = _throughput(count, seconds)
+    rated, seconds = _timed(billing.compute_all_fees, True)
+    result["computeAllFees"] = _throughput(rated, seconds)
+    # 内存模式下费用文件由后台线程写出，这里是计费结束后还要等多久才写完
+    _, seconds = _timed(billing.flush)
+    result["feesFlush"] = _throughput(rated, seconds)
+    if os.path.exists(billing.fees_file):
+        result["feesFileBytes"] = os.path.getsize(billing.fees_file)
+
+    if getattr(billing, "calls", None) is not None:
+        # 把内存中的通话记录重新写成 JSON 文件，即 write_json_records 写出费用文件时的编码和写盘速度
+        save_path = os.path.join(data_dir, "save-test.json")
+        _, seconds = _timed(write_json_records, save_path, "callRecords", billing.calls, fees_format)
+        result["jsonSave"] = _throughput(count, seconds)
+        os.remove(save_path)
+
+    rng = random.Random(seed)
+    people = users["users"]
+    phones = [(rng.choice(people)["phoneNumber"],) for _ in range(queries)]
+    fragments = []
+    for _ in range(queries):
+        name = rng.choice(people)["userName"]
+        start = rng.randrange(len(name))
+        fragments.append((name[start:start + rng.randint(1, 2)],))
+    result["queryFeeSummary"] = _latencies(billing.query_fee_summary, phones)
+    result["queryCallRecords"] = _latencies(billing.query_call_records, phones)
+    result["findUsersByName"] = _latencies(billing.find_users_by_name, fragments)
+    result["peakRssBytes"] = _peak_rss_bytes()
+    return result
+
+
+def _median_result(results):
+    """几次运行的结果逐项合并：数值指标取中位数（整数取较小的中位数，仍为整数），其余字段取第一次的。"""
+    merged = {}
+    for key, value in results[0].items():
+        values = [result.get(key) for result in results]
+        if isinstance(value, dict) and all(isinstance(v, dict) for v in values):
+            merged[key] = _median_result(values)
+        elif all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+            if all(isinstance(v, int) for v in values):
+                median = statistics.median_low(values)
+            else:
+                median = statistics.median(values)
+            merged[key] = round(median, 4) if isinstance(median, float) else median
+        else:
+            merged[key] = value
+    return merged
+
+
+def bench_pipeline(sizes, data_dir=None, storage="json", in_memory=True, queries=DEFAULT_QUERY_SAMPLES,
+                   users=None, workers=1, seed=0, keep_data=False, fees_format=FEES_FORMAT, log=sys.stderr,
+                   repeat=DEFAULT_PIPELINE_REPEATS):
+    """
+    按 sizes 中的各个通话记录条数依次测试计费流程，返回可直接写成 JSON 的结果字典。
+    每种规模运行 repeat 次，各项指标取中位数。
+    data_dir 为 None 时使用临时目录并在结束后删除；每种规模使用 data_dir 下单独的子目录。
+    users 为 None 时用户数取通话记录条数的 1/100（至少 1000 个）。
+    """
+    temporary = data_dir is None
+    base_dir = tempfile.mkdtemp(prefix="billing-bench-") if temporary else os.path.abspath(data_dir)
+    report = {
+        "benchmark": "pipeline",
+        "startedAt": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpuCount": os.cpu_count(),
+        "numpy": billing_core.np is not None,
+        "storage": storage,
+        "inMemory": in_memory,
+        "workers": workers,
+        "feesFormat": fees_format,
+        "seed": seed,
+        "repeats": repeat,
+        "results": [],
+    }
+    try:
+        for count in sizes:
+            user_count = users or max(1000, count // 100)
+            size_dir = os.path.join(base_dir, f"calls-{count}")
+            runs = []
+            for _ in range(repeat):
+                # 每次从空目录开始（上一次留下的费用文件会让打开计费系统时不再计费）；
+                # 每次运行一个新进程：峰值内存只反映这一次，也不受上一次残留对象的影响
+                shutil.rmtree(size_dir, ignore_errors=True)
+                with ProcessPoolExecutor(max_workers=1) as pool:
+                    runs.append(pool.submit(bench_pipeline_size, size_dir, count, user_count, storage, in_memory,
+                                            queries, workers, seed, fees_format).result())
+            result = _median_result(runs)
+            report["results"].append(result)
+            if log is not None:
+                rss = result["peakRssBytes"]
+                log.write(f"{count} 条：计费 {result['computeAllFees']['recordsPerSecond']} 条/秒，"
+                          f"话单查询 p99 {result['queryCallRecords'].get('p99Ms')} 毫秒，"
+                          f"峰值内存 {'-' if rss is None else round(rss / 1048576)} MB\n")
+            if temporary or not keep_data:
+                shutil.rmtree(size_dir, ignore_errors=True)
+    finally:
+        if temporary:
+            shutil.rmtree(base_dir, ignore_errors=True)
+    return report
+
+
+def compare_pipeline(old, new, threshold=DEFAULT_REGRESSION_THRESHOLD):
+    """
+    按通话记录条数对应比较两次 pipeline 的结果，返回 [(条数, 指标, 原值, 新值, 变化比例, 是否改善, 是否退步), ...]。
+    变化比例按“变好为正”计算：吞吐量上升、延迟或内存下降为正，超过 threshold 时算改善或退步；
+    延迟相差不到 LATENCY_NOISE_MS 时是计时误差，两个方向都不算。
+    """
+    old_results = {r["calls"]: r for r in old.get("results", [])}
+    rows = []
+    for result in new.get("results", []):
+        before = old_results.get(result["calls"])
+        if before is None:
+            continue
+        for name, value, old_value in _comparable_metrics(before, result):
+            if name.rsplit(".", 1)[-1] in HIGHER_IS_BETTER:
+                change = value / old_value - 1
+            else:
+                change = old_value / value - 1 if value else 0.0
+            noise = name.endswith("Ms") and abs(value - old_value) < LATENCY_NOISE_MS
+            improved = not noise and change > threshold
+            regressed = not noise and change < -threshold
+            rows.append((result["calls"], name, old_value, value, round(change, 3), improved, regressed))
+    return rows
+
+
+def _comparable_metrics(before, after):
+    """两次结果中都有、可以比较的指标：(名称, 新值, 原值)。"""
+    for section, values in after.items():
+        if isinstance(values, dict):
+            for key, value in values.items():
+                old_value = before.get(section, {}).get(key)
+                if key in HIGHER_IS_BETTER + LOWER_IS_BETTER and value and old_value:
+                    yield f"{section}.{key}", value, old_value
+        elif section in LOWER_IS_BETTER and values and before.get(section):
+            yield section, values, before[section]
+
+
+def _parse_sizes(text):
+    try:
+        sizes = [int(float(part)) for part in text.split(",") if part.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"通话记录条数应为逗号分隔的整数（可写成 1e6）：{text}")
+    if not sizes or min(sizes) <= 0:
+        raise argparse.ArgumentTypeError(f"通话记录条数应为正整数：{text}")
+    return sizes
+
+
+# -------------------- 主程序入口 --------------------
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="计费系统性能测试")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    p_memory = subparsers.add_parser("memory", help="比较字典与按列存放的内存占用")
+    # tracemalloc 会让分配变慢很多，每条记录的平均占用在几万条时已经稳定
+    p_memory.add_argument("--records", type=int, default=50000, help="通话记录条数")
+    p_memory.add_argument("--users", type=int, default=10000, help="用户数")
+    p_rating = subparsers.add_parser("rating", help="比较写死的计费规则与编译后的资费方案的计费速度")
+    p_rating.add_argument("--records", type=int, default=200000, help="通话记录条数")
+    p_rating.add_argument("--users", type=int, default=10000, help="用户数")
+    p_pipeline = subparsers.add_parser("pipeline", help="测试数据文件读写、计费和查询的吞吐量、延迟和峰值内存")
+    p_pipeline.add_argument("--sizes", type=_parse_sizes, default=_parse_sizes(DEFAULT_PIPELINE_SIZES),
+                            help=f"逗号分隔的通话记录条数，如 1e3,1e5,1e7（默认 {DEFAULT_PIPELINE_SIZES}）")
+    p_pipeline.add_argument("--users", type=int, help="用户数，默认为通话记录条数的 1/100（至少 1000）")
+    p_pipeline.add_argument("--storage", choices=["json", "jsonl", "sqlite"], default="json", help="存储方式")
+    p_pipeline.add_argument("--streaming", action="store_true", help="使用流式模式（不在内存中保留通话记录）")
+    p_pipeline.add_argument("--queries", type=int, default=DEFAULT_QUERY_SAMPLES, help="每种查询测量的次数")
+    p_pipeline.add_argument("--repeat", type=int, default=DEFAULT_PIPELINE_REPEATS,
+                            help=f"每种规模运行的次数，各项指标取中位数（默认 {DEFAULT_PIPELINE_REPEATS}）")
+    p_pipeline.add_argument("--workers", type=int, default=1, help="全量计费的进程数")
+    p_pipeline.add_argument("--fees-format", choices=FEES_FORMATS, default=FEES_FORMAT, help="fees.json 的编码方式")
+    p_pipeline.add_argument("--seed", type=int, default=0, help="随机种子，相同时生成的数据相同")
+    p_pipeline.add_argument("--data-dir", help="存放生成数据的目录，默认使用临时目录")
+    p_pipeline.add_argument("--keep-data", action="store_true", help="测完保留 --data-dir 中生成的数据")
+    p_pipeline.add_argument("--output", help="结果 JSON 文件，默认输出到标准输出")
+    p_compare = subparsers.add_parser("compare", help="比较两次 pipeline 的结果，找出退步的指标")
+    p_compare.add_argument("old", help="原来的结果 JSON 文件")
+    p_compare.add_argument("new", help="新的结果 JSON 文件")
+    p_compare.add_argument("--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                           help="变差超过这个比例算作退步（默认 0.2）")
+    args = parser.parse_args(argv)
+
+    if args.command == "memory":
+        result = bench_memory(args.records, args.users)
+        print(f"通话记录 {result['records']} 条（含费用记录）")
+        print(f"  字典列表：每条 {result['dictBytesPerRecord']} 字节")
+        print(f"  按列存放：每条 {result['tableBytesPerRecord']} 字节")
+        print(f"  按列存放约为字典列表的 1/{result['ratio']}")
+    elif args.command == "rating":
+        result = bench_rating(args.records, args.users)
+        print(f"逐条计费 {result['records']} 条，每秒条数：")
+        print(f"  原来写死的规则：{result['hardCodedPerSecond']}")
+        print(f"  默认套餐：      {result['defaultPlanPerSecond']}（为原来的 {result['defaultPlanRatio']} 倍）")
+        print(f"  分档峰谷套餐：  {result['tieredPlanPerSecond']}")
+    elif args.command == "pipeline":
+        report = bench_pipeline(args.sizes, args.data_dir, args.storage, not args.streaming, args.queries,
+                                args.users, max(1, args.workers), args.seed, args.keep_data, args.fees_format,
+                                repeat=max(1, args.repeat))
+        text = json.dumps(report, ensure_ascii=False, indent=4)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                f.write(text + "\n")
+        else:
+            print(text)
+    elif args.command == "compare":
+        with open(args.old, encoding="utf-8") as f:
+            old = json.load(f)
+        with open(args.new, encoding="utf-8") as f:
+            new = json.load(f)
+        rows = compare_pipeline(old, new, args.threshold)
+        for calls, name, old_value, value, change, improved, regressed in rows:
+            mark = "退步" if regressed else ("改善" if improved else "")
+            print(f"{calls}\t{name}\t{old_value}\t{value}\t{change:+.1%}\t{mark}")
+        regressions = sum(1 for row in rows if row[-1])
+        print(f"共比较 {len(rows)} 项指标，退步 {regressions} 项（阈值 {args.threshold:.0%}）")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+模拟电信计费系统的命令行入口，不需要图形界面，适合在服务器的定时任务和批处理中使用。
+
+- rate           对新增通话记录计费（加 --full 则全部重新计费）
+- fee、calls 和 bills 查询前只对上次计费之后新增的通话记录计费，从不全量重算；
+  需要全量重算时（还没有计费过、资费数据有变化等）按现有费用查询，并在标准错误提示先运行 rate
+- fee <号码>     话费查询：本地、长途话费合计及总计
+- calls <号码>   话单查询：该号码作为主叫的全部通话
+- fee、calls 和 bills 可用 --month 指定计费月份，或用 --from / --to 指定任意时间段（含起始、不含结束）
+- users <姓名>   按姓名模糊查询用户
+- bills          批量出账：一次顺序扫描生成全部用户在计费周期内的账单（合计及通话明细），
+                 写成 CSV 或 JSON Lines 文件，并输出用时和吞吐量
+- 查询结果可用 --format 选择输出为文本表格、JSON 或 CSV
+- --metrics 在命令结束后输出各阶段（解析、计费、写出费用、各查询）的耗时统计（JSON），
+  --profile 另外打开 cProfile / tracemalloc 剖析（也可用环境变量 BILLING_PROFILE 打开）
+- --fees-format 选择 fees.json 的编码：indent（缩进，默认）、compact（不缩进）或 zlib（compact 再压缩）
+- 只导入 billing_core，不导入 tkinter，没有 X 显示也能运行
+- 使用流式模式，逐条读取通话记录和费用文件，通话记录再多也不会把整个文件读进内存
+
+用法示例：
+    python billing_cli.py rate --full --workers 4
+    python billing_cli.py --format csv calls 13800000001 > calls.csv
+    python billing_cli.py fee 13800000001 --month 2025-11
+    python billing_cli.py bills --month 2025-11 --output bills-2025-11.csv
+    python billing_cli.py --profile cprofile --metrics metrics.json rate --full
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+from billing_core import (
+    BILLING_STORAGE,
+    FEES_FORMAT,
+    FEES_FORMATS,
+    PROFILE_ENV,
+    SqliteBillingSystem,
+    create_billing_system,
+    month_period,
+    normalize_period_bound,
+    parse_profile_modes,
+)
+
+# 各子命令输出的列，顺序即 CSV 表头和文本表格的列顺序
+RATE_COLUMNS = ("records", "seconds", "output")
+FEE_COLUMNS = ("phoneNumber", "userName", "periodStart", "periodEnd", "localFee", "longDistanceFee", "totalFee")
+CALL_COLUMNS = ("userName", "callerNumber", "calleeNumber", "calleeName", "startTime", "durationSeconds",
+                "callType")
+USER_COLUMNS = ("userId", "userName", "phoneNumber")
+BILL_RUN_COLUMNS = ("users", "calls", "totalFee", "seconds", "usersPerSecond", "callsPerSecond", "output")
+
+
+# -------------------- 输出 --------------------
+
+def write_rows(rows, columns, fmt, out=None):
+    """按指定格式输出若干行结果（每行是一个字典），默认输出到标准输出。"""
+    out = out or sys.stdout
+    if fmt == "json":
+        json.dump(rows, out, ensure_ascii=False, indent=4)
+        out.write("\n")
+    elif fmt == "csv":
+        writer = csv.DictWriter(out, fieldnames=columns, extrasaction="ignore", lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(rows)
+    else:
+        out.write("\t".join(columns) + "\n")
+        for row in rows:
+            out.write("\t".join("" if row.get(c) is None else str(row.get(c)) for c in columns) + "\n")
+
+
+def write_metrics(billing, path):
+    """把计费系统的耗时统计（及剖析结果）写成 JSON；path 为 "-" 时写到标准错误，不与查询结果混在一起。"""
+    text = json.dumps(billing.metrics.report(), ensure_ascii=False, indent=4) + "\n"
+    if path == "-":
+        sys.stderr.write(text)
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+# -------------------- 子命令 --------------------
+
+def selected_period(args):
+    """由 --month / --from / --to 得到查询的 (起始时间, 结束时间)，不限的一端为 None。"""
+    if args.month:
+        return month_period(args.month)
+    return args.start, args.end
+
+
+def cmd_rate(billing, args):
+    started = time.time()
+    count = billing.compute_all_fees(full=args.full)
+    seconds = time.time() - started
+    output = billing.db_path if isinstance(billing, SqliteBillingSystem) else billing.fees_file
+    return [{"records": count, "seconds": round(seconds, 3), "output": output}], RATE_COLUMNS
+
+
+def rate_new_calls(billing):
+    """查询前只对新增的通话记录计费；需要全量重算时不在查询里做，留给 rate 子命令。"""
+    if billing.rate_new_calls() is None:
+        sys.stderr.write("提示：费用需要全量重新计费（还没有计费过、资费数据有变化或通话记录被改写），"
+                         "以下按现有费用查询，请运行 rate 子命令重新计费\n")
+
+
+def cmd_fee(billing, args):
+    rate_new_calls(billing)
+    start, end = selected_period(args)
+    user_name, local_sum, long_sum, total_sum = billing.query_fee_summary(args.phone, start, end)
+    row = {
+        "phoneNumber": args.phone,
+        "userName": user_name,
+        "periodStart": start,
+        "periodEnd": end,
+        "localFee": round(local_sum, 2),
+        "longDistanceFee": round(long_sum, 2),
+        "totalFee": round(total_sum, 2),
+    }
+    return [row], FEE_COLUMNS
+
+
+def cmd_calls(billing, args):
+    rate_new_calls(billing)
+    start, end = selected_period(args)
+    return billing.query_call_records(args.phone, start, end), CALL_COLUMNS
+
+
+def cmd_users(billing, args):
+    return billing.find_users_by_name(args.name), USER_COLUMNS
+
+
+def cmd_bills(billing, args):
+    rate_new_calls(billing)
+    start, end = selected_period(args)
+    report = billing.export_bills(args.output, start, end, itemized=not args.no_items)
+    return [report], BILL_RUN_COLUMNS
+
+
+def add_period_arguments(parser):
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--month", help="计费月份，格式 YYYY-MM")
+    group.add_argument("--from", dest="start", help="起始时间（包含），格式 YYYY-MM-DD [HH:MM:SS]")
+    parser.add_argument("--to", dest="end", help="结束时间（不包含），格式同 --from")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="模拟电信计费系统（命令行）")
+    parser.add_argument("--storage", choices=["auto", "json", "jsonl", "sqlite"], default=BILLING_STORAGE,
+                        help="通话记录与费用的存储方式")
+    parser.add_argument("--format", choices=["text", "json", "csv"], default="text",
+                        help="输出格式，默认为制表符分隔的文本表格")
+    parser.add_argument("--fees-format", choices=FEES_FORMATS, default=FEES_FORMAT,
+                        help="写出 fees.json 时的编码：indent 缩进、compact 不缩进、zlib 不缩进再压缩")
+    parser.add_argument("--metrics", metavar="PATH",
+                        help="命令结束后把各阶段的耗时统计写成 JSON 文件，\"-\" 表示写到标准错误")
+    parser.add_argument("--profile", metavar="MODES",
+                        help="打开剖析：cprofile、tracemalloc（逗号分隔）或 all；未给出时取环境变量 BILLING_PROFILE，"
+                             "打开剖析而未给出 --metrics 时结果写到标准错误")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p_rate = subparsers.add_parser("rate", help="对通话记录计费")
+    p_rate.add_argument("--full", action="store_true", help="全部通话记录重新计费，而不只是新增的")
+    p_rate.add_argument("--workers", type=int, default=1,
+                        help="全量重新计费时并行计费的进程数，默认 1 即不启用多进程")
+    p_rate.set_defaults(func=cmd_rate)
+
+    p_fee = subparsers.add_parser("fee", help="话费查询")
+    p_fee.add_argument("phone", help="电话号码")
+    add_period_arguments(p_fee)
+    p_fee.set_defaults(func=cmd_fee)
+
+    p_calls = subparsers.add_parser("calls", help="话单查询")
+    p_calls.add_argument("phone", help="电话号码")
+    add_period_arguments(p_calls)
+    p_calls.set_defaults(func=cmd_calls)
+
+    p_users = subparsers.add_parser("users", help="按姓名模糊查询用户")
+    p_users.add_argument("name", help="姓名或姓名的一部分")
+    p_users.set_defaults(func=cmd_users)
+
+    p_bills = subparsers.add_parser("bills", help="批量出账，生成全部用户的账单")
+    add_period_arguments(p_bills)
+    p_bills.add_argument("--output", default="bills.jsonl",
+                         help="账单文件，以 .csv 结尾时写成 CSV，否则写成 JSON Lines（默认 bills.jsonl）")
+    p_bills.add_argument("--no-items", action="store_true", help="只输出每个用户的合计，不带通话明细")
+    p_bills.set_defaults(func=cmd_bills)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if hasattr(args, "month"):
+        if args.month and args.end:
+            parser.error("--month 不能与 --to 同时使用")
+        try:
+            selected_period(args)
+            normalize_period_bound(args.start)
+            normalize_period_bound(args.end)
+        except ValueError as e:
+            parser.error(str(e))
+    try:
+        profile = parse_profile_modes(args.profile if args.profile is not None else os.environ.get(PROFILE_ENV))
+    except ValueError as e:
+        parser.error(str(e))
+    workers = max(1, getattr(args, "workers", 1))
+    billing = create_billing_system(args.storage, workers=workers, in_memory=False, profile=profile,
+                                    fees_format=args.fees_format)
+    rows, columns = args.func(billing, args)
+    write_rows(rows, columns, args.format)
+    metrics = args.metrics or ("-" if billing.metrics.profile else None)
+    if metrics:
+        write_metrics(billing, metrics)
+
+
+# -------------------- 主程序入口 --------------------
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2974 @@
+"""
+模拟电信计费系统的计费核心：数据文件、计费、存储与后台计费线程。
+不依赖 tkinter，图形界面（P23000626-B2.py）和命令行（billing_cli.py）都从这里导入。
+"""
+import base64
+import codecs
+import cProfile
+import csv
+import ctypes
+import ctypes.util
+import functools
+import gzip
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import math
+import os
+import pstats
+import queue
+import re
+import select
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import tracemalloc
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 是可选的，没有安装时批量计费退回逐条计算
+    np = None
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，file_lock 不加锁
+    fcntl = None
+
+# -------------------- 文件路径设置 --------------------
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+USERS_FILE = os.path.join(BASE_DIR, "users.json")
+RATES_FILE = os.path.join(BASE_DIR, "rates.json")
+# 资费方案（可选）：峰谷时段、分档计价和按用户选择的套餐，没有这个文件时按原来的固定规则计费
+TARIFFS_FILE = os.path.join(BASE_DIR, "tariffs.json")
+CALLS_FILE = os.path.join(BASE_DIR, "calls.json")
+FEES_FILE = os.path.join(BASE_DIR, "fees.json")
+# JSON Lines 格式（每行一条记录，只追加写入），可用“通话记录格式转换.py”从上面两个文件转换得到
+CALLS_JSONL_FILE = os.path.join(BASE_DIR, "calls.jsonl")
+FEES_JSONL_FILE = os.path.join(BASE_DIR, "fees.jsonl")
+# SQLite 数据库（存储方式为 "sqlite" 时使用），数据从上面的 JSON 文件导入
+DB_FILE = os.path.join(BASE_DIR, "billing.db")
+
+# 计费系统的存储方式："auto"、"json"、"jsonl" 或 "sqlite"
+BILLING_STORAGE = "auto"
+# fees.json 的编码方式（见 FEES_FORMATS），fees.jsonl 不受影响
+FEES_FORMAT = "indent"
+
+
+def set_data_dir(path):
+    """把上面各数据文件的位置改到 path 目录下（文件名不变），之后新建的 BillingSystem 都使用这个目录。"""
+    global BASE_DIR, USERS_FILE, RATES_FILE, TARIFFS_FILE, CALLS_FILE, FEES_FILE
+    global CALLS_JSONL_FILE, FEES_JSONL_FILE, DB_FILE
+    BASE_DIR = os.path.abspath(path)
+    USERS_FILE = os.path.join(BASE_DIR, "users.json")
+    RATES_FILE = os.path.join(BASE_DIR, "rates.json")
+    TARIFFS_FILE = os.path.join(BASE_DIR, "tariffs.json")
+    CALLS_FILE = os.path.join(BASE_DIR, "calls.json")
+    FEES_FILE = os.path.join(BASE_DIR, "fees.json")
+    CALLS_JSONL_FILE = os.path.join(BASE_DIR, "calls.jsonl")
+    FEES_JSONL_FILE = os.path.join(BASE_DIR, "fees.jsonl")
+    DB_FILE = os.path.join(BASE_DIR, "billing.db")
+
+
+# -------------------- 初始化示例数据 --------------------
+
+def init_sample_data():
+    """如果 JSON 文件不存在，则创建一些示例数据，方便测试。"""
+    if not os.path.exists(USERS_FILE):
+        users = {
+            "users": [
+                {"userId": "U001", "userName": "张三", "phoneNumber": "13800000001"},
+                {"userId": "U002", "userName": "李四", "phoneNumber": "13800000002"},
+                {"userId": "U003", "userName": "王五", "phoneNumber": "01088880000"},
+                {"userId": "U004", "userName": "张三丰", "phoneNumber": "13900000003"}
+            ]
+        }
+        with open(USERS_FILE, "w", encoding="utf-8") as f:
+            json.dump(users, f, ensure_ascii=False, indent=4)
+
+    if not os.path.exists(RATES_FILE):
+        rates = {
+            "longDistanceRates": [
+                {"areaCode": "010", "areaName": "北京", "ratePerMinute": 0.60},
+                {"areaCode": "021", "areaName": "上海", "ratePerMinute": 0.65},
+                {"areaCode": "020", "areaName": "广州", "ratePerMinute": 0.70}
+            ]
+        }
+        with open(RATES_FILE, "w", encoding="utf-8") as f:
+            json.dump(rates, f, ensure_ascii=False, indent=4)
+
+    if not os.path.exists(CALLS_FILE) and not os.path.exists(CALLS_JSONL_FILE):
+        calls = {
+            "callRecords": [
+                {
+                    "callId": "C001",
+                    "callerNumber": "13800000001",
+                    "calleeNumber": "01088880000",
+                    "startTime": "2025-11-18 09:00:10",
+                    "durationSeconds": 125,  # 2分5秒 -> 3分钟
+                    "callType": "long-distance",
+                    "longDistanceAreaCode": "010"
+                },
+                {
+                    "callId": "C002",
+                    "callerNumber": "13800000001",
+                    "calleeNumber": "13800000002",
+                    "startTime": "2025-11-18 10:15:05",
+                    "durationSeconds": 170,  # 2分50秒 -> 3分钟
+                    "callType": "local",
+                    "longDistanceAreaCode": None
+                },
+                {
+                    "callId": "C003",
+                    "callerNumber": "13800000002",
+                    "calleeNumber": "02166668888",
+                    "startTime": "2025-11-18 11:20:30",
+                    "durationSeconds": 59,   # 0分59秒 -> 1分钟
+                    "callType": "long-distance",
+                    "longDistanceAreaCode": "021"
+                }
+            ]
+        }
+        with open(CALLS_FILE, "w", encoding="utf-8") as f:
+            json.dump(calls, f, ensure_ascii=False, indent=4)
+
+
+# -------------------- 文件读写工具 --------------------
+
+def file_signature(path):
+    """返回文件的 (修改时间, 大小)，文件不存在时返回 None。"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+@contextmanager
+def file_lock(path, exclusive=False):
+    """
+    对 path 加建议锁（flock 锁住旁边的 path + ".lock" 文件，数据文件被原子替换后锁仍然有效）。
+    通话记录的读写约定：
+    - 写入方（通话记录生成器）持有排他锁写入一批记录，写完才释放；文件只在末尾追加，
+      原处改写的只能是文件最后 SNAPSHOT_TAIL_BYTES 个字节以内的内容（JSON 文件结尾的 "]}"）
+    - 要改写更前面的内容时不能原处修改，只能写到临时文件后用 os.replace 整体替换
+    - 读取方持共享锁取得已提交的长度（和最后一段字节，见 RecordStream 的 locked），
+      因此只会看到完整提交的若干批记录，不会读到写了一半的文件
+    没有 fcntl（Windows）或无法创建锁文件时不加锁。
+    """
+    try:
+        f = open(path + ".lock", "a") if fcntl is not None else None
+    except OSError:
+        f = None
+    if f is None:
+        yield
+        return
+    with f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+# fees.json 的编码方式：
+# - "indent"：与 json.dump(..., ensure_ascii=False, indent=4) 完全相同，便于直接阅读
+# - "compact"：不缩进、分隔符后不留空格，每条记录一行，文件大小和编码时间都约为 indent 的一半
+# - "zlib"：compact 的内容再经 zlib 压缩（gzip 封装，可用 zcat 查看），读取时按文件头自动识别；
+#   增量计费追加的每批记录各是一个 gzip 成员，整体重写时再合成一个
+FEES_FORMATS = ("indent", "compact", "zlib")
+# zlib 的压缩级别：费用记录重复很多，最快的 1 级已经能压到很小
+FEES_COMPRESS_LEVEL = 1
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def open_record_file(path):
+    """以二进制方式打开记录文件；gzip 压缩的文件（按文件头识别）返回解压后的内容。"""
+    f = open(path, "rb")
+    if f.peek(len(GZIP_MAGIC))[:len(GZIP_MAGIC)] != GZIP_MAGIC:
+        return f
+    f.close()
+    return gzip.open(path, "rb")
+
+
+def parse_jsonl(data: bytes):
+    """
+    解析 JSON Lines 字节串，返回 (记录列表, 已解析的字节数)。
+    最后一行如果还没写完（没有换行符）就先不解析，留到下次再读。
+    """
+    end = data.rfind(b"\n") + 1
+    records = [json.loads(line) for line in data[:end].splitlines() if line.strip()]
+    return records, end
+
+
+def write_jsonl_atomic(path, records):
+    """先写临时文件再原子替换，读者不会看到写了一半的文件。"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False))
+            f.write("\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def append_jsonl(path, records):
+    """把记录逐行追加到 JSON Lines 文件末尾，已有内容不会被重写。"""
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records))
+
+
+# json.dump(..., indent=4) 写出的 {key: [...]} 文件中，记录内各项之间的分隔
+_RECORD_ITEM_SEPARATOR = ",\n" + " " * 12
+
+
+def dump_indented_record(record):
+    """
+    返回记录在 json.dump(..., ensure_ascii=False, indent=4) 写出的 {key: [...]} 文件中的文本（带 8 格缩进）。
+    取值都是标量的记录用 C 实现的编码器一次写出，结果相同但比带 indent 的纯 Python 编码快得多。
+    """
+    if record and not any(isinstance(v, (dict, list, tuple)) for v in record.values()):
+        text = json.dumps(record, ensure_ascii=False, separators=(_RECORD_ITEM_SEPARATOR, ": "))
+        return "        {\n            " + text[1:-1] + "\n        }"
+    # 字符串中的换行都被转义了，文本中的 "\n" 只会是缩进排版产生的换行
+    # （textwrap.indent 还会把 \u2028 等字符当作换行，结果与 json.dump 不同）
+    return "        " + json.dumps(record, ensure_ascii=False, indent=4).replace("\n", "\n        ")
+
+
+def dump_compact_record(record):
+    """返回记录在 compact 编码的 {key: [...]} 文件中的文本：不缩进，分隔符后不留空格。"""
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+
+
+# 各编码方式的 {key: [...]} 文件中，数组非空时的结尾、数组为空时的结尾，以及单条记录的编码函数
+_JSON_RECORD_LAYOUTS = {
+    "indent": ("\n    ]\n}", "]\n}", dump_indented_record),
+    "compact": ("\n]}", "]}", dump_compact_record),
+}
+
+
+def write_json_records(path, key, records, encoding="indent"):
+    """
+    把记录逐条写成 {key: [...]} 布局的 JSON 文件（.jsonl 文件则每行一条），encoding 见 FEES_FORMATS；
+    默认的 "indent" 与 json.dump(..., ensure_ascii=False, indent=4) 写出的完全一致。
+    records 可以是生成器，不需要把全部记录放进内存；先写临时文件再原子替换。
+    """
+    if path.endswith(".jsonl"):
+        write_jsonl_atomic(path, records)
+        return
+    if encoding not in FEES_FORMATS:
+        raise ValueError(f"未知的编码方式：{encoding}")
+    closing, empty_closing, dump = _JSON_RECORD_LAYOUTS["indent" if encoding == "indent" else "compact"]
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as raw:
+        # gzip 头部不记文件名和修改时间：内容相同时写出的字节也相同
+        binary = gzip.GzipFile("", "wb", FEES_COMPRESS_LEVEL, raw, mtime=0) if encoding == "zlib" else raw
+        with binary, io.TextIOWrapper(binary, encoding="utf-8") as f:
+            key_text = json.dumps(key, ensure_ascii=False)
+            f.write("{\n    " + key_text + ": [" if encoding == "indent" else "{" + key_text + ":[")
+            first = True
+            for record in records:
+                f.write("\n" if first else ",\n")
+                f.write(dump(record))
+                first = False
+            end = empty_closing if first else closing
+            if binary is raw:
+                f.write(end)
+        if binary is not raw:
+            # 压缩时结尾单独写成一个 gzip 成员，追加记录时只需替换这个成员（见 BillingSystem._append_json_rows）
+            raw.write(gzip_member(end.encode("utf-8")))
+    os.replace(tmp_path, path)
+
+
+def gzip_member(data):
+    """把 data 压缩成一个 gzip 成员；头部不记修改时间，同样的内容总是得到同样的字节。"""
+    return gzip.compress(data, compresslevel=FEES_COMPRESS_LEVEL, mtime=0)
+
+
+# 跳过 JSON 空白字符，流式解析和解析 calls.json 尾部新增记录时使用
+_JSON_WS = re.compile(r"[ \t\n\r]*")
+
+# 流式读取记录文件时每次读入的字节数
+STREAM_CHUNK_SIZE = 1 << 20
+# 持锁读取 JSON 文件时，随长度一起保存下来的文件末尾字节数；
+# 写入方追加记录时只改写最后一条记录之后的 "]}"，这部分之前的内容不会再变（见 file_lock 的约定）
+SNAPSHOT_TAIL_BYTES = 4096
+
+
+class _FileSnapshot:
+    """
+    文件在取快照时的内容（只读前 size 个字节）：前 size - len(tail) 个字节之后不会被改写，直接从文件中读，
+    其余部分用取快照时一并读出的 tail。只提供 RecordStream 用到的 read 和 seek。
+    """
+
+    def __init__(self, f, size, tail):
+        self._file = f
+        self._stable = size - len(tail)
+        self._tail = tail
+        self._pos = 0
+        f.seek(0)
+
+    def read(self, n=-1):
+        data = b""
+        if self._pos < self._stable:
+            want = self._stable - self._pos if n < 0 else min(n, self._stable - self._pos)
+            data = self._file.read(want)
+            self._pos += len(data)
+            if len(data) < want:
+                return data
+            if n >= 0:
+                n -= len(data)
+        if self._pos >= self._stable and n != 0:
+            k = self._pos - self._stable
+            chunk = self._tail[k:] if n < 0 else self._tail[k:k + n]
+            self._pos += len(chunk)
+            data += chunk
+        return data
+
+    def seek(self, pos):
+        self._pos = pos
+        self._file.seek(min(pos, self._stable))
+        return pos
+
+
+class RecordStream:
+    """
+    流式逐条读取记录文件：{key: [...]} 布局的 JSON 文件，或每行一条记录的 JSON Lines 文件。
+    内存中只有一块读缓冲区和正在解析的记录，不会像 json.load 那样把整个文件和全部记录一次读进来。
+
+    遍历结束后：
+    - end_offset：最后一条完整记录结束处的字节偏移（JSON 数组为空时为 "[" 之后，
+      JSON Lines 为最后一个换行之后）；JSON 文件中这个数组后面还有别的键、无法原处追加时为 None
+    - tail：end_offset 之前最多 tail_size 个字节，增量续读时用来确认已读部分没有被改写
+    JSON Lines 文件最后一行还没写完时先不读它，与 parse_jsonl 一致。
+
+    locked=True 时按 file_lock 的约定读取正在被写入的文件：持共享锁取得已提交的长度后即释放，只读到这里为止，
+    解析和调用方处理记录期间都不持锁，不会挡住写入方。JSON 文件的结尾 "]}" 会被写入方原处改写，
+    取长度时一并读出最后 SNAPSHOT_TAIL_BYTES 个字节，解析到这里时用读出的内容。
+    """
+
+    def __init__(self, path, key=None, tail_size=0, chunk_size=STREAM_CHUNK_SIZE, locked=False):
+        self.path = path
+        self.key = key
+        self.tail_size = tail_size
+        self.chunk_size = chunk_size
+        self.locked = locked
+        self.end_offset = None
+        self.tail = b""
+
+    def __iter__(self):
+        jsonl = self.path.endswith(".jsonl")
+        with open_record_file(self.path) as f:
+            if self.locked and not isinstance(f, gzip.GzipFile):
+                f = self._snapshot(f, jsonl)
+            if jsonl:
+                yield from self._iter_jsonl(f)
+            else:
+                yield from self._iter_json(f)
+            if self.tail_size and self.end_offset is not None:
+                start = max(0, self.end_offset - self.tail_size)
+                f.seek(start)
+                self.tail = f.read(self.end_offset - start)
+
+    def batches(self, size):
+        """按每批最多 size 条产出记录列表。"""
+        batch = []
+        for record in self:
+            batch.append(record)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _snapshot(self, f, jsonl):
+        """持共享锁取得文件已提交的长度（JSON 文件还有末尾的一段字节），返回只读到这里的 _FileSnapshot。"""
+        with file_lock(self.path):
+            size = os.fstat(f.fileno()).st_size
+            tail = b""
+            if not jsonl:
+                f.seek(max(0, size - SNAPSHOT_TAIL_BYTES))
+                tail = f.read(size - f.tell())
+        return _FileSnapshot(f, size, tail)
+
+    def _iter_jsonl(self, f):
+        offset = 0
+        buffer = b""
+        while True:
+            chunk = f.read(self.chunk_size)
+            if not chunk:
+                break
+            records, consumed = parse_jsonl(buffer + chunk)
+            buffer = (buffer + chunk)[consumed:]
+            offset += consumed
+            yield from records
+        self.end_offset = offset
+
+    # ---------- JSON 文件的增量解析 ----------
+    # 解析位置 _pos 是已读入文本 _text 中的下标，_text[0] 在文件中的字节偏移为 _base；
+    # 读入新的一块时丢弃 _pos 之前已解析的文本，缓冲区始终只有一块左右大小。
+    # _mark 标记最后一条记录结束的位置，被丢弃前先换算成字节偏移存入 _mark_offset。
+
+    def _iter_json(self, f):
+        self._file = f
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._text = ""
+        self._pos = 0
+        self._base = 0
+        self._eof = False
+        self._mark = None
+        self._mark_offset = None
+        decoder = json.JSONDecoder()
+        end_offset = None
+
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+        else:
+            while True:
+                if self._peek() != '"':
+                    raise self._error("Expecting property name enclosed in double quotes")
+                key = self._value(decoder)
+                self._expect(":")
+                if key == self.key and self._peek() == "[":
+                    self._pos += 1
+                    self._mark = self._pos
+                    if self._peek() == "]":
+                        self._pos += 1
+                    else:
+                        while True:
+                            yield self._value(decoder)
+                            self._mark = self._pos
+                            if self._expect(",]") == "]":
+                                break
+                    end_offset = self._marked_offset()
+                else:
+                    self._value(decoder)
+                if self._expect(",}") == "}":
+                    break
+                # 数组后面还有别的键，新记录不能直接追加在数组末尾
+                end_offset = None
+        if self._peek():
+            raise self._error("Extra data")
+        self.end_offset = end_offset
+
+    def _more(self):
+        """丢弃已解析的文本并读入下一块；文件已经读完时返回 False。"""
+        if self._eof:
+            return False
+        if self._pos:
+            if self._mark is not None:
+                self._mark_offset = self._base + len(self._text[:self._mark].encode("utf-8"))
+                self._mark = None
+            self._base += len(self._text[:self._pos].encode("utf-8"))
+            self._text = self._text[self._pos:]
+            self._pos = 0
+        chunk = self._file.read(self.chunk_size)
+        self._eof = not chunk
+        self._text += self._utf8.decode(chunk, final=self._eof)
+        return not self._eof
+
+    def _marked_offset(self):
+        if self._mark is None:
+            return self._mark_offset
+        return self._base + len(self._text[:self._mark].encode("utf-8"))
+
+    def _peek(self):
+        """跳过空白，返回下一个字符；文件已结束时返回空串。"""
+        while True:
+            self._pos = _JSON_WS.match(self._text, self._pos).end()
+            if self._pos < len(self._text):
+                return self._text[self._pos]
+            if not self._more():
+                return ""
+
+    def _expect(self, chars):
+        """下一个字符必须是 chars 中的一个，跳过它并返回。"""
+        c = self._peek()
+        if not c or c not in chars:
+            raise self._error("Expecting " + " or ".join(repr(ch) for ch in chars))
+        self._pos += 1
+        return c
+
+    def _value(self, decoder):
+        """解析当前位置的一个 JSON 值；缓冲区中的内容不完整时读入下一块再解析。"""
+        self._peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self._text, self._pos)
+            except json.JSONDecodeError:
+                if self._more():
+                    continue
+                raise
+            # 数字之类的值可能恰好在缓冲区末尾被截断，读入更多内容后重新解析
+            if end == len(self._text) and self._more():
+                continue
+            self._pos = end
+            return value
+
+    def _error(self, msg):
+        return json.JSONDecodeError(msg, self._text, self._pos)
+
+
+# -------------------- 紧凑记录存储 --------------------
+
+# 通话记录与费用记录的字段顺序，与 JSON 文件中的键一致
+CALL_FIELDS = ("callId", "callerNumber", "calleeNumber", "startTime",
+               "durationSeconds", "callType", "longDistanceAreaCode")
+FEE_FIELDS = ("callId", "callerNumber", "calleeNumber", "userName",
+              "localFee", "longDistanceFee", "totalFee")
+
+# 通话开始时间的格式 "YYYY-MM-DD HH:MM:SS"
+_START_TIME = re.compile(r"(\d{4})-(\d{2})-(\d{2}) (\d{2}):(\d{2}):(\d{2})", re.ASCII)
+_INT64_MAX = (1 << 63) - 1
+
+
+def pack_start_time(text):
+    """把 "YYYY-MM-DD HH:MM:SS" 编码为整数 YYYYMMDDhhmmss，大小顺序与时间先后一致；格式不符时返回 None。"""
+    m = _START_TIME.fullmatch(text) if type(text) is str else None
+    if m is None:
+        return None
+    return int("".join(m.groups()))
+
+
+def unpack_start_time(value):
+    """pack_start_time 的逆运算。"""
+    t = "%014d" % value
+    return f"{t[0:4]}-{t[4:6]}-{t[6:8]} {t[8:10]}:{t[10:12]}:{t[12:14]}"
+
+
+class StringPool:
+    """
+    字符串编号表：号码、区号、用户名这类大量重复的字符串只保存一份，记录中只存 4 字节的编号。
+    编号 0 固定表示 None。
+    """
+
+    __slots__ = ("values", "_ids")
+
+    def __init__(self):
+        self.values = [None]
+        self._ids = {None: 0}
+
+    def __len__(self):
+        return len(self.values)
+
+    def id(self, value):
+        i = self._ids.get(value)
+        if i is None:
+            i = self._ids[value] = len(self.values)
+            self.values.append(value)
+        return i
+
+
+# 可以编入 StringPool 的取值类型
+_POOLABLE_TYPES = (str, type(None))
+# 不能按列存放的记录原样另存，列中填入这些占位值
+_PLACEHOLDER_CALL = dict(dict.fromkeys(CALL_FIELDS, ""), durationSeconds=0)
+_PLACEHOLDER_FEE = dict(dict.fromkeys(FEE_FIELDS), localFee=0.0, longDistanceFee=0.0)
+
+
+def _is_regular_call(call):
+    """通话记录的键（包括顺序）与 CALL_FIELDS 相同，且各字段的取值都能按列存放。"""
+    duration = call["durationSeconds"] if tuple(call) == CALL_FIELDS else None
+    return (type(duration) is int and -_INT64_MAX <= duration <= _INT64_MAX
+            and type(call["callId"]) is str
+            and type(call["callerNumber"]) in _POOLABLE_TYPES
+            and type(call["calleeNumber"]) in _POOLABLE_TYPES
+            and type(call["callType"]) in _POOLABLE_TYPES
+            and type(call["longDistanceAreaCode"]) in _POOLABLE_TYPES)
+
+
+class CallTable:
+    """
+    按列存放的通话记录，代替每条一个字典的 callRecords 列表：
+    - 主叫、被叫号码，通话类型和区号存为 StringPool 编号（array 中每条 4 字节）
+    - 开始时间编码为整数（不能编码的记为 -1），通话时长存为 64 位整数，只有 callId 保留为字符串
+    - 键或取值类型与 JSON 文件的常规布局不同的记录原样保存，取出时与原记录完全相同
+    下标访问和遍历得到的仍是与 JSON 中相同的字典，每次取用时临时构造。
+    """
+
+    __slots__ = ("phones", "labels", "call_ids", "callers", "callees", "start_times",
+                 "durations", "call_types", "area_codes", "_irregular")
+
+    def __init__(self):
+        self.phones = StringPool()
+        self.labels = StringPool()
+        self.call_ids = []
+        self.callers = array("I")
+        self.callees = array("I")
+        self.start_times = array("q")
+        self.durations = array("q")
+        self.call_types = array("I")
+        self.area_codes = array("I")
+        self._irregular = {}
+
+    def __len__(self):
+        return len(self.call_ids)
+
+    def extend(self, records):
+        records = list(records)
+        start = len(self.call_ids)
+        start_times = [pack_start_time(call.get("startTime")) for call in records]
+        for j, call in enumerate(records):
+            if start_times[j] is None or not _is_regular_call(call):
+                self._irregular[start + j] = dict(call)
+                records[j] = _PLACEHOLDER_CALL
+                if start_times[j] is None:
+                    start_times[j] = -1
+        # 逐列追加，比逐条追加到每一列快得多
+        phone_id = self.phones.id
+        label_id = self.labels.id
+        self.call_ids.extend([call["callId"] for call in records])
+        self.callers.extend([phone_id(call["callerNumber"]) for call in records])
+        self.callees.extend([phone_id(call["calleeNumber"]) for call in records])
+        self.start_times.extend(start_times)
+        self.durations.extend([call["durationSeconds"] for call in records])
+        self.call_types.extend([label_id(call["callType"]) for call in records])
+        self.area_codes.extend([label_id(call["longDistanceAreaCode"]) for call in records])
+
+    def __getitem__(self, i):
+        call = self._irregular.get(i)
+        if call is not None:
+            return dict(call)
+        phones = self.phones.values
+        labels = self.labels.values
+        return {
+            "callId": self.call_ids[i],
+            "callerNumber": phones[self.callers[i]],
+            "calleeNumber": phones[self.callees[i]],
+            "startTime": unpack_start_time(self.start_times[i]),
+            "durationSeconds": self.durations[i],
+            "callType": labels[self.call_types[i]],
+            "longDistanceAreaCode": labels[self.area_codes[i]]
+        }
+
+    def __iter__(self):
+        for i in range(len(self.call_ids)):
+            yield self[i]
+
+
+class FeeTable:
+    """
+    与 CallTable 逐条对应的费用记录，按列只存本地话费、长途话费（各 8 字节）和主叫用户名编号：
+    callId 和号码取自同一下标的通话记录，总费用按 round(本地 + 长途, 2) 还原，与 rate_call 的算法相同。
+    与这些约定不符的费用记录原样保存。
+    """
+
+    __slots__ = ("calls", "names", "user_names", "local_fees", "long_fees", "_irregular")
+
+    def __init__(self, calls):
+        self.calls = calls
+        self.names = StringPool()
+        self.user_names = array("I")
+        self.local_fees = array("d")
+        self.long_fees = array("d")
+        self._irregular = {}
+
+    def __len__(self):
+        return len(self.local_fees)
+
+    def extend(self, rows):
+        """追加费用记录；对应的通话记录必须已经追加到 calls 中。"""
+        rows = list(rows)
+        start = len(self.local_fees)
+        for j, fee in enumerate(rows):
+            if not self._is_regular_fee(fee, start + j):
+                self._irregular[start + j] = dict(fee)
+                rows[j] = _PLACEHOLDER_FEE
+        name_id = self.names.id
+        self.user_names.extend([name_id(fee["userName"]) for fee in rows])
+        self.local_fees.extend([fee["localFee"] for fee in rows])
+        self.long_fees.extend([fee["longDistanceFee"] for fee in rows])
+
+    def amounts(self, i):
+        """第 i 条费用记录的 (本地话费, 长途话费)。"""
+        fee = self._irregular.get(i)
+        if fee is not None:
+            return float(fee.get("localFee", 0.0)), float(fee.get("longDistanceFee", 0.0))
+        return self.local_fees[i], self.long_fees[i]
+
+    def _is_regular_fee(self, fee, i):
+        """费用记录的键与 FEE_FIELDS 相同，总费用和 callId、号码都能从各列还原。"""
+        if tuple(fee) != FEE_FIELDS:
+            return False
+        local_fee = fee["localFee"]
+        long_fee = fee["longDistanceFee"]
+        total_fee = fee["totalFee"]
+        calls = self.calls
+        phones = calls.phones.values
+        return (type(local_fee) is float and type(long_fee) is float and type(total_fee) is float
+                and total_fee == round(local_fee + long_fee, 2)
+                and type(fee["userName"]) in _POOLABLE_TYPES
+                and i not in calls._irregular
+                and fee["callId"] == calls.call_ids[i]
+                and fee["callerNumber"] == phones[calls.callers[i]]
+                and fee["calleeNumber"] == phones[calls.callees[i]])
+
+    def __getitem__(self, i):
+        fee = self._irregular.get(i)
+        if fee is not None:
+            return dict(fee)
+        calls = self.calls
+        phones = calls.phones.values
+        local_fee = self.local_fees[i]
+        long_fee = self.long_fees[i]
+        return {
+            "callId": calls.call_ids[i],
+            "callerNumber": phones[calls.callers[i]],
+            "calleeNumber": phones[calls.callees[i]],
+            "userName": self.names.values[self.user_names[i]],
+            "localFee": local_fee,
+            "longDistanceFee": long_fee,
+            "totalFee": round(local_fee + long_fee, 2)
+        }
+
+    def __iter__(self):
+        for i in range(len(self.local_fees)):
+            yield self[i]
+
+
+# -------------------- 计费周期 --------------------
+
+_DATE = re.compile(r"\d{4}-\d{2}-\d{2}", re.ASCII)
+_MONTH = re.compile(r"(\d{4})-(\d{2})", re.ASCII)
+
+
+def normalize_period_bound(text):
+    """
+    把时间段的起止时间规范为 "YYYY-MM-DD HH:MM:SS"：只写日期时取当天 0 点，None 或空串表示不限。
+    格式不对时抛出 ValueError。
+    """
+    if text is None or not text.strip():
+        return None
+    text = text.strip()
+    if _DATE.fullmatch(text):
+        text += " 00:00:00"
+    if pack_start_time(text) is None:
+        raise ValueError(f"时间格式应为 YYYY-MM-DD 或 YYYY-MM-DD HH:MM:SS：{text}")
+    return text
+
+
+def month_period(month):
+    """
+    计费月份 "YYYY-MM" 对应的时间段 (起始时间, 结束时间)。
+    与各查询接口的约定一致：包含起始时间，不包含结束时间（下月 1 日 0 点）。
+    """
+    m = _MONTH.fullmatch(month.strip())
+    if m is None or not 1 <= int(m.group(2)) <= 12:
+        raise ValueError(f"月份格式应为 YYYY-MM：{month}")
+    year, mon = int(m.group(1)), int(m.group(2))
+    next_year, next_mon = (year + 1, 1) if mon == 12 else (year, mon + 1)
+    return f"{year:04d}-{mon:02d}-01 00:00:00", f"{next_year:04d}-{next_mon:02d}-01 00:00:00"
+
+
+def _period_keys(start, end):
+    """把规范化后的起止时间换成 pack_start_time 的整数区间 [lo, hi)，不限时取最小、最大值。"""
+    lo = pack_start_time(start) if start is not None else 0
+    hi = pack_start_time(end) if end is not None else _INT64_MAX
+    return lo, hi
+
+
+# -------------------- 姓名索引 --------------------
+
+_NO_NAMES = frozenset()
+
+
+class NameIndex:
+    """
+    用户姓名的子串索引：姓名中的每个字、每两个相邻的字 → 含有它的姓名集合（同名用户只记一次）。
+    - 查一个字时直接取该字的集合；查两个字以上时对查询串中各个相邻两字的集合求交集（从最小的开始），
+      超过两个字时再确认交集中的姓名确实包含整个查询串（各个两字组都出现不代表它们依次相连）
+    - add / discard 按姓名增量维护，users.json 变化时只处理新增和消失的姓名
+    """
+
+    def __init__(self, names=()):
+        self._postings = {}
+        self._names = set()
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, name):
+        return name in self._names
+
+    @property
+    def names(self):
+        return self._names
+
+    @staticmethod
+    def _grams(name):
+        return set(name).union(name[i:i + 2] for i in range(len(name) - 1))
+
+    def add(self, name):
+        if not isinstance(name, str) or name in self._names:
+            return
+        self._names.add(name)
+        for gram in self._grams(name):
+            postings = self._postings.get(gram)
+            if postings is None:
+                self._postings[gram] = {name}
+            else:
+                postings.add(name)
+
+    def discard(self, name):
+        if name not in self._names:
+            return
+        self._names.remove(name)
+        for gram in self._grams(name):
+            postings = self._postings[gram]
+            postings.discard(name)
+            if not postings:
+                del self._postings[gram]
+
+    def search(self, text):
+        """返回包含 text 的全部姓名（新的集合，调用方可以随意修改）。text 为空串时返回空集合。"""
+        if not text:
+            return set()
+        if len(text) == 1:
+            return set(self._postings.get(text, _NO_NAMES))
+        postings = sorted((self._postings.get(text[i:i + 2], _NO_NAMES) for i in range(len(text) - 1)), key=len)
+        matches = postings[0].intersection(*postings[1:])
+        if len(text) > 2:
+            matches = {name for name in matches if text in name}
+        return matches
+
+
+# -------------------- 资费方案 --------------------
+
+# 没有 tariffs.json、或其中没有指定 defaultPlan 时使用的套餐名
+DEFAULT_TARIFF_PLAN = "standard"
+# 本地话费的默认规则，与 calc_local_fee 相同
+DEFAULT_LOCAL_TARIFF = {"baseMinutes": 3, "baseFee": 0.5, "tiers": [{"blockMinutes": 3, "blockFee": 0.2}]}
+
+# 编译套餐时预先算好本地话费的分钟数范围；更长的通话用到时再把表向后延长
+LOCAL_FEE_TABLE_MINUTES = 60
+# 费用表和长途话费缓存只收录不超过这么多分钟的通话（一周），数据异常的超长通话直接计算，缓存不会无限增长
+FEE_TABLE_MAX_MINUTES = 7 * 24 * 60
+
+# 编译好的套餐：
+# - fees(分钟数, 长途每分钟费率, 是否谷时) 返回未舍入的 (本地话费, 长途话费)，市话的费率传 None
+# - rated(分钟数, 长途每分钟费率, 区号, 通话记录) 返回舍入后的 (本地话费, 长途话费, 总费用)，
+#   与对 fees 的结果逐项 round(x, 2) 相同，但查表或查缓存得到，计费时不再做浮点运算；
+#   通话记录只用来取开始时间（判断峰谷时段）
+# - flat_local 是只有一档、没有峰谷时段、长途不分档的套餐的本地计费参数
+#   (基本分钟数, 基本费用, 每档分钟数, 每档费用)，NumPy 批量计费据此按列计算；其他套餐为 None
+CompiledPlan = namedtuple("CompiledPlan", ["name", "fees", "rated", "flat_local"])
+
+
+def _tariff_number(spec, key, default, plan_name, kind=(int, float)):
+    value = spec.get(key, default)
+    if isinstance(value, bool) or not isinstance(value, kind):
+        raise ValueError(f"资费方案 {plan_name} 的 {key} 应为数字：{value!r}")
+    return value
+
+
+def _tariff_section(spec, key, default, plan_name):
+    """取出定义中的一节（如 local、offPeak），它必须是一个对象。"""
+    section = spec.get(key, default)
+    if not isinstance(section, dict):
+        raise ValueError(f"资费方案 {plan_name} 的 {key} 应为对象：{section!r}")
+    return section
+
+
+def _tariff_tiers(tiers, start, plan_name, fields):
+    """
+    检查分档定义：每档的 uptoMinutes（该档截止的通话总分钟数）递增，最后一档不设上限。
+    返回 [(截止分钟数或 None, 各字段的值...)]。
+    """
+    if not isinstance(tiers, list) or not tiers:
+        raise ValueError(f"资费方案 {plan_name} 的 tiers 应为非空列表")
+    parsed = []
+    previous = start
+    for k, tier in enumerate(tiers):
+        if not isinstance(tier, dict):
+            raise ValueError(f"资费方案 {plan_name} 的每一档应为对象：{tier!r}")
+        upto = tier.get("uptoMinutes")
+        last = k == len(tiers) - 1
+        if last != (upto is None):
+            raise ValueError(f"资费方案 {plan_name}：只有最后一档不写 uptoMinutes")
+        if upto is not None:
+            upto = _tariff_number(tier, "uptoMinutes", None, plan_name, int)
+            if upto <= previous:
+                raise ValueError(f"资费方案 {plan_name}：各档 uptoMinutes 应递增且大于 {previous}")
+            previous = upto
+        parsed.append((upto,) + tuple(_tariff_number(tier, key, default, plan_name, kind)
+                                      for key, default, kind in fields))
+    return parsed
+
+
+def _parse_clock(text, plan_name):
+    """把 "HH:MM" 换成一天中的第几分钟。"""
+    m = re.fullmatch(r"(\d{1,2}):(\d{2})", str(text), re.ASCII)
+    if m is None or int(m.group(1)) > 24 or int(m.group(2)) > 59:
+        raise ValueError(f"资费方案 {plan_name} 的时段应写成 HH:MM：{text!r}")
+    return min(int(m.group(1)) * 60 + int(m.group(2)), 24 * 60)
+
+
+def compile_tariff_plan(name, spec):
+    """
+    把一个套餐的定义编译成 CompiledPlan。分档、时段都在这里换成局部变量和查找表，
+    计费时每条通话只做几次整数运算和一次按“一天中的第几分钟”的查表。定义有误时抛出 ValueError。
+    """
+    if not isinstance(spec, dict):
+        raise ValueError(f"资费方案 {name} 应为对象：{spec!r}")
+    local = _tariff_section(spec, "local", DEFAULT_LOCAL_TARIFF, name)
+    base_minutes = _tariff_number(local, "baseMinutes", 3, name, int)
+    base_fee = _tariff_number(local, "baseFee", 0.5, name)
+    local_tiers = _tariff_tiers(local.get("tiers", DEFAULT_LOCAL_TARIFF["tiers"]), base_minutes, name,
+                                [("blockMinutes", 3, int), ("blockFee", 0.2, (int, float))])
+    if any(block_minutes <= 0 for _, block_minutes, _ in local_tiers):
+        raise ValueError(f"资费方案 {name} 的 blockMinutes 应大于 0")
+    long_tiers = _tariff_tiers(_tariff_section(spec, "longDistance", {}, name).get("tiers", [{}]), 0, name,
+                               [("multiplier", 1.0, (int, float))])
+
+    off_peak = spec.get("offPeak")
+    off_peak_minutes = None
+    if off_peak is not None:
+        off_peak = _tariff_section(spec, "offPeak", None, name)
+        # 一天 1440 分钟各自是否属于谷时，from > to 表示跨过午夜
+        begin = _parse_clock(off_peak.get("from"), name)
+        end = _parse_clock(off_peak.get("to"), name)
+        off_peak_minutes = bytearray(24 * 60)
+        for minute in (range(begin, end) if begin <= end else itertools.chain(range(begin, 24 * 60), range(end))):
+            off_peak_minutes[minute] = 1
+        local_multiplier = _tariff_number(off_peak, "localMultiplier", 1.0, name)
+        long_multiplier = _tariff_number(off_peak, "longDistanceMultiplier", 1.0, name)
+
+    if len(local_tiers) == 1 and len(long_tiers) == 1 and long_tiers[0][1] == 1 and off_peak is None:
+        # 最常见的情形（包括默认规则）：结果与 calc_local_fee 和 费率 × 分钟数 逐位相同
+        _, block_minutes, block_fee = local_tiers[0]
+
+        def fees(minutes, rate, off_peak=False):
+            if minutes <= base_minutes:
+                local_fee = base_fee
+            else:
+                local_fee = base_fee + -(-(minutes - base_minutes) // block_minutes) * block_fee
+            return local_fee, (0.0 if rate is None else rate * minutes)
+
+        return CompiledPlan(name, fees, _memoized_rating(fees), (base_minutes, base_fee, block_minutes, block_fee))
+
+    def local_fee_of(minutes):
+        fee = base_fee
+        done = base_minutes
+        for upto, block_minutes, block_fee in local_tiers:
+            if minutes <= done:
+                break
+            end = minutes if upto is None else min(minutes, upto)
+            fee = fee + -(-(end - done) // block_minutes) * block_fee
+            done = end
+        return fee
+
+    def long_fee_of(rate, minutes):
+        fee = 0.0
+        done = 0
+        for upto, multiplier in long_tiers:
+            if minutes <= done:
+                break
+            end = minutes if upto is None else min(minutes, upto)
+            fee += rate * multiplier * (end - done)
+            done = end
+        return fee
+
+    def fees(minutes, rate, off_peak=False):
+        local_fee = local_fee_of(minutes)
+        long_fee = 0.0 if rate is None else long_fee_of(rate, minutes)
+        if off_peak:
+            local_fee *= local_multiplier
+            long_fee *= long_multiplier
+        return local_fee, long_fee
+
+    return CompiledPlan(name, fees, _memoized_rating(fees, off_peak_minutes), None)
+
+
+def _is_off_peak(call, off_peak_minutes):
+    """按开始时间的时、分查表判断通话是否在谷时；开始时间格式不对的按峰时计。"""
+    start_time = call.get("startTime")
+    try:
+        minute = int(start_time[11:13]) * 60 + int(start_time[14:16])
+    except (TypeError, ValueError):
+        return False
+    return 0 <= minute < 24 * 60 and off_peak_minutes[minute] == 1
+
+
+def _memoized_rating(fees, off_peak_minutes=None):
+    """
+    为套餐的 fees 生成带缓存的 rated（见 CompiledPlan）。同一套餐下费用只取决于分钟数、区号和是否谷时：
+    - 市话：按分钟数查表，表中是舍入后的 (本地话费, 0.0, 总费用)；编译时先算好 LOCAL_FEE_TABLE_MINUTES 分钟以内的，
+      更长的通话用到时按倍数向后延长
+    - 长途：按 (是否谷时, 区号, 分钟数) 缓存舍入后的三项费用。用区号而不是费率作键，
+      费率相等（如 0.0 与 -0.0）但乘积的符号不同时也不会混用
+    费率变化时 _build_indexes 会重新编译套餐，缓存随之丢弃。
+    表只在新列表建好后整体替换，后台计费线程与其他线程同时计费也不会读到错位的表。
+    """
+    def rounded(minutes, rate, off_peak):
+        local_fee, long_fee = fees(minutes, rate, off_peak)
+        local_fee = round(local_fee, 2)
+        long_fee = round(long_fee, 2)
+        return local_fee, long_fee, round(local_fee + long_fee, 2)
+
+    peak_modes = (False, True) if off_peak_minutes is not None else (False,)
+    local_tables = [[rounded(m, None, off_peak) for m in range(LOCAL_FEE_TABLE_MINUTES + 1)] for off_peak in peak_modes]
+    long_cache = {}
+
+    def rated(minutes, rate, area_code, call):
+        off_peak = off_peak_minutes is not None and _is_off_peak(call, off_peak_minutes)
+        if not 0 <= minutes <= FEE_TABLE_MAX_MINUTES:
+            return rounded(minutes, rate, off_peak)
+        if rate is None:
+            table = local_tables[off_peak]
+            if minutes >= len(table):
+                size = min(max(minutes + 1, 2 * len(table)), FEE_TABLE_MAX_MINUTES + 1)
+                table = table + [rounded(m, None, off_peak) for m in range(len(table), size)]
+                local_tables[off_peak] = table
+            return table[minutes]
+        key = (off_peak, area_code, minutes)
+        result = long_cache.get(key)
+        if result is None:
+            result = long_cache[key] = rounded(minutes, rate, off_peak)
+        return result
+
+    return rated
+
+
+def compile_tariffs(tariffs):
+    """
+    编译 tariffs.json 的内容，返回 (套餐名 → CompiledPlan, 默认套餐)。格式如下，各项都可以省略，
+    省略的部分按原来的固定规则（本地 3 分钟内 0.5 元、之后每 3 分钟 0.2 元，长途按区号每分钟费率）：
+
+        {
+            "defaultPlan": "standard",
+            "plans": {
+                "standard": {},
+                "night": {
+                    "local": {"baseMinutes": 3, "baseFee": 0.5,
+                              "tiers": [{"uptoMinutes": 30, "blockMinutes": 3, "blockFee": 0.2},
+                                        {"blockMinutes": 3, "blockFee": 0.1}]},
+                    "longDistance": {"tiers": [{"uptoMinutes": 10, "multiplier": 1.0}, {"multiplier": 0.8}]},
+                    "offPeak": {"from": "22:00", "to": "07:00", "localMultiplier": 0.5, "longDistanceMultiplier": 0.5}
+                }
+            }
+        }
+
+    - local.tiers：超过基本分钟数的部分按档计费，每档按 blockMinutes 向上取整成块，每块 blockFee 元
+    - longDistance.tiers：长途话费按档计费，每档每分钟为区号费率 × multiplier
+    - offPeak：开始时间在 [from, to) 内的通话（from 大于 to 表示跨午夜），话费分别乘以对应系数
+    - users.json 中用户的 "plan" 字段选择套餐，没有该字段或套餐不存在时使用 defaultPlan
+    """
+    if not isinstance(tariffs, dict) or not isinstance(tariffs.get("plans", {}), dict):
+        raise ValueError("tariffs.json 应为对象，其中的 plans 为 套餐名 → 定义 的对象")
+    plans_spec = dict(tariffs.get("plans", {}))
+    default_name = tariffs.get("defaultPlan", DEFAULT_TARIFF_PLAN)
+    plans_spec.setdefault(default_name, {})
+    plans = {name: compile_tariff_plan(name, spec) for name, spec in plans_spec.items()}
+    return plans, plans[default_name]
+
+
+# -------------------- 性能统计 --------------------
+
+# 性能剖析开关：环境变量 BILLING_PROFILE 为逗号分隔的 "cprofile"、"tracemalloc"，或 "all" 表示两者都打开
+PROFILE_ENV = "BILLING_PROFILE"
+PROFILE_MODES = ("cprofile", "tracemalloc")
+# 剖析报告中列出的函数数（按累计耗时）和代码行数（按分配的内存）
+PROFILE_TOP = 25
+
+
+def parse_profile_modes(text):
+    """把 "cprofile,tracemalloc" 或 "all" 之类的文字解析为剖析方式的集合；有未知的方式时抛出 ValueError。"""
+    modes = {part.strip().lower() for part in (text or "").split(",") if part.strip()}
+    if "all" in modes:
+        modes = (modes - {"all"}) | set(PROFILE_MODES)
+    unknown = modes - set(PROFILE_MODES)
+    if unknown:
+        raise ValueError(f"未知的剖析方式：{'、'.join(sorted(unknown))}（可选 {'、'.join(PROFILE_MODES)} 或 all）")
+    return modes
+
+
+class _StageRecords:
+    """stage() 产出的对象：阶段内处理完才知道条数时，把条数写到 records 上。"""
+    __slots__ = ("records",)
+
+    def __init__(self, records):
+        self.records = records
+
+
+class Instrumentation:
+    """
+    计费各阶段和各查询方法的耗时统计，以及可选的 cProfile / tracemalloc 剖析。
+    - 耗时统计一直开启：每个阶段只在开始和结束时各取一次时间，不逐条记录计时
+    - 每个阶段累计调用次数、总耗时、最长一次的耗时和处理的记录条数；阶段可以嵌套，各自分别统计
+    - 剖析只在一个线程最外层的阶段开始时打开、结束时关闭，每一轮的 cProfile 结果合并进同一份统计；
+      tracemalloc 记录每个最外层阶段的内存峰值（多个线程同时运行时为近似值）
+    统计可能同时被后台计费线程和界面线程更新，内部用一把锁保护。
+    """
+
+    def __init__(self, profile=()):
+        self._lock = threading.Lock()
+        # 阶段名 → [调用次数, 总耗时, 最长耗时, 记录条数, 内存峰值]
+        self._stages = {}
+        self._local = threading.local()
+        self._pstats = None
+        self.profile = set()
+        self.enable_profiling(profile)
+
+    def enable_profiling(self, modes):
+        modes = set(modes)
+        if "tracemalloc" in modes and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.profile |= modes
+
+    def add(self, name, seconds, records=None, peak_bytes=None):
+        """把一次耗时 seconds 秒、处理 records 条记录的运行计入阶段 name。"""
+        with self._lock:
+            entry = self._stages.get(name)
+            if entry is None:
+                entry = self._stages[name] = [0, 0.0, 0.0, 0, None]
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+            if records:
+                entry[3] += records
+            if peak_bytes is not None:
+                entry[4] = peak_bytes if entry[4] is None else max(entry[4], peak_bytes)
+
+    @contextmanager
+    def stage(self, name, records=None):
+        """计时一个阶段；records 在阶段结束后才知道时，可设置产出对象的 records 属性。"""
+        depth = getattr(self._local, "depth", 0)
+        profiler = None
+        tracing = False
+        if depth == 0:
+            if "cprofile" in self.profile:
+                profiler = cProfile.Profile()
+                try:
+                    profiler.enable()
+                except ValueError:
+                    # 别的剖析器（如另一线程的 cProfile，Python 3.12 起）正在运行，这一次不剖析
+                    profiler = None
+            if "tracemalloc" in self.profile and tracemalloc.is_tracing():
+                tracemalloc.reset_peak()
+                tracing = True
+        box = _StageRecords(records)
+        self._local.depth = depth + 1
+        started = time.perf_counter()
+        try:
+            yield box
+        finally:
+            seconds = time.perf_counter() - started
+            self._local.depth = depth
+            if profiler is not None:
+                profiler.disable()
+                self._merge_profile(profiler)
+            peak = tracemalloc.get_traced_memory()[1] if tracing else None
+            self.add(name, seconds, box.records, peak)
+
+    def timed_batches(self, name, batches):
+        """逐批产出 batches 中的记录列表，取每一批（即读取和解析）的耗时计入阶段 name。"""
+        batches = iter(batches)
+        while True:
+            started = time.perf_counter()
+            batch = next(batches, None)
+            if batch is None:
+                return
+            self.add(name, time.perf_counter() - started, len(batch))
+            yield batch
+
+    def _merge_profile(self, profiler):
+        with self._lock:
+            if self._pstats is None:
+                self._pstats = pstats.Stats(profiler)
+            else:
+                self._pstats.add(profiler)
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._pstats = None
+
+    def snapshot(self):
+        """各阶段的统计（字典列表），按总耗时从多到少排列。"""
+        with self._lock:
+            items = [(name, list(entry)) for name, entry in self._stages.items()]
+        rows = []
+        for name, (calls, total, longest, records, peak) in sorted(items, key=lambda item: -item[1][1]):
+            rows.append({
+                "stage": name,
+                "calls": calls,
+                "totalMs": round(total * 1000, 3),
+                "meanMs": round(total / calls * 1000, 3),
+                "maxMs": round(longest * 1000, 3),
+                "records": records,
+                "recordsPerSecond": round(records / total) if records and total > 0 else None,
+                "peakBytes": peak,
+            })
+        return rows
+
+    def report(self, top=PROFILE_TOP):
+        """完整的统计报告（可直接写成 JSON）：各阶段耗时，打开剖析时还有 cProfile 和 tracemalloc 的结果。"""
+        report = {"profile": sorted(self.profile), "stages": self.snapshot()}
+        if "cprofile" in self.profile:
+            report["cprofile"] = self.profile_text(top)
+        if "tracemalloc" in self.profile and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            report["tracedBytes"] = current
+            report["tracedPeakBytes"] = peak
+            report["topAllocations"] = [
+                {"location": str(stat.traceback), "sizeBytes": stat.size, "count": stat.count}
+                for stat in self._allocation_snapshot().statistics("lineno")[:top]
+            ]
+        return report
+
+    @staticmethod
+    def _allocation_snapshot():
+        """当前的内存分配快照，去掉剖析工具自身（cProfile、pstats、tracemalloc）的分配。"""
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, module.__file__) for module in (cProfile, pstats, tracemalloc)
+        ])
+
+    def profile_text(self, top=PROFILE_TOP):
+        """cProfile 的结果：按累计耗时排列的前 top 个函数（文本）；还没有结果时返回空串。"""
+        with self._lock:
+            if self._pstats is None:
+                return ""
+            out = io.StringIO()
+            self._pstats.stream = out
+            self._pstats.sort_stats("cumulative").print_stats(top)
+            return out.getvalue()
+
+
+def _instrumented(stage, records=None):
+    """
+    方法装饰器：每次调用计入 self.metrics 中名为 stage 的阶段。
+    records 为根据返回值得出处理条数的函数（如 len）。
+    没有打开剖析时直接取前后两次时间，省去 stage() 上下文管理器的开销（查询方法每次只需几微秒）。
+    """
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            metrics = self.metrics
+            if not metrics.profile:
+                count = None
+                started = time.perf_counter()
+                try:
+                    result = method(self, *args, **kwargs)
+                    if records is not None:
+                        count = records(result)
+                    return result
+                finally:
+                    metrics.add(stage, time.perf_counter() - started, count)
+            with metrics.stage(stage) as box:
+                result = method(self, *args, **kwargs)
+                if records is not None:
+                    box.records = records(result)
+                return result
+        return wrapper
+    return decorate
+
+
+# -------------------- 计费核心逻辑 --------------------
+
+# 一批通话记录至少有这么多条时才使用 NumPy 批量计费，条数太少时数组开销反而更大
+BATCH_RATING_MIN_RECORDS = 1000
+# 多进程计费时，通话记录至少有这么多条才值得启动进程池
+PARALLEL_MIN_RECORDS = 50000
+# 流式计费时每批读入并计费的通话条数（多进程时再乘以进程数）
+RATING_BATCH_SIZE = 10000
+# 每个工作进程分到的分片数，分片多一些可以缓解个别号码通话特别多造成的负载不均
+SHARDS_PER_WORKER = 4
+
+def calc_local_fee(minutes: int) -> float:
+    """
+    本地电话费计算：
+    - 3 分钟以内 0.5 元
+    - 超过 3 分钟以后，每 3 分钟递增 0.2 元（不足 3 分钟按 3 分钟算）
+    """
+    if minutes <= 3:
+        return 0.5
+    else:
+        extra_minutes = minutes - 3
+        extra_blocks = math.ceil(extra_minutes / 3)
+        return 0.5 + extra_blocks * 0.2
+
+
+def _round_column(values):
+    """
+    对数组中每个数做 Python 的 round(x, 2)。
+    NumPy 的 np.round 与 Python 的 round 舍入结果并不总是相同，这里先按位模式去重
+    （不同的金额只有很少几种），对每个不同的值调用 round，再按下标映射回去，保证与逐条计算完全一致。
+    """
+    bits, inverse = np.unique(values.view(np.int64), return_inverse=True)
+    rounded = np.array([round(v, 2) for v in bits.view(np.float64).tolist()], dtype=np.float64)
+    return rounded[inverse.reshape(-1)]
+
+# 校验通话记录文件已计费前缀未被改写时，保留的已计费部分末尾的字节数
+CALLS_TAIL_CHECK_BYTES = 512
+
+
+class BillingSystem:
+    def __init__(self, storage="auto", workers=1, in_memory=True, profile=None, fees_format=None):
+        """
+        storage 选择通话记录与费用的存储格式：
+        - "json"：calls.json / fees.json
+        - "jsonl"：calls.jsonl / fees.jsonl（每行一条记录，只追加写入）
+        - "auto"：存在 calls.jsonl 时用 JSONL，否则用 JSON
+        workers 大于 1 时，全量重算使用多个进程按主叫号码分片并行计费。
+        in_memory=False 为流式模式：不在内存中保留通话记录和费用记录，只保留按主叫号码的话费合计；
+        全量重算逐批读取、计费并写出费用文件，话单查询时顺序扫描通话记录文件。
+        适合通话记录很多、只做批量计费或偶尔查询的场合（如命令行）。
+        profile 为要打开的剖析方式（见 Instrumentation），为 None 时取环境变量 BILLING_PROFILE。
+        fees_format 为 fees.json 的编码方式（见 FEES_FORMATS），为 None 时取 FEES_FORMAT。
+        内存模式下费用文件由后台线程写出，计费不等待磁盘；需要确认文件已经写好时调用 flush()。
+        """
+        fees_format = FEES_FORMAT if fees_format is None else fees_format
+        if fees_format not in FEES_FORMATS:
+            raise ValueError(f"未知的费用文件编码方式：{fees_format}")
+        if storage == "auto":
+            storage = "jsonl" if os.path.exists(CALLS_JSONL_FILE) else "json"
+        if storage == "json":
+            self.calls_file, self.fees_file = CALLS_FILE, FEES_FILE
+        elif storage == "jsonl":
+            self.calls_file, self.fees_file = CALLS_JSONL_FILE, FEES_JSONL_FILE
+        else:
+            raise ValueError(f"未知的存储格式：{storage}")
+        self.storage = storage
+        self.fees_format = fees_format
+        self.workers = workers
+        self.in_memory = in_memory
+        # 写出费用文件的后台线程（内存模式下使用；流式模式下费用记录不在内存中，只能边计费边写出）
+        self._fees_writer = BackgroundWriter.for_path(self.fees_file)
+        # 后台写出出错后，下一次写出改为整体重写，不在残缺的文件上追加
+        self._fees_file_stale = False
+        # 计费可能在后台线程中进行：计费结果合并进共享数据、以及查询读取这些数据时都要先持有这把锁，
+        # 耗时的解析和计费本身在锁外完成
+        self.lock = threading.RLock()
+        # 各阶段的耗时统计（以及可选的剖析），界面的“性能诊断”页和命令行的 --metrics 从这里读取
+        self.metrics = Instrumentation(parse_profile_modes(os.environ.get(PROFILE_ENV)) if profile is None else profile)
+
+        init_sample_data()
+        self._ref_signature = self._reference_signature()
+        self.users = self._load_json(USERS_FILE)
+        self.rates = self._load_json(RATES_FILE)
+        self.tariffs = self._load_tariffs()
+        self._build_indexes()
+
+        # 增量计费状态：通话记录文件中已计费部分的结束位置（字节偏移，None 表示不能续读）、
+        # 该位置之前的一小段字节（用于确认前缀没有被改写）以及最后一条已计费的 callId
+        self._calls_offset = None
+        self._calls_tail = b""
+        self._last_call_id = None
+        # 首次计费、或 users.json / rates.json 内容变化后，需要全量重算；
+        # 费用文件旁的计费状态（见 _load_state）有效时，加载已有费用后改为从上次的位置续读
+        self._full_rerate_pending = True
+
+        self._load_rated_data()
+
+    def _load_rated_data(self):
+        """加载已有的通话记录和费用，并建立按主叫号码的聚合；还没有费用文件时立即计费一次。"""
+        # 按主叫号码维护的聚合：号码 → [本地话费合计, 长途话费合计, 通话次数]，流式模式下第一次用到时才建立
+        # （见 _loaded_fee_totals）；以及按时间排序的索引（流式模式下不使用）：号码 → 该号码的通话在通话表中的下标、
+        # 号码 → 这些通话的开始时间（pack_start_time 编码，与下标一一对应、从早到晚排列）
+        self._fee_totals = {}
+        self._call_positions = {}
+        self._call_times = {}
+        # 同一进程中别的计费系统可能还在后台写这个费用文件，等它写完再读
+        self.flush()
+
+        if not self.in_memory:
+            # 流式模式：还没有费用文件时不立即计费，留给第一次 compute_all_fees（反正要全量重算）；
+            # 计费状态有效时直接从上次的位置续读
+            self.calls = self.fees = None
+            self._fee_totals = None
+            state = self._load_state()
+            if os.path.exists(self.fees_file) and state is not None:
+                self._calls_offset, self._calls_tail, self._last_call_id = state
+                self._full_rerate_pending = False
+            return
+
+        self.calls = CallTable()
+        self.fees = FeeTable(self.calls)
+        stream = RecordStream(self.calls_file, "callRecords", tail_size=CALLS_TAIL_CHECK_BYTES, locked=True)
+        for records in self.metrics.timed_batches("parseCalls", stream.batches(RATING_BATCH_SIZE)):
+            with self.metrics.stage("indexCalls", len(records)):
+                start = len(self.calls)
+                self.calls.extend(records)
+                self._index_calls(self._call_positions, self._call_times, records, self.calls, start)
+
+        if os.path.exists(self.fees_file):
+            # 费用记录与通话记录逐条对应，多出来的（通话记录文件被改短了）不放进费用表
+            fee_count = 0
+            fee_batches = RecordStream(self.fees_file, "fees").batches(RATING_BATCH_SIZE)
+            for rows in self.metrics.timed_batches("parseFees", fee_batches):
+                fee_count += len(rows)
+                self._index_fees(self._fee_totals, rows)
+                self.fees.extend(rows[:len(self.calls) - len(self.fees)])
+            self._resume(stream.end_offset, stream.tail, fee_count)
+        else:
+            self.compute_all_fees()
+
+    def _resume(self, offset, tail, fee_count):
+        """
+        计费状态有效、且费用文件中的 fee_count 条费用正好对应到上次计费的最后一条通话时，不必全量重算：
+        停机期间追加的通话（已经读进了通话表）现在补算，之后从通话记录文件末尾（offset）续读。
+        """
+        state = self._load_state()
+        if state is None or offset is None or fee_count != len(self.fees):
+            return
+        if fee_count and self.calls[fee_count - 1].get("callId") != state[2]:
+            return
+        self._full_rerate_pending = False
+        self._calls_offset = offset
+        self._calls_tail = tail
+        self._last_call_id = self.calls[len(self.calls) - 1].get("callId") if len(self.calls) else None
+        if fee_count < len(self.calls):
+            rows = self.rate_calls([self.calls[i] for i in range(fee_count, len(self.calls))])
+            with self.lock:
+                self.fees.extend(rows)
+                self._index_fees(self._fee_totals, rows)
+            self._append_fee_rows(rows, self._cursor())
+
+    @classmethod
+    def for_rating(cls, users, rates, tariffs=None):
+        """
+        只用于计费的轻量实例：不读写任何文件，只根据给定的 users / rates / tariffs 建立索引。
+        多进程分片计费时，每个工作进程启动时创建一个。
+        """
+        rater = cls.__new__(cls)
+        rater.lock = threading.RLock()
+        rater.metrics = Instrumentation()
+        rater.workers = 1
+        rater.in_memory = True
+        rater.users = users
+        rater.rates = rates
+        rater.tariffs = tariffs or {}
+        rater._build_indexes()
+        return rater
+
+    @staticmethod
+    def _load_json(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    @classmethod
+    def _load_tariffs(cls):
+        """tariffs.json 是可选的，没有时返回空的定义（全部按默认规则计费）。"""
+        return cls._load_json(TARIFFS_FILE) if os.path.exists(TARIFFS_FILE) else {}
+
+    def _append_fee_rows(self, rows, cursor):
+        """
+        把新的费用行追加到费用文件；JSON 布局无法原地追加时整体重写。写好之后记下计费状态 cursor（见 _save_state）。
+        内存模式下交给后台线程写出，此时 rows 已经追加进费用表。
+        """
+        if self.in_memory:
+            with self.lock:
+                fees, count = self.fees, len(self.fees)
+            self._fees_writer.submit(functools.partial(self._write_fees, fees, count, cursor, rows))
+            return
+        with self.metrics.stage("writeFees", len(rows)):
+            if self.storage == "jsonl":
+                append_jsonl(self.fees_file, rows)
+            elif not self._append_json_rows(self.fees_file, rows, self.fees_format):
+                # 流式模式下内存中没有费用记录：边读原费用文件边写出新文件
+                old_rows = RecordStream(self.fees_file, "fees") if os.path.exists(self.fees_file) else []
+                write_json_records(self.fees_file, "fees", itertools.chain(old_rows, rows), self.fees_format)
+            self._save_state(cursor)
+
+    def _write_fees(self, fees, count, cursor, rows=None):
+        """
+        后台写出任务：把新的费用行 rows 追加到费用文件；rows 为 None、无法原地追加或上次写出出错时，
+        用费用表 fees 的前 count 条整体重写（提交之后费用表可能又追加了记录，这些由后面的任务写出）。
+        写好之后记下计费状态 cursor。
+        """
+        with self.metrics.stage("writeFees", count if rows is None else len(rows)):
+            try:
+                appended = False
+                if rows is not None and not self._fees_file_stale:
+                    if self.storage == "jsonl":
+                        append_jsonl(self.fees_file, rows)
+                        appended = True
+                    else:
+                        appended = self._append_json_rows(self.fees_file, rows, self.fees_format)
+                if not appended:
+                    write_json_records(self.fees_file, "fees", (fees[i] for i in range(count)), self.fees_format)
+                    self._fees_file_stale = False
+                self._save_state(cursor)
+            except Exception:
+                self._fees_file_stale = True
+                raise
+
+    def flush(self):
+        """等待后台线程把已经计费的费用全部写进费用文件；后台写出出错时抛出该异常。"""
+        self._fees_writer.flush()
+
+    @staticmethod
+    def _append_json_rows(path, rows, encoding="indent"):
+        """
+        把 rows 追加到 write_json_records 写出的 {"fees": [...]} 这类文件末尾，
+        结果（压缩文件为解压后的内容）与整体重写完全一致。文件不存在或格式不符时返回 False，由调用方整体重写。
+        压缩文件的结尾是单独的 gzip 成员，把它换成 新记录的成员 + 结尾成员；
+        文件会比整体重写的大一些（每次追加多一个成员头尾，压缩字典也不跨成员），下次整体重写时复原。
+        """
+        if encoding not in FEES_FORMATS:
+            return False
+        closing, _, dump = _JSON_RECORD_LAYOUTS["indent" if encoding == "indent" else "compact"]
+        closing = closing.encode("utf-8")
+        if encoding == "zlib":
+            # 只有记录时才是 closing 的成员，空列表 "[]" 的情况交给整体重写
+            tail = gzip_member(closing)
+        else:
+            # 前一个字符必须是上一条记录的 "}"，空列表 "[]" 的情况交给整体重写
+            tail = b"}" + closing
+        try:
+            f = open(path, "r+b")
+        except FileNotFoundError:
+            return False
+        with f:
+            end = f.seek(0, os.SEEK_END) - len(tail)
+            if end < 0:
+                return False
+            f.seek(end)
+            if f.read() != tail:
+                return False
+            data = "".join([",\n" + dump(row) for row in rows]).encode("utf-8")
+            if encoding == "zlib":
+                f.seek(end)
+                f.write(gzip_member(data) + tail)
+            else:
+                f.seek(end + 1)
+                f.write(data + closing)
+            f.truncate()
+        return True
+
+    def _reference_signature(self):
+        return file_signature(USERS_FILE), file_signature(RATES_FILE), file_signature(TARIFFS_FILE)
+
+    def _refresh_reference_data(self):
+        """users.json / rates.json / tariffs.json 有变化时重新加载；内容确实改变时标记需要全量重算。"""
+        signature = self._reference_signature()
+        if signature == self._ref_signature:
+            return
+        with self.metrics.stage("loadReferenceData"):
+            users = self._load_json(USERS_FILE)
+            rates = self._load_json(RATES_FILE)
+            tariffs = self._load_tariffs()
+            if users != self.users or rates != self.rates or tariffs != self.tariffs:
+                # 数据和索引一起替换，查询不会看到新旧混杂的状态（这种情况很少，持锁时间长一点也无妨）
+                # 建立索引失败（如 tariffs.json 有误）时恢复原来的数据和索引，文件签名也不更新，下一轮再试
+                with self.lock:
+                    old = self.users, self.rates, self.tariffs
+                    self.users, self.rates, self.tariffs = users, rates, tariffs
+                    try:
+                        self._build_indexes()
+                    except Exception:
+                        self.users, self.rates, self.tariffs = old
+                        self._build_indexes()
+                        raise
+                self._full_rerate_pending = True
+        self._ref_signature = signature
+
+    # ---------- 计费状态 ----------
+
+    @property
+    def state_file(self):
+        """费用文件旁记录计费状态的文件：通话记录的续读位置，以及这份费用对应的资费数据摘要。"""
+        return self.fees_file + ".state"
+
+    def _cursor(self):
+        """当前的续读位置 (偏移, 校验字节, 最后一条已计费的 callId)，与 _load_state 的返回值相同。"""
+        return self._calls_offset, self._calls_tail, self._last_call_id
+
+    def _load_state(self):
+        """
+        读出计费状态，返回续读位置 (偏移, 校验字节, 最后一条已计费的 callId)。
+        没有状态文件、费用文件在写出状态之后被改动过、资费数据变了，或通话记录文件已计费部分被改写时返回 None。
+        """
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            offset = state["callsOffset"]
+            tail = base64.b64decode(state["callsTail"])
+            fees_signature = file_signature(self.fees_file)
+            if (state.get("callsFile") != self.calls_file
+                    or state.get("referenceDigest") != self._reference_digest
+                    or fees_signature is None or state.get("feesSignature") != list(fees_signature)
+                    or not isinstance(offset, int) or offset < len(tail)):
+                return None
+            with open(self.calls_file, "rb") as f:
+                f.seek(offset - len(tail))
+                if f.read(len(tail)) != tail:
+                    return None
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        return offset, tail, state.get("lastCallId")
+
+    def _save_state(self, cursor):
+        """费用文件写好之后记下计费状态 cursor（见 _cursor）；续读位置未知时删除状态文件，下次启动全量重算。"""
+        offset, tail, last_call_id = cursor
+        if offset is None:
+            try:
+                os.remove(self.state_file)
+            except FileNotFoundError:
+                pass
+            return
+        state = {
+            "callsFile": self.calls_file,
+            "callsOffset": offset,
+            "callsTail": base64.b64encode(tail).decode("ascii"),
+            "lastCallId": last_call_id,
+            "referenceDigest": self._reference_digest,
+            "feesSignature": list(file_signature(self.fees_file)),
+        }
+        tmp_path = self.state_file + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.state_file)
+
+    def _build_indexes(self):
+        """
+        根据 users / rates 建立哈希索引，避免每次查询都线性扫描：
+        - 手机号 → 用户字典（号码重复时与原先的线性查找一样取第一个）
+        - 区号 → 每分钟费率
+        - 姓名 → 用户在列表中的位置（同名用户放在一起），以及姓名的子串索引 NameIndex
+        并编译 tariffs 中的资费方案：手机号 → 套餐带缓存的计费函数（只记录不使用默认套餐的用户）
+        """
+        # 先编译资费方案：定义有误时在改动任何索引之前就抛出 ValueError
+        plans, default_plan = compile_tariffs(self.tariffs)
+        # users / rates / tariffs 内容的摘要，用来判断已有的费用是否按当前费率计算
+        # （没有资费方案时不计入，原有的摘要保持不变）
+        reference = [self.users, self.rates] + ([self.tariffs] if self.tariffs else [])
+        text = json.dumps(reference, ensure_ascii=False, sort_keys=True)
+        reference_digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        user_by_phone = {}
+        user_positions_by_name = {}
+        for i, u in enumerate(self.users.get("users", [])):
+            user_by_phone.setdefault(u.get("phoneNumber"), u)
+            user_positions_by_name.setdefault(u.get("userName", ""), []).append(i)
+
+        rate_by_area = {}
+        for r in self.rates.get("longDistanceRates", []):
+            rate_by_area.setdefault(r.get("areaCode"), float(r.get("ratePerMinute", 0.0)))
+
+        rated_by_phone = {}
+        for phone_number, u in user_by_phone.items():
+            plan = plans.get(u.get("plan"), default_plan)
+            if plan is not default_plan:
+                rated_by_phone[phone_number] = plan.rated
+
+        # 姓名子串索引：第一次全部建立，之后只加入新出现的姓名、去掉不再出现的姓名
+        # （原处修改，放在所有可能出错的步骤之后）
+        name_index = getattr(self, "_name_index", None)
+        if name_index is None:
+            name_index = NameIndex(user_positions_by_name)
+        else:
+            for name in name_index.names - user_positions_by_name.keys():
+                name_index.discard(name)
+            for name in user_positions_by_name:
+                name_index.add(name)
+
+        self._user_by_phone = user_by_phone
+        self._user_positions_by_name = user_positions_by_name
+        self._name_index = name_index
+        self._rate_by_area = rate_by_area
+        self._default_plan = default_plan
+        self._default_rated = default_plan.rated
+        self._rated_by_phone = rated_by_phone
+        self._reference_digest = reference_digest
+
+    # ---------- 用户相关 ----------
+
+    def get_user_name(self, phone_number: str) -> str:
+        """根据手机号返回用户名，找不到则返回“未知用户”"""
+        u = self._user_by_phone.get(phone_number)
+        if u is None:
+            return "未知用户"
+        return u.get("userName", "未知用户")
+
+    @_instrumented("findUsersByName", records=len)
+    def find_users_by_name(self, name: str, limit=None):
+        """
+        根据姓名（支持模糊匹配）查询所有用户。
+        返回列表，每项为用户字典，顺序与 users.json 中一致；给出 limit 时只返回最前面的 limit 个（输入时即时查询用）。
+        """
+        name = name.strip()
+        if not name:
+            return []
+        # 在姓名子串索引中找出包含 name 的不重复姓名，再按原顺序取出对应用户
+        with self.lock:
+            positions_by_name = self._user_positions_by_name
+            users = self.users.get("users", [])
+            names = self._name_index.search(name)
+        positions = []
+        for user_name in names:
+            positions.extend(positions_by_name[user_name])
+        if limit is not None and limit < len(positions):
+            positions = heapq.nsmallest(limit, positions)
+        else:
+            positions.sort()
+        return [users[i] for i in positions]
+
+    # ---------- 费率 & 计费 ----------
+
+    def get_rate(self, area_code: str) -> float:
+        if not area_code:
+            return 0.0
+        return self._rate_by_area.get(area_code, 0.0)
+
+    def rate_call(self, call):
+        """对单条通话记录计费，返回对应的费用记录。"""
+        duration_seconds = int(call.get("durationSeconds", 0))
+        call_type = call.get("callType", "local")
+        area_code = call.get("longDistanceAreaCode")
+        caller_number = call.get("callerNumber")
+
+        # 通话时长（分钟），不满 1 分钟按 1 分钟算；用整数运算向上取整，
+        # 时长超过 2**53 秒时 duration_seconds / 60.0 会先舍入，结果可能少算 1 分钟
+        minutes = -(-duration_seconds // 60)
+        # 按主叫用户的套餐查表得到舍入后的本地话费、长途话费和总费用
+        rate = self.get_rate(area_code) if call_type == "long-distance" else None
+        # 绝大多数情况下没有人选其他套餐，不必再按号码查找
+        rated_by_phone = self._rated_by_phone
+        rated = rated_by_phone.get(caller_number, self._default_rated) if rated_by_phone else self._default_rated
+        local_fee, long_fee, total_fee = rated(minutes, rate, area_code, call)
+
+        return {
+            "callId": call.get("callId"),
+            "callerNumber": caller_number,
+            "calleeNumber": call.get("calleeNumber"),
+            "userName": self.get_user_name(caller_number),
+            "localFee": local_fee,
+            "longDistanceFee": long_fee,
+            "totalFee": total_fee
+        }
+
+    @_instrumented("rateCalls", records=len)
+    def rate_calls(self, records):
+        """
+        批量计费，结果与逐条调用 rate_call 完全一致。
+        安装了 NumPy、记录较多且所有用户都使用同一个不分档、不分时段的套餐时，
+        把时长、通话类型和费率取成列数组，用数组运算一次算出分钟数、本地话费、长途话费和总费用。
+        """
+        flat_local = self._default_plan.flat_local
+        if np is None or len(records) < BATCH_RATING_MIN_RECORDS or flat_local is None or self._rated_by_phone:
+            return [self.rate_call(call) for call in records]
+        base_minutes, base_fee, block_minutes, block_fee = flat_local
+
+        n = len(records)
+        try:
+            durations = np.fromiter(
+                (int(call.get("durationSeconds", 0)) for call in records), dtype=np.int64, count=n
+            )
+        except OverflowError:
+            # 有时长超出 int64 范围（数据有误的极端值）时这一批改为逐条计费，Python 整数不会溢出
+            return [self.rate_call(call) for call in records]
+        is_long = np.fromiter(
+            (call.get("callType", "local") == "long-distance" for call in records), dtype=bool, count=n
+        )
+        rates = np.fromiter(
+            (self.get_rate(call.get("longDistanceAreaCode")) for call in records), dtype=np.float64, count=n
+        )
+
+        # 通话时长（分钟），不满 1 分钟按 1 分钟算，与 rate_call 一样用整数运算向上取整
+        minutes = -(-durations // 60)
+        # 本地话费：基本分钟数以内为基本费用，之后每档（不足按一档）加一档的费用
+        extra_blocks = -((base_minutes - minutes) // block_minutes)
+        local_fees = np.where(minutes <= base_minutes, float(base_fee), base_fee + extra_blocks * block_fee)
+        # 长途话费
+        long_fees = np.where(is_long, rates * minutes, 0.0)
+
+        local_fees = _round_column(local_fees)
+        long_fees = _round_column(long_fees)
+        total_fees = _round_column(local_fees + long_fees)
+
+        get_user_name = self.get_user_name
+        return [
+            {
+                "callId": call.get("callId"),
+                "callerNumber": call.get("callerNumber"),
+                "calleeNumber": call.get("calleeNumber"),
+                "userName": get_user_name(call.get("callerNumber")),
+                "localFee": local_fee,
+                "longDistanceFee": long_fee,
+                "totalFee": total_fee
+            }
+            for call, local_fee, long_fee, total_fee in zip(
+                records, local_fees.tolist(), long_fees.tolist(), total_fees.tolist()
+            )
+        ]
+
+    def open_rating_pool(self):
+        """创建多进程计费用的进程池，每个工作进程按当前的 users / rates / tariffs 建立一次索引。"""
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=_init_shard_worker,
+                                   initargs=(self.users, self.rates, self.tariffs))
+
+    @_instrumented("rateCallsParallel", records=len)
+    def rate_calls_parallel(self, records, pool):
+        """
+        在进程池中并行计费，返回费用记录列表，与顺序计费的结果完全一致：
+        - 按主叫号码的 CRC32 分片，同一号码的通话都在同一分片内，个别号码通话特别多时也不会拆散
+        - 费用记录按原来的下标放回，顺序与通话记录一致；话费合计由调用方按这个顺序累加，
+          浮点结果与顺序计费相同
+        """
+        shard_count = self.workers * SHARDS_PER_WORKER
+        shards = [[] for _ in range(shard_count)]
+        positions = [[] for _ in range(shard_count)]
+        for i, call in enumerate(records):
+            k = zlib.crc32(str(call.get("callerNumber")).encode("utf-8")) % shard_count
+            shards[k].append(call)
+            positions[k].append(i)
+
+        rows = [None] * len(records)
+        for shard_positions, shard_rows in zip(positions, pool.map(_rate_shard, shards)):
+            for i, row in zip(shard_positions, shard_rows):
+                rows[i] = row
+        return rows
+
+    @_instrumented("computeAllFees", records=int)
+    def compute_all_fees(self, full=False):
+        """
+        计算通话费用并保存到费用文件（fees.json 或 fees.jsonl）。
+        默认增量计费：只对上次之后追加到通话记录文件的记录计费，并把新费用行追加到费用文件；
+        只有 users.json / rates.json / tariffs.json 内容变化、通话记录已计费部分被改写或 full=True 时才全量重算。
+        返回本次计费的通话条数。
+        """
+        self._refresh_reference_data()
+
+        if not full:
+            count = self._rate_new_calls()
+            if count is not None:
+                return count
+        return self._rerate_all_calls()
+
+    @_instrumented("rateNewCalls", records=lambda count: count or 0)
+    def rate_new_calls(self):
+        """
+        只对上次计费之后追加到通话记录文件的记录计费，从不全量重算，供查询前调用。
+        返回本次计费的通话条数；需要全量重算时（还没有计费过、资费数据变化或通话记录已计费部分被改写）
+        什么也不做并返回 None，由 compute_all_fees 处理。
+        """
+        self._refresh_reference_data()
+        return self._rate_new_calls()
+
+    def _rate_new_calls(self):
+        if self._full_rerate_pending:
+            return None
+        new_calls = self._read_new_calls()
+        if new_calls is None:
+            # 通话记录文件被整体改写过，无法续读
+            return None
+        return self._commit_new_calls(*new_calls)
+
+    def _commit_new_calls(self, records, offset, tail):
+        """对续读到的新通话记录计费，追加到内存数据、聚合和费用文件，并前移续读位置。"""
+        if records:
+            rows = self.rate_calls(records)
+            # 流式模式下话费合计可能还没建立：这时持锁直到费用文件写完，
+            # 查询线程以后从费用文件建立合计时正好包含这些行
+            guard = self.lock if self._fee_totals is None else nullcontext()
+            with guard:
+                with self.metrics.stage("indexCalls", len(records)), self.lock:
+                    if self.in_memory:
+                        # 先追加通话记录再更新倒排表，查询时拿到的下标总是有效的
+                        start = len(self.calls)
+                        self.calls.extend(records)
+                        self._index_calls(self._call_positions, self._call_times, records, self.calls, start)
+                        self.fees.extend(rows)
+                    if self._fee_totals is not None:
+                        self._index_fees(self._fee_totals, rows)
+                self._append_fee_rows(rows, (offset, tail, records[-1].get("callId")))
+            self._last_call_id = records[-1].get("callId")
+            self._calls_offset = offset
+            self._calls_tail = tail
+        return len(records)
+
+    def _rerate_all_calls(self):
+        """
+        重新读取通话记录文件，对全部通话记录计费，并整体重写费用文件。
+        通话记录逐批流式读取、计费，费用记录边算边写出；内存模式下同时逐批存入新的通话表和费用表，
+        流式模式下只保留按主叫号码的话费合计。
+        """
+        stream = RecordStream(self.calls_file, "callRecords", tail_size=CALLS_TAIL_CHECK_BYTES,
+                              locked=True)
+        # 新的数据和聚合先在锁外建好，再一次性替换
+        fee_totals = {}
+        call_positions = {}
+        call_times = {}
+        calls = CallTable()
+        fees = FeeTable(calls)
+        count = 0
+        last_call_id = None
+        pool = None
+        batch_size = RATING_BATCH_SIZE
+        if self.workers > 1:
+            batch_size = max(batch_size * self.workers, PARALLEL_MIN_RECORDS)
+
+        def rated_batches():
+            nonlocal count, last_call_id, pool
+            for batch in self.metrics.timed_batches("parseCalls", stream.batches(batch_size)):
+                # 通话记录足够多时才启动进程池
+                if pool is None and self.workers > 1 and len(batch) >= PARALLEL_MIN_RECORDS:
+                    pool = self.open_rating_pool()
+                if pool is not None:
+                    fees_list = self.rate_calls_parallel(batch, pool)
+                else:
+                    fees_list = self.rate_calls(batch)
+                with self.metrics.stage("indexCalls", len(batch)):
+                    self._index_fees(fee_totals, fees_list)
+                    if self.in_memory:
+                        calls.extend(batch)
+                        fees.extend(fees_list)
+                        self._index_calls(call_positions, call_times, batch, calls, count)
+                count += len(batch)
+                last_call_id = batch[-1].get("callId")
+                yield fees_list
+
+        def written_rows():
+            for fees_list in rated_batches():
+                # 这批费用记录全部交出之后才会回到这里，期间即 write_json_records 编码、写出这一批的时间
+                started = time.perf_counter()
+                yield from fees_list
+                self.metrics.add("writeFees", time.perf_counter() - started, len(fees_list))
+
+        try:
+            if self.in_memory:
+                # 费用记录都在新的费用表中，计费完成后整个交给后台线程写出
+                for _ in rated_batches():
+                    pass
+            else:
+                write_json_records(self.fees_file, "fees", written_rows(), self.fees_format)
+                self._save_state((stream.end_offset, stream.tail, last_call_id))
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        with self.lock:
+            self._fee_totals = fee_totals
+            if self.in_memory:
+                self.calls = calls
+                self.fees = fees
+                self._call_positions = call_positions
+                self._call_times = call_times
+        if self.in_memory:
+            # 整体重写会覆盖还没写出的追加，这些任务不必再执行
+            cursor = (stream.end_offset, stream.tail, last_call_id)
+            self._fees_writer.submit(functools.partial(self._write_fees, fees, len(fees), cursor), replaces=True)
+
+        self._last_call_id = last_call_id
+        self._calls_offset = stream.end_offset
+        self._calls_tail = stream.tail
+        self._full_rerate_pending = False
+        return count
+
+    @staticmethod
+    def _index_calls(positions, times, records, calls, start):
+        """
+        把刚追加到通话表 calls、从下标 start 开始的这批通话记录加入按主叫号码的索引。
+        每个号码的下标按开始时间排列（同一时间的按先后顺序），times 中保存对应的开始时间，供按时间段二分查找。
+        通话记录一般按时间先后追加，绝大多数情况下直接追加在末尾。
+        """
+        start_times = calls.start_times
+        for i, call in enumerate(records, start):
+            caller_number = call.get("callerNumber")
+            t = start_times[i]
+            caller_positions = positions.get(caller_number)
+            if caller_positions is None:
+                positions[caller_number] = array("I", (i,))
+                times[caller_number] = array("q", (t,))
+                continue
+            caller_times = times[caller_number]
+            if t >= caller_times[-1]:
+                caller_positions.append(i)
+                caller_times.append(t)
+            else:
+                k = bisect_right(caller_times, t)
+                caller_positions.insert(k, i)
+                caller_times.insert(k, t)
+
+    def _loaded_fee_totals(self):
+        """
+        返回按主叫号码的话费合计。流式模式下启动时不扫描费用文件，第一次话费查询时才读一遍建立，
+        只查用户、话单的命令不必付出这个代价。调用方需持有 self.lock。
+        """
+        if self._fee_totals is None:
+            totals = {}
+            if os.path.exists(self.fees_file):
+                with self.metrics.stage("indexFees") as box:
+                    self._index_fees(totals, RecordStream(self.fees_file, "fees"))
+                    box.records = sum(entry[2] for entry in totals.values())
+            self._fee_totals = totals
+        return self._fee_totals
+
+    @staticmethod
+    def _index_fees(totals, rows):
+        """把这批费用记录累加进按主叫号码的话费合计。"""
+        for fee in rows:
+            caller_number = fee.get("callerNumber")
+            entry = totals.get(caller_number)
+            if entry is None:
+                entry = totals[caller_number] = [0.0, 0.0, 0]
+            entry[0] += float(fee.get("localFee", 0.0))
+            entry[1] += float(fee.get("longDistanceFee", 0.0))
+            entry[2] += 1
+
+    @_instrumented("readNewCalls", records=lambda result: len(result[0]) if result else 0)
+    def _read_new_calls(self):
+        """
+        从上次的偏移处续读通话记录文件，返回 (新记录列表, 新偏移, 新校验字节)。
+        已计费部分被改写（或从未全量加载过）时返回 None；最后一条记录还没写完时先不读它。
+        """
+        offset = self._calls_offset
+        tail = self._calls_tail
+        if offset is None:
+            return None
+        try:
+            # 持共享锁读取：生成器正在写入的一批记录要么全部读到，要么一条也读不到
+            with file_lock(self.calls_file), open(self.calls_file, "rb") as f:
+                f.seek(offset - len(tail))
+                data = f.read()
+        except OSError:
+            return None
+        if not data.startswith(tail):
+            return None
+
+        if self.storage == "jsonl":
+            records, consumed = parse_jsonl(data[len(tail):])
+        else:
+            parsed = self._parse_json_tail(data[len(tail):], tail)
+            if parsed is None:
+                return None
+            records, consumed = parsed
+
+        data = data[:len(tail) + consumed]
+        return records, offset + consumed, data[-CALLS_TAIL_CHECK_BYTES:]
+
+    @staticmethod
+    def _parse_json_tail(data, tail):
+        """
+        解析 {"callRecords": [...]} 文件在上次偏移之后新增的记录，返回 (记录列表, 已解析的字节数)。
+        内容与追加布局不符时返回 None。
+        """
+        text = data.decode("utf-8", errors="replace")
+        decoder = json.JSONDecoder()
+        records = []
+        # 偏移处紧跟 "[" 说明原来是空列表，第一条新记录前没有逗号
+        need_comma = not tail.rstrip().endswith(b"[")
+        pos = consumed = 0
+        while True:
+            pos = _JSON_WS.match(text, pos).end()
+            if pos >= len(text) or text[pos] == "]":
+                break
+            if text[pos] == ",":
+                if not need_comma:
+                    return None
+                pos = _JSON_WS.match(text, pos + 1).end()
+            elif need_comma:
+                return None
+            try:
+                record, pos = decoder.raw_decode(text, pos)
+            except ValueError:
+                # 记录写了一半，下次再读
+                break
+            if not isinstance(record, dict):
+                return None
+            records.append(record)
+            need_comma = True
+            consumed = pos
+
+        return records, len(text[:consumed].encode("utf-8"))
+
+    # ---------- 查询接口 ----------
+
+    def _period_positions(self, phone_number, start, end):
+        """
+        该号码在 [start, end) 时间段内的通话在通话表中的下标，按通话记录的先后顺序排列。
+        在按时间排序的索引上二分查找；起止时间都不限时返回全部通话（包括开始时间格式不对的）。
+        调用方需持有 self.lock。
+        """
+        positions = self._call_positions.get(phone_number)
+        if positions is None:
+            return []
+        if start is None and end is None:
+            return positions
+        times = self._call_times[phone_number]
+        lo, hi = _period_keys(start, end)
+        return sorted(positions[bisect_left(times, lo):bisect_left(times, hi)])
+
+    def _scan_period_calls(self, phone_number, start, end):
+        """流式模式：顺序扫描通话记录文件，产出 (下标, 通话记录)，只含该号码在 [start, end) 内的通话。"""
+        lo, hi = _period_keys(start, end)
+        bounded = start is not None or end is not None
+        for i, call in enumerate(RecordStream(self.calls_file, "callRecords", locked=True)):
+            if call.get("callerNumber") != phone_number:
+                continue
+            if bounded:
+                t = pack_start_time(call.get("startTime"))
+                if t is None or not lo <= t < hi:
+                    continue
+            yield i, call
+
+    @_instrumented("queryFeeSummary")
+    def query_fee_summary(self, phone_number: str, start=None, end=None):
+        """
+        话费查询：返回 userName, local_sum, long_sum, total_sum
+        给出 start / end（"YYYY-MM-DD" 或 "YYYY-MM-DD HH:MM:SS"）时只统计开始时间在 [start, end) 内的通话，
+        计费月份可用 month_period 换算成起止时间。
+        """
+        user_name = self.get_user_name(phone_number)
+        start = normalize_period_bound(start)
+        end = normalize_period_bound(end)
+        local_sum = 0.0
+        long_sum = 0.0
+
+        if start is None and end is None:
+            with self.lock:
+                totals = self._loaded_fee_totals().get(phone_number)
+                if totals is not None:
+                    local_sum, long_sum = totals[0], totals[1]
+        elif self.in_memory:
+            with self.lock:
+                fee_count = len(self.fees)
+                for i in self._period_positions(phone_number, start, end):
+                    if i < fee_count:
+                        local_fee, long_fee = self.fees.amounts(i)
+                        local_sum += local_fee
+                        long_sum += long_fee
+        elif os.path.exists(self.fees_file):
+            # 流式模式：费用文件与通话记录文件逐条对应，两个文件一起顺序扫描
+            wanted = (i for i, _ in self._scan_period_calls(phone_number, start, end))
+            i = next(wanted, None)
+            for j, fee in enumerate(RecordStream(self.fees_file, "fees")):
+                if i is None:
+                    break
+                if j == i:
+                    local_sum += float(fee.get("localFee", 0.0))
+                    long_sum += float(fee.get("longDistanceFee", 0.0))
+                    i = next(wanted, None)
+
+        local_sum = round(local_sum, 2)
+        long_sum = round(long_sum, 2)
+        total_sum = round(local_sum + long_sum, 2)
+
+        return user_name, local_sum, long_sum, total_sum
+
+    @_instrumented("queryCallRecords", records=len)
+    def query_call_records(self, phone_number: str, start=None, end=None, offset=0, limit=None):
+        """
+        话单查询：该号码作为主叫的通话，按通话记录的先后顺序；start / end 的含义与 query_fee_summary 相同。
+        offset / limit 只取其中从第 offset 条开始的至多 limit 条，界面分页显示时使用。
+        """
+        caller_name = self.get_user_name(phone_number)
+        start = normalize_period_bound(start)
+        end = normalize_period_bound(end)
+        stop = None if limit is None else offset + limit
+        if self.in_memory:
+            with self.lock:
+                # 下标按开始时间排列；通话记录一般按时间先后追加，这里的排序几乎不用移动元素
+                positions = sorted(self._period_positions(phone_number, start, end))[offset:stop]
+                calls = [self.calls[i] for i in positions]
+        else:
+            # 流式模式：顺序扫描通话记录文件，只取该号码作为主叫的通话
+            calls = itertools.islice((call for _, call in self._scan_period_calls(phone_number, start, end)),
+                                     offset, stop)
+        records = []
+        for call in calls:
+            callee_number = call.get("calleeNumber")
+            callee_name = self.get_user_name(callee_number)
+            records.append({
+                "userName": caller_name,
+                "callerNumber": call.get("callerNumber"),
+                "calleeNumber": callee_number,
+                "calleeName": callee_name,
+                "startTime": call.get("startTime"),
+                "durationSeconds": call.get("durationSeconds"),
+                "callType": call.get("callType", "local")
+            })
+        return records
+
+    @_instrumented("countCallRecords")
+    def count_call_records(self, phone_number: str, start=None, end=None):
+        """该号码作为主叫、开始时间在 [start, end) 内的通话条数，即 query_call_records 不分页时返回的条数。"""
+        start = normalize_period_bound(start)
+        end = normalize_period_bound(end)
+        if self.in_memory:
+            with self.lock:
+                return len(self._period_positions(phone_number, start, end))
+        return sum(1 for _ in self._scan_period_calls(phone_number, start, end))
+
+    @_instrumented("queryBillingMonths")
+    def query_billing_months(self):
+        """有通话记录的计费月份列表（"YYYY-MM"，从早到晚），供界面选择计费周期。"""
+        if self.in_memory:
+            with self.lock:
+                months = {t // 100000000 for t in self.calls.start_times if t >= 0}
+        else:
+            months = set()
+            for call in RecordStream(self.calls_file, "callRecords", locked=True):
+                t = pack_start_time(call.get("startTime"))
+                if t is not None:
+                    months.add(t // 100000000)
+        return [f"{m // 100:04d}-{m % 100:02d}" for m in sorted(months)]
+
+    # ---------- 批量出账 ----------
+
+    def iter_period_fees(self, start=None, end=None):
+        """
+        按通话记录的先后顺序产出 [start, end) 期间每条已计费通话的 (通话记录, 费用记录)。
+        起止时间须已经过 normalize_period_bound；顺序扫描一遍，不按号码分别查找。
+        """
+        lo, hi = _period_keys(start, end)
+        bounded = start is not None or end is not None
+        if self.in_memory:
+            # 通话表和费用表只会追加或整体替换，取出当前的表和条数后不必一直持锁
+            with self.lock:
+                calls, fees = self.calls, self.fees
+                count = len(fees)
+            start_times = calls.start_times
+            for i in range(count):
+                if not bounded or lo <= start_times[i] < hi:
+                    yield calls[i], fees[i]
+            return
+        if not os.path.exists(self.fees_file):
+            return
+        calls = RecordStream(self.calls_file, "callRecords", locked=True)
+        for call, fee in zip(calls, RecordStream(self.fees_file, "fees")):
+            if bounded:
+                t = pack_start_time(call.get("startTime"))
+                if t is None or not lo <= t < hi:
+                    continue
+            yield call, fee
+
+    def generate_bills(self, start=None, end=None, itemized=True):
+        """
+        生成 [start, end) 期间 users.json 中每个用户的账单，按 users.json 的顺序产出。
+        账单含本地、长途话费合计、总计和通话次数（金额的舍入与 query_fee_summary 相同），
+        itemized 为 True 时还带有逐条通话明细 "calls"。期间没有通话的用户也有一张金额为 0 的账单。
+        整个期间的费用只顺序扫描一遍；明细按号码暂存为元组，输出时才组装成字典。
+        """
+        start = normalize_period_bound(start)
+        end = normalize_period_bound(end)
+        with self.lock:
+            users = self.users.get("users", [])
+        phones = {u.get("phoneNumber") for u in users}
+        # 号码 → [本地话费合计, 长途话费合计, 通话次数]，号码 → 明细元组列表
+        totals = {}
+        items = {}
+        for call, fee in self.iter_period_fees(start, end):
+            phone_number = call.get("callerNumber")
+            if phone_number not in phones:
+                continue
+            local_fee = float(fee.get("localFee", 0.0))
+            long_fee = float(fee.get("longDistanceFee", 0.0))
+            t = totals.get(phone_number)
+            if t is None:
+                t = totals[phone_number] = [0.0, 0.0, 0]
+                items[phone_number] = []
+            t[0] += local_fee
+            t[1] += long_fee
+            t[2] += 1
+            if itemized:
+                items[phone_number].append((
+                    call.get("callId"), call.get("calleeNumber"), call.get("startTime"),
+                    call.get("durationSeconds"), call.get("callType", "local"),
+                    fee.get("localFee"), fee.get("longDistanceFee"), fee.get("totalFee")
+                ))
+
+        for u in users:
+            phone_number = u.get("phoneNumber")
+            local_sum, long_sum, count = totals.get(phone_number, (0.0, 0.0, 0))
+            local_sum = round(local_sum, 2)
+            long_sum = round(long_sum, 2)
+            bill = {
+                "phoneNumber": phone_number,
+                "userId": u.get("userId"),
+                "userName": u.get("userName", "未知用户"),
+                "periodStart": start,
+                "periodEnd": end,
+                "callCount": count,
+                "localFee": local_sum,
+                "longDistanceFee": long_sum,
+                "totalFee": round(local_sum + long_sum, 2),
+            }
+            if itemized:
+                bill["calls"] = [dict(zip(BILL_ITEM_FIELDS, item)) for item in items.get(phone_number, ())]
+            yield bill
+
+    @_instrumented("exportBills", records=lambda report: report["calls"])
+    def export_bills(self, path, start=None, end=None, itemized=True):
+        """
+        批量出账：把 generate_bills 的账单逐张写到 path（.csv 为 CSV，其余为 JSON Lines），
+        返回出账统计：用户数、通话条数、用时和每秒处理的用户数、通话条数。
+        """
+        started = time.perf_counter()
+        user_count, call_count, total_fee = write_bills(path, self.generate_bills(start, end, itemized))
+        seconds = time.perf_counter() - started
+        return {
+            "users": user_count,
+            "calls": call_count,
+            "totalFee": round(total_fee, 2),
+            "seconds": round(seconds, 3),
+            "usersPerSecond": round(user_count / seconds) if seconds > 0 else None,
+            "callsPerSecond": round(call_count / seconds) if seconds > 0 else None,
+            "output": path,
+        }
+
+
+# -------------------- 多进程分片计费 --------------------
+
+# 工作进程中的计费实例，由 _init_shard_worker 创建
+_shard_rater = None
+
+
+def _init_shard_worker(users, rates, tariffs):
+    global _shard_rater
+    _shard_rater = BillingSystem.for_rating(users, rates, tariffs)
+
+
+def _rate_shard(records):
+    """在工作进程中对一个分片计费，返回费用记录列表。"""
+    return _shard_rater.rate_calls(records)
+
+
+# -------------------- SQLite 存储 --------------------
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    userId TEXT,
+    userName TEXT,
+    phoneNumber TEXT
+);
+CREATE TABLE IF NOT EXISTS rates (
+    areaCode TEXT,
+    areaName TEXT,
+    ratePerMinute REAL
+);
+CREATE TABLE IF NOT EXISTS calls (
+    seq INTEGER PRIMARY KEY,
+    callId,
+    callerNumber,
+    calleeNumber,
+    startTime,
+    durationSeconds,
+    callType,
+    longDistanceAreaCode
+);
+CREATE TABLE IF NOT EXISTS fees (
+    seq INTEGER PRIMARY KEY,
+    callId,
+    callerNumber,
+    calleeNumber,
+    userName,
+    localFee,
+    longDistanceFee,
+    totalFee
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+CREATE INDEX IF NOT EXISTS idx_users_phone ON users (phoneNumber);
+CREATE INDEX IF NOT EXISTS idx_calls_caller ON calls (callerNumber);
+CREATE INDEX IF NOT EXISTS idx_calls_callee ON calls (calleeNumber);
+CREATE INDEX IF NOT EXISTS idx_calls_start ON calls (startTime);
+CREATE INDEX IF NOT EXISTS idx_calls_caller_start ON calls (callerNumber, startTime);
+CREATE INDEX IF NOT EXISTS idx_fees_caller ON fees (callerNumber);
+"""
+
+# 与 pack_start_time 能编码的 "YYYY-MM-DD HH:MM:SS" 格式对应的 GLOB 模式
+_START_TIME_GLOB = "[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9] [0-9][0-9]:[0-9][0-9]:[0-9][0-9]"
+
+# 全量重算时每批从数据库取出并计费的通话条数
+SQLITE_BATCH_SIZE = 10000
+# 数据库结构的版本（PRAGMA user_version）；calls / fees 表的数据列不声明类型（见 _to_sqlite），
+# 版本不同的数据库打开时删掉重建
+SQLITE_SCHEMA_VERSION = 2
+
+
+def _to_sqlite(value):
+    """
+    把通话记录、费用记录中的 JSON 值转成存入数据库的值，读出时由 _from_sqlite 原样还原。
+    calls / fees 表的数据列不声明类型，字符串、整数、浮点数（包括 -0.0）按原类型保存；
+    SQLite 存不下的值（超出 64 位的整数、NaN、布尔值、对象和数组）存成其 JSON 文本的 BLOB，
+    JSON 中不会出现 BLOB，读出时不会混淆。
+    """
+    kind = type(value)
+    if value is None or kind is str:
+        return value
+    if (kind is float and value == value) or (kind is int and -2 ** 63 <= value < 2 ** 63):
+        return value
+    return json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+
+def _from_sqlite(value):
+    """_to_sqlite 的逆变换。"""
+    return json.loads(value) if type(value) is bytes else value
+
+
+class SqliteBillingSystem(BillingSystem):
+    """
+    用标准库 sqlite3 保存用户、费率、通话记录和费用的计费系统，接口与 BillingSystem 相同。
+    - 通话记录仍由生成脚本写入 calls.json / calls.jsonl，这里增量导入到 calls 表，不在内存中保留
+    - 续读位置保存在 meta 表中，重新启动后也只导入新追加的记录
+    - 话费汇总和话单查询是 callerNumber 索引上的 SQL 查询
+    - import_json / export_json 与现有的 JSON 文件互相导入导出；calls / fees 表按 JSON 中的原值保存（见 _to_sqlite），
+      导出的费用文件与 JSON 后端写出的逐字节相同
+    """
+
+    def __init__(self, storage="auto", db_path=None, workers=1, in_memory=True, profile=None, fees_format=None):
+        # 默认路径在调用时才取，set_data_dir 之后也能生效
+        db_path = db_path or DB_FILE
+        # in_memory=False 时与文件存储的流式模式一样，启动时不计费，留给第一次 compute_all_fees
+        self.db_path = db_path
+        # 写连接只在计费时使用（可能在后台线程中）；查询使用单独的读连接，
+        # WAL 模式下读连接只看到已提交的数据，不会被正在进行的计费事务阻塞
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != SQLITE_SCHEMA_VERSION:
+            # 旧结构的通话和费用都能从通话记录文件重新导入：删掉重建，清空续读位置后全量重算
+            self.db.executescript("DROP TABLE IF EXISTS calls; DROP TABLE IF EXISTS fees; DROP TABLE IF EXISTS meta;")
+            self.db.execute(f"PRAGMA user_version = {SQLITE_SCHEMA_VERSION}")
+        self.db.executescript(SQLITE_SCHEMA)
+        self.read_db = sqlite3.connect(db_path, check_same_thread=False)
+        super().__init__(storage, workers, in_memory, profile, fees_format)
+
+    def _build_indexes(self):
+        super()._build_indexes()
+        # users / rates 表与内存中的数据保持一致
+        with self.db:
+            self.db.execute("DELETE FROM users")
+            self.db.executemany(
+                "INSERT INTO users (userId, userName, phoneNumber) VALUES (?, ?, ?)",
+                [(u.get("userId"), u.get("userName"), u.get("phoneNumber"))
+                 for u in self.users.get("users", [])]
+            )
+            self.db.execute("DELETE FROM rates")
+            self.db.executemany(
+                "INSERT INTO rates (areaCode, areaName, ratePerMinute) VALUES (?, ?, ?)",
+                [(r.get("areaCode"), r.get("areaName"), r.get("ratePerMinute"))
+                 for r in self.rates.get("longDistanceRates", [])]
+            )
+
+    def _load_rated_data(self):
+        meta = dict(self.db.execute("SELECT key, value FROM meta"))
+        if meta.get("callsFile") == self.calls_file:
+            self._calls_offset = meta.get("callsOffset")
+            self._calls_tail = meta.get("callsTail") or b""
+            self._last_call_id = _from_sqlite(meta.get("lastCallId"))
+            self._full_rerate_pending = meta.get("referenceDigest") != self._reference_digest
+        if self._full_rerate_pending and self.in_memory:
+            self.compute_all_fees()
+
+    def _save_cursor(self, offset, tail, last_call_id):
+        self.db.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            [("callsFile", self.calls_file),
+             ("callsOffset", offset),
+             ("callsTail", tail),
+             ("lastCallId", _to_sqlite(last_call_id)),
+             ("referenceDigest", self._reference_digest)]
+        )
+
+    def _insert_calls(self, records):
+        """把通话记录写入 calls 表并计费写入 fees 表，两张表用同一个 seq 对应。"""
+        row = self.db.execute("SELECT COALESCE(MAX(seq), 0) FROM calls").fetchone()
+        start = row[0] + 1
+        with self.metrics.stage("insertCalls", len(records)):
+            self.db.executemany(
+                "INSERT INTO calls (seq, callId, callerNumber, calleeNumber, startTime, "
+                "durationSeconds, callType, longDistanceAreaCode) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(seq,) + tuple(_to_sqlite(call.get(k)) for k in CALL_FIELDS)
+                 for seq, call in enumerate(records, start)]
+            )
+        self._insert_fees(range(start, start + len(records)), self.rate_calls(records))
+
+    def _insert_fees(self, seqs, rows):
+        with self.metrics.stage("writeFees", len(rows)):
+            self.db.executemany(
+                "INSERT INTO fees (seq, callId, callerNumber, calleeNumber, userName, "
+                "localFee, longDistanceFee, totalFee) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(seq,) + tuple(_to_sqlite(fee[k]) for k in FEE_FIELDS) for seq, fee in zip(seqs, rows)]
+            )
+
+    def _commit_new_calls(self, records, offset, tail):
+        last_call_id = records[-1].get("callId") if records else self._last_call_id
+        with self.db:
+            if records:
+                self._insert_calls(records)
+            self._save_cursor(offset, tail, last_call_id)
+        self._calls_offset = offset
+        self._calls_tail = tail
+        self._last_call_id = last_call_id
+        return len(records)
+
+    def _rerate_all_calls(self):
+        """
+        全量重算：calls 表仍与通话记录文件一致时只导入新记录，然后按当前费率重算全部费用；
+        否则从通话记录文件重新导入全部通话。
+        """
+        new_calls = self._read_new_calls()
+        with self.db:
+            if new_calls is None:
+                # 逐批流式导入，不把整个通话记录文件读进内存
+                stream = RecordStream(self.calls_file, "callRecords", tail_size=CALLS_TAIL_CHECK_BYTES,
+                                      locked=True)
+                self.db.execute("DELETE FROM calls")
+                self.db.execute("DELETE FROM fees")
+                count = 0
+                last_call_id = None
+                for records in self.metrics.timed_batches("parseCalls", stream.batches(SQLITE_BATCH_SIZE)):
+                    self._insert_calls(records)
+                    count += len(records)
+                    last_call_id = records[-1].get("callId")
+                offset, tail = stream.end_offset, stream.tail
+            else:
+                records, offset, tail = new_calls
+                self.db.execute("DELETE FROM fees")
+                cursor = self.db.execute(
+                    "SELECT seq, " + ", ".join(CALL_FIELDS) + " FROM calls ORDER BY seq"
+                )
+                count = len(records)
+                pool = self.open_rating_pool() if self.workers > 1 else None
+                try:
+                    while True:
+                        rows = cursor.fetchmany(SQLITE_BATCH_SIZE * max(1, self.workers))
+                        if not rows:
+                            break
+                        batch = [dict(zip(CALL_FIELDS, map(_from_sqlite, row[1:]))) for row in rows]
+                        if pool is not None:
+                            fees_list = self.rate_calls_parallel(batch, pool)
+                        else:
+                            fees_list = self.rate_calls(batch)
+                        self._insert_fees([row[0] for row in rows], fees_list)
+                        count += len(rows)
+                finally:
+                    if pool is not None:
+                        pool.shutdown()
+                if records:
+                    self._insert_calls(records)
+                last_call_id = records[-1].get("callId") if records else self._last_call_id
+            self._save_cursor(offset, tail, last_call_id)
+        self._calls_offset = offset
+        self._calls_tail = tail
+        self._last_call_id = last_call_id
+        self._full_rerate_pending = False
+        return count
+
+    # ---------- JSON 导入导出 ----------
+
+    def import_json(self):
+        """从 users.json、rates.json 和通话记录文件重新导入全部数据，并重算费用。"""
+        self._ref_signature = None
+        self._refresh_reference_data()
+        self._calls_offset = None
+        self._rerate_all_calls()
+
+    def export_json(self, path=None):
+        """
+        把 fees 表导出为费用文件（默认 fees.json 或 fees.jsonl），按 fees_format 编码，与 JSON 后端写出的完全一致。
+        逐行写出，不把全部费用读进内存。
+        """
+        path = path or self.fees_file
+        cursor = self.read_db.execute("SELECT " + ", ".join(FEE_FIELDS) + " FROM fees ORDER BY seq")
+        rows = (dict(zip(FEE_FIELDS, map(_from_sqlite, row))) for row in cursor)
+        write_json_records(path, "fees", rows, self.fees_format)
+
+    # ---------- 查询接口 ----------
+
+    @staticmethod
+    def _period_condition(start, end):
+        """
+        calls 表上 [start, end) 时间段的 SQL 条件及参数，由 (callerNumber, startTime) 索引支持。
+        与内存中的索引一致，开始时间格式不对的通话不属于任何时间段。
+        """
+        if start is None and end is None:
+            return "", ()
+        sql = " AND calls.startTime GLOB ?"
+        params = (_START_TIME_GLOB,)
+        if start is not None:
+            sql += " AND calls.startTime >= ?"
+            params += (start,)
+        if end is not None:
+            sql += " AND calls.startTime < ?"
+            params += (end,)
+        return sql, params
+
+    @_instrumented("queryFeeSummary")
+    def query_fee_summary(self, phone_number: str, start=None, end=None):
+        user_name = self.get_user_name(phone_number)
+        start = normalize_period_bound(start)
+        end = normalize_period_bound(end)
+        if start is None and end is None:
+            cursor = self.read_db.execute(
+                "SELECT localFee, longDistanceFee FROM fees WHERE callerNumber = ? ORDER BY seq",
+                (phone_number,)
+            )
+        else:
+            condition, params = self._period_condition(start, end)
+            cursor = self.read_db.execute(
+                "SELECT fees.localFee, fees.longDistanceFee FROM calls JOIN fees ON fees.seq = calls.seq "
+                "WHERE calls.callerNumber = ?" + condition + " ORDER BY calls.seq",
+                (phone_number,) + params
+            )
+        # 不用 SQL 的 SUM：按通话顺序逐条相加，浮点误差与内存中的话费合计（_index_fees）一致，
+        # 非数值的费用也与其一样按 float() 处理
+        local_sum = long_sum = 0.0
+        for local_fee, long_fee in cursor:
+            local_sum += float(_from_sqlite(local_fee))
+            long_sum += float(_from_sqlite(long_fee))
+
+        local_sum = round(local_sum, 2)
+        long_sum = round(long_sum, 2)
+        total_sum = round(local_sum + long_sum, 2)
+
+        return user_name, local_sum, long_sum, total_sum
+
+    @_instrumented("queryCallRecords", records=len)
+    def query_call_records(self, phone_number: str, start=None, end=None, offset=0, limit=None):
+        caller_name = self.get_user_name(phone_number)
+        condition, params = self._period_condition(normalize_period_bound(start), normalize_period_bound(end))
+        cursor = self.read_db.execute(
+            "SELECT callerNumber, calleeNumber, startTime, durationSeconds, callType FROM calls "
+            "WHERE callerNumber = ?" + condition + " ORDER BY seq LIMIT ? OFFSET ?",
+            (phone_number,) + params + (-1 if limit is None else limit, offset)
+        )
+        return [
+            {
+                "userName": caller_name,
+                "callerNumber": caller_number,
+                "calleeNumber": callee_number,
+                "calleeName": self.get_user_name(callee_number),
+                "startTime": start_time,
+                "durationSeconds": duration_seconds,
+                "callType": call_type or "local"
+            }
+            for caller_number, callee_number, start_time, duration_seconds, call_type
+            in (map(_from_sqlite, row) for row in cursor)
+        ]
+
+    @_instrumented("countCallRecords")
+    def count_call_records(self, phone_number: str, start=None, end=None):
+        condition, params = self._period_condition(normalize_period_bound(start), normalize_period_bound(end))
+        (count,) = self.read_db.execute(
+            "SELECT COUNT(*) FROM calls WHERE callerNumber = ?" + condition, (phone_number,) + params
+        ).fetchone()
+        return count
+
+    @_instrumented("queryBillingMonths")
+    def query_billing_months(self):
+        cursor = self.read_db.execute("SELECT DISTINCT substr(startTime, 1, 7) FROM calls ORDER BY 1")
+        # 不是字符串的开始时间（按 JSON 文本存成 BLOB，见 _to_sqlite）不属于任何月份
+        return [month for (month,) in cursor if isinstance(month, str) and _MONTH.fullmatch(month)]
+
+    def iter_period_fees(self, start=None, end=None):
+        condition, params = self._period_condition(start, end)
+        cursor = self.read_db.execute(
+            "SELECT calls.callId, calls.callerNumber, calls.calleeNumber, calls.startTime, calls.durationSeconds, "
+            "calls.callType, fees.localFee, fees.longDistanceFee, fees.totalFee "
+            "FROM calls JOIN fees ON fees.seq = calls.seq WHERE 1" + condition + " ORDER BY calls.seq",
+            params
+        )
+        for row in cursor:
+            (call_id, caller_number, callee_number, start_time, duration_seconds, call_type,
+             local_fee, long_fee, total_fee) = map(_from_sqlite, row)
+            call = {"callId": call_id, "callerNumber": caller_number, "calleeNumber": callee_number,
+                    "startTime": start_time, "durationSeconds": duration_seconds, "callType": call_type or "local"}
+            fee = {"localFee": local_fee, "longDistanceFee": long_fee, "totalFee": total_fee}
+            yield call, fee
+
+
+def create_billing_system(storage="auto", workers=1, in_memory=True, profile=None, fees_format=None):
+    """
+    按存储方式创建计费系统："json" / "jsonl" / "auto" 使用文件，"sqlite" 使用数据库。
+    in_memory 对文件存储决定是否在内存中保留通话记录；数据库本来就不在内存中保留通话记录，
+    in_memory=False 时只是启动时不计费（与流式模式一样留给第一次 compute_all_fees）。
+    profile 为要打开的剖析方式，为 None 时取环境变量 BILLING_PROFILE。
+    fees_format 为 fees.json 的编码方式（数据库存储时用于 export_json），为 None 时取 FEES_FORMAT。
+    """
+    if storage == "sqlite":
+        return SqliteBillingSystem(workers=workers, in_memory=in_memory, profile=profile, fees_format=fees_format)
+    return BillingSystem(storage, workers, in_memory, profile, fees_format)
+
+
+# -------------------- 批量出账 --------------------
+
+# 账单明细中每条通话的字段
+BILL_ITEM_FIELDS = ("callId", "calleeNumber", "startTime", "durationSeconds", "callType",
+                    "localFee", "longDistanceFee", "totalFee")
+# CSV 账单的列：每个用户先是各条通话明细（lineType 为 "call"），最后一行是合计（lineType 为 "total"）
+BILL_CSV_COLUMNS = ("phoneNumber", "userId", "userName", "periodStart", "periodEnd", "lineType",
+                    "callCount") + BILL_ITEM_FIELDS
+
+
+def write_bills(path, bills):
+    """
+    把账单逐张写到 path：.csv 文件按 BILL_CSV_COLUMNS 每条明细一行、每个用户一行合计，
+    其余每张账单写成 JSON Lines 的一行。bills 可以是生成器；先写临时文件再原子替换。
+    返回 (账单数, 通话明细条数, 话费总计)。
+    """
+    user_count = call_count = 0
+    total_fee = 0.0
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+        if path.endswith(".csv"):
+            writer = csv.writer(f, lineterminator="\n")
+            writer.writerow(BILL_CSV_COLUMNS)
+        for bill in bills:
+            user_count += 1
+            call_count += bill["callCount"]
+            total_fee += bill["totalFee"]
+            if not path.endswith(".csv"):
+                f.write(json.dumps(bill, ensure_ascii=False))
+                f.write("\n")
+                continue
+            head = (bill["phoneNumber"], bill["userId"], bill["userName"], bill["periodStart"], bill["periodEnd"])
+            for item in bill.get("calls", ()):
+                writer.writerow(head + ("call", None) + tuple(item[k] for k in BILL_ITEM_FIELDS))
+            writer.writerow(head + ("total", bill["callCount"]) + (None,) * 5
+                            + (bill["localFee"], bill["longDistanceFee"], bill["totalFee"]))
+    os.replace(tmp_path, path)
+    return user_count, call_count, total_fee
+
+
+# -------------------- 文件变化检测 --------------------
+
+# 被监视的文件发生变化后，等它静止这么久（秒）再计费，把一连串写入合并成一轮
+CHANGE_DEBOUNCE = 0.2
+# 文件一直在被写入时，最多推迟这么久（秒）也要计费一次
+CHANGE_MAX_DELAY = 1.0
+# 没有 inotify 时比较文件状态的间隔（秒）
+CHANGE_POLL_INTERVAL = 0.5
+
+# inotify 事件掩码（见 <sys/inotify.h>）
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class FileChangeWatcher:
+    """
+    检测若干文件是否发生变化。
+    - Linux 上通过 ctypes 调用 inotify 监听这些文件所在的目录，写入、原子替换、删除都能立即感知，空闲时不占 CPU
+    - 其他系统或 inotify 不可用时，退回到定时比较文件的 (修改时间, 大小)
+    """
+
+    def __init__(self, paths):
+        self.paths = [os.path.abspath(p) for p in paths]
+        self._names = {os.path.basename(p) for p in self.paths}
+        self._signatures = [file_signature(p) for p in self.paths]
+        self._inotify_fd = self._open_inotify()
+
+    def _open_inotify(self):
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        mask = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+        for directory in {os.path.dirname(p) for p in self.paths}:
+            if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+                os.close(fd)
+                return None
+        return fd
+
+    @property
+    def uses_inotify(self):
+        return self._inotify_fd is not None
+
+    def close(self):
+        if self._inotify_fd is not None:
+            os.close(self._inotify_fd)
+            self._inotify_fd = None
+
+    def _changed(self, timeout, stop_event=None):
+        """最多等待 timeout 秒，期间被监视的文件有变化则返回 True。"""
+        if self._inotify_fd is None:
+            if stop_event is not None:
+                stop_event.wait(timeout)
+            else:
+                time.sleep(timeout)
+            signatures = [file_signature(p) for p in self.paths]
+            changed = signatures != self._signatures
+            self._signatures = signatures
+            return changed
+
+        readable, _, _ = select.select([self._inotify_fd], [], [], timeout)
+        if not readable:
+            return False
+        changed = False
+        while True:
+            try:
+                data = os.read(self._inotify_fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            pos = 0
+            while pos < len(data):
+                _, _, _, length = INOTIFY_EVENT.unpack_from(data, pos)
+                pos += INOTIFY_EVENT.size
+                name = data[pos:pos + length].rstrip(b"\0")
+                pos += length
+                if os.fsdecode(name) in self._names:
+                    changed = True
+        return changed
+
+    def wait(self, timeout, stop_event=None):
+        """
+        等到被监视的文件发生变化、并且静止 CHANGE_DEBOUNCE 秒（最多再等 CHANGE_MAX_DELAY 秒）后返回 True；
+        超时或 stop_event 被设置时返回 False。
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            if stop_event is not None and stop_event.is_set():
+                return False
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if self._changed(min(remaining, CHANGE_POLL_INTERVAL), stop_event):
+                break
+
+        # 防抖：连续写入合并成一次计费
+        first_change = time.monotonic()
+        while time.monotonic() - first_change < CHANGE_MAX_DELAY:
+            if not self._changed(CHANGE_DEBOUNCE, stop_event):
+                break
+        return True
+
+
+# -------------------- 后台写文件 --------------------
+
+class BackgroundWriter:
+    """
+    在后台线程中按提交顺序执行写文件的任务，提交任务的一方（计费）不必等待磁盘。
+    - submit(job, replaces=False)：job 为无参数的函数；replaces=True 表示它会整体重写文件，
+      排在它前面、还没开始执行的任务都不必再执行
+    - 线程只在有任务时运行，任务做完就退出；不是守护线程，程序退出前会先把已提交的任务写完
+    - 任务出错时打印出来并记下，由下一次 flush() 抛出
+    同一进程中每个文件只用一个实例（for_path），多个计费系统写同一个文件时也按顺序写出，不会同时写同一个临时文件。
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def for_path(cls, path):
+        """取得写 path 的实例，没有时新建一个。"""
+        path = os.path.abspath(path)
+        with cls._instances_lock:
+            writer = cls._instances.get(path)
+            if writer is None:
+                writer = cls._instances[path] = cls(os.path.basename(path) + "-writer")
+            return writer
+
+    def __init__(self, name):
+        self.name = name
+        self._jobs = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._error = None
+
+    def submit(self, job, replaces=False):
+        with self._cond:
+            if replaces:
+                self._jobs.clear()
+            self._jobs.append(job)
+            if self._thread is None:
+                # 明确指定不是守护线程：在后台计费线程（守护线程）中提交时，默认会继承它的设置
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=False)
+                self._thread.start()
+
+    def flush(self):
+        """等待已提交的任务全部执行完；其间有任务出错时抛出该异常。"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._thread is None)
+            error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._jobs:
+                    self._thread = None
+                    self._cond.notify_all()
+                    return
+                job = self._jobs.popleft()
+            try:
+                job()
+            except Exception as e:
+                print("后台写文件出错：", e)
+                with self._cond:
+                    self._error = e
+
+
+# -------------------- 后台计费 --------------------
+
+# 即使没有检测到文件变化，也至少每隔这么久（秒）计费一次，作为兜底
+RATING_FALLBACK_INTERVAL = 60
+
+# 后台计费线程每完成一轮发布的状态快照：完成时间、本轮计费条数、耗时（秒）、
+# 每秒计费条数、延迟（通话记录文件最后一次写入到费用可查询之间的秒数）以及出错信息
+RatingStatus = namedtuple(
+    "RatingStatus", ["rated_at", "records", "seconds", "records_per_sec", "lag", "error"]
+)
+
+
+class RatingWorker(threading.Thread):
+    """
+    后台计费线程：通话记录、users.json、rates.json 或 tariffs.json 发生变化时调用 compute_all_fees，不占用 tkinter 主循环。
+    没有变化时只在 interval 秒后兜底计费一次。计费结果在 BillingSystem 内部持锁一次性合并；每轮结束后把 RatingStatus 放进 status_queue，
+    由界面线程用 after() 轮询取出（tkinter 控件只能在主线程中操作）。
+    """
+
+    def __init__(self, billing, interval=RATING_FALLBACK_INTERVAL):
+        super().__init__(daemon=True)
+        self.billing = billing
+        self.interval = interval
+        self.status_queue = queue.Queue()
+        self.watcher = FileChangeWatcher([billing.calls_file, USERS_FILE, RATES_FILE, TARIFFS_FILE])
+        self._stop_event = threading.Event()
+
+    def run(self):
+        try:
+            while not self._stop_event.is_set():
+                self.status_queue.put(self.rate_once())
+                self.watcher.wait(self.interval, self._stop_event)
+        finally:
+            self.watcher.close()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def rate_once(self):
+        """执行一轮计费并返回对应的 RatingStatus。"""
+        signature = file_signature(self.billing.calls_file)
+        started = time.time()
+        records = 0
+        error = None
+        try:
+            records = self.billing.compute_all_fees()
+        except Exception as e:
+            print("自动计算费用出错：", e)
+            error = str(e)
+        finished = time.time()
+
+        seconds = finished - started
+        lag = 0.0
+        if records and signature is not None:
+            lag = max(0.0, finished - signature[0] / 1e9)
+        records_per_sec = records / seconds if seconds > 0 else 0.0
+        return RatingStatus(finished, records, seconds, records_per_sec, lag, error)
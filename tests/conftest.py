@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""测试公用的夹具和数据：仓库根目录下的模块不是包，先把根目录加入模块搜索路径；每个测试使用单独的数据目录。"""
+
+import json
+import os
+import random
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import billing_core as billing  # noqa: E402
+
+AREA_CODES = {"010": ("北京", 0.60), "021": ("上海", 0.65), "020": ("广州", 0.70), "025": ("南京", 0.55)}
+SURNAMES = "张李王赵刘陈杨黄"
+GIVEN_NAMES = "三四五六伟芳娜敏静丽强磊"
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """把计费系统的数据文件（BASE_DIR 和各个 *_FILE）都改到临时目录。"""
+    for name, value in list(vars(billing).items()):
+        if name == "BASE_DIR":
+            monkeypatch.setattr(billing, name, str(tmp_path))
+        elif name.endswith("_FILE") and isinstance(value, str):
+            monkeypatch.setattr(billing, name, str(tmp_path / os.path.basename(value)))
+    return str(tmp_path)
+
+
+@pytest.fixture
+def rerates(monkeypatch):
+    """记录全量重算的次数：返回的列表每全量重算一次追加一项。"""
+    counter = []
+    original = billing.BillingSystem._rerate_all_calls
+
+    def counted(self, *args, **kwargs):
+        counter.append(1)
+        return original(self, *args, **kwargs)
+
+    monkeypatch.setattr(billing.BillingSystem, "_rerate_all_calls", counted)
+    return counter
+
+
+def dump_json(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+
+
+def load_json(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_reference_data(data_dir, users=50, seed=1):
+    """在 data_dir 中写出 users.json 和 rates.json，返回用户列表。"""
+    rng = random.Random(seed)
+    user_list = [
+        {"userId": f"U{i:04d}", "userName": rng.choice(SURNAMES) + rng.choice(GIVEN_NAMES) * rng.randint(1, 2),
+         "phoneNumber": f"138{i:08d}"}
+        for i in range(1, users + 1)
+    ]
+    dump_json(os.path.join(data_dir, "users.json"), {"users": user_list})
+    rates = [{"areaCode": code, "areaName": name, "ratePerMinute": rate} for code, (name, rate) in AREA_CODES.items()]
+    dump_json(os.path.join(data_dir, "rates.json"), {"longDistanceRates": rates})
+    return user_list
+
+
+def make_calls(users, count, seed=1, first=1):
+    """随机生成 count 条通话记录，callId 从 C{first:04d} 起连续编号。"""
+    rng = random.Random(seed)
+    calls = []
+    for i in range(first, first + count):
+        caller, callee = rng.sample(users, 2)
+        long_distance = rng.random() < 0.3
+        calls.append({
+            "callId": f"C{i:04d}",
+            "callerNumber": caller["phoneNumber"],
+            "calleeNumber": callee["phoneNumber"],
+            "startTime": f"2025-{rng.randint(10, 12)}-{rng.randint(10, 28)} "
+                         f"{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}",
+            "durationSeconds": rng.randint(1, 1200),
+            "callType": "long-distance" if long_distance else "local",
+            "longDistanceAreaCode": rng.choice(sorted(AREA_CODES)) if long_distance else None,
+        })
+    return calls
+
+
+def write_calls(data_dir, calls):
+    """写出 calls.json，返回文件路径。"""
+    path = os.path.join(data_dir, "calls.json")
+    dump_json(path, {"callRecords": calls})
+    return path
+
+
+def append_calls(path, calls):
+    """与实时通话生成器一样，把新记录加到列表末尾后整体写回 calls.json。"""
+    data = load_json(path)
+    data["callRecords"].extend(calls)
+    dump_json(path, data)
+
+
+def expected_fees_text(billing_system, calls):
+    """对 calls 全量计费时 fees.json 的内容。"""
+    fees = [billing_system.rate_call(call) for call in calls]
+    return json.dumps({"fees": fees}, ensure_ascii=False, indent=4)
+
+
+def read_text(path):
+    with open(path, encoding="utf-8") as f:
+        return f.read()
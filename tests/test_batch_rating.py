@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""NumPy 批量计费：rate_calls 的结果与逐条 rate_call 逐位相同，时长超出 int64 或没有 NumPy 时退回逐条计算。"""
+
+import random
+
+import pytest
+
+from conftest import billing, make_calls, write_calls, write_reference_data
+
+
+@pytest.fixture
+def system(data_dir):
+    users = write_reference_data(data_dir)
+    write_calls(data_dir, make_calls(users, 10))
+    return billing.BillingSystem()
+
+
+def _odd_calls(system, count, seed=1):
+    """各种时长（字符串、负数、0、整分钟边界）、通话类型和未知区号混在一起的通话记录。"""
+    rng = random.Random(seed)
+    users = system.users["users"]
+    calls = make_calls(users, count, seed)
+    for call in calls:
+        choice = rng.random()
+        if choice < 0.05:
+            call["durationSeconds"] = str(call["durationSeconds"])
+        elif choice < 0.1:
+            call["durationSeconds"] = -rng.randint(0, 500)
+        elif choice < 0.2:
+            call["durationSeconds"] = 60 * rng.randint(0, 30)
+        if rng.random() < 0.05:
+            call["longDistanceAreaCode"] = "999"
+        if rng.random() < 0.05:
+            del call["callType"]
+    return calls
+
+
+def test_batch_matches_per_call(system):
+    pytest.importorskip("numpy")
+    calls = _odd_calls(system, 5 * billing.BATCH_RATING_MIN_RECORDS)
+    assert system.rate_calls(calls) == [system.rate_call(call) for call in calls]
+
+
+def test_duration_outside_int64_falls_back(system):
+    calls = _odd_calls(system, billing.BATCH_RATING_MIN_RECORDS)
+    for i, duration in enumerate((2 ** 63, 2 ** 70, -2 ** 63 - 1, -2 ** 80)):
+        calls[i * 100]["durationSeconds"] = duration
+    assert system.rate_calls(calls) == [system.rate_call(call) for call in calls]
+
+
+def test_without_numpy(system, monkeypatch):
+    calls = _odd_calls(system, billing.BATCH_RATING_MIN_RECORDS)
+    expected = system.rate_calls(calls)
+    monkeypatch.setattr(billing, "np", None)
+    assert system.rate_calls(calls) == expected
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""性能测试脚本：pipeline 的报告结构与多次运行取中位数，compare 的改善 / 退步判定、计时误差下限和退出码。"""
+
+import copy
+import json
+
+import pytest
+
+import billing_bench
+
+
+def _report(compute=10000.0, p99=5.0, rss=100 << 20, calls=1000):
+    return {"results": [{
+        "calls": calls,
+        "computeAllFees": {"records": calls, "seconds": 0.1, "recordsPerSecond": compute},
+        "queryCallRecords": {"samples": 50, "p50Ms": 1.0, "p90Ms": 2.0, "p99Ms": p99, "maxMs": 9.0},
+        "peakRssBytes": rss,
+    }]}
+
+
+def _flags(rows):
+    return {name: (improved, regressed) for _, name, _, _, _, improved, regressed in rows}
+
+
+def test_pipeline_report(tmp_path):
+    report = billing_bench.bench_pipeline([300], str(tmp_path), queries=5, users=40, repeat=2, log=None)
+    assert report["repeats"] == 2 and report["storage"] == "json" and report["inMemory"] is True
+    (result,) = report["results"]
+    assert result["calls"] == 300 and result["users"] == 40
+    assert result["computeAllFees"]["records"] == 300 and result["computeAllFees"]["recordsPerSecond"] > 0
+    for query in ("queryFeeSummary", "queryCallRecords", "findUsersByName"):
+        stats = result[query]
+        assert stats["samples"] == 5 and stats["p50Ms"] <= stats["p90Ms"] <= stats["p99Ms"] <= stats["maxMs"]
+    # 没有 --keep-data 时每种规模的数据测完即删除
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_median_result():
+    runs = [{"calls": 10, "a": {"x": 1.0, "n": 3}, "name": "x"},
+            {"calls": 10, "a": {"x": 5.0, "n": 4}, "name": "y"},
+            {"calls": 10, "a": {"x": 2.0, "n": 8}, "name": "z"},
+            {"calls": 10, "a": {"x": 9.0, "n": 1}, "name": "w"}]
+    assert billing_bench._median_result(runs) == {"calls": 10, "a": {"x": 3.5, "n": 3}, "name": "x"}
+
+
+def test_compare_flags_changes_beyond_threshold():
+    old = _report()
+    rows = billing_bench.compare_pipeline(old, _report(compute=7000.0, p99=4.0, rss=200 << 20))
+    flags = _flags(rows)
+    assert flags["computeAllFees.recordsPerSecond"] == (False, True)
+    assert flags["queryCallRecords.p99Ms"] == (True, False)
+    assert flags["peakRssBytes"] == (False, True)
+    assert flags["queryCallRecords.p50Ms"] == (False, False)
+    # 按条数对应比较，对方没有的规模不比较
+    assert billing_bench.compare_pipeline(old, _report(calls=5000)) == []
+
+
+def test_compare_ignores_latency_noise_both_ways():
+    noise = billing_bench.LATENCY_NOISE_MS / 2
+    old = _report(p99=0.01)
+    for p99 in (0.01 + noise, 0.01 + noise / 4):
+        flags = _flags(billing_bench.compare_pipeline(old, _report(p99=p99)))
+        assert flags["queryCallRecords.p99Ms"] == (False, False)
+        flags = _flags(billing_bench.compare_pipeline(_report(p99=p99), old))
+        assert flags["queryCallRecords.p99Ms"] == (False, False)
+
+
+def test_compare_exit_code(tmp_path, capsys):
+    old_path, new_path = tmp_path / "old.json", tmp_path / "new.json"
+    old = _report()
+    old_path.write_text(json.dumps(old), encoding="utf-8")
+    new_path.write_text(json.dumps(copy.deepcopy(old)), encoding="utf-8")
+    billing_bench.main(["compare", str(old_path), str(new_path)])
+    assert "退步 0 项" in capsys.readouterr().out
+
+    new_path.write_text(json.dumps(_report(compute=5000.0)), encoding="utf-8")
+    with pytest.raises(SystemExit) as exc:
+        billing_bench.main(["compare", str(old_path), str(new_path), "--threshold", "0.3"])
+    assert exc.value.code == 1
+    assert "退步 1 项" in capsys.readouterr().out
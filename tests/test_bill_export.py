@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""批量出账：三种存储方式生成的账单相同，合计与话费查询一致，CSV / JSON Lines 文件的布局和出账统计正确。"""
+
+import csv
+import json
+import os
+
+import pytest
+
+import billing_cli
+from conftest import billing, make_calls, write_calls, write_reference_data
+
+MONTH = billing.month_period("2025-11")
+
+
+@pytest.fixture
+def users(data_dir):
+    users = write_reference_data(data_dir, users=12)
+    # 最后一个用户没有通话，也要有一张金额为 0 的账单
+    calls = make_calls(users[:-1], 300)
+    calls[10]["callerNumber"] = "19900000000"  # 不在 users.json 中的号码不出账
+    write_calls(data_dir, calls)
+    return users
+
+
+def _systems(data_dir):
+    return [billing.BillingSystem(), billing.BillingSystem(in_memory=False),
+            billing.SqliteBillingSystem(db_path=os.path.join(data_dir, "billing.db"))]
+
+
+@pytest.mark.parametrize("period", [(None, None), MONTH])
+def test_bills_match_queries_across_storages(data_dir, users, period):
+    systems = _systems(data_dir)
+    expected = list(systems[0].generate_bills(*period))
+    assert [b["phoneNumber"] for b in expected] == [u["phoneNumber"] for u in users]
+    assert expected[-1]["callCount"] == 0 and expected[-1]["totalFee"] == 0.0 and expected[-1]["calls"] == []
+    for system in systems:
+        bills = list(system.generate_bills(*period))
+        assert bills == expected
+        for bill in bills:
+            phone = bill["phoneNumber"]
+            summary = system.query_fee_summary(phone, *period)
+            assert (bill["localFee"], bill["longDistanceFee"], bill["totalFee"]) == summary[1:]
+            records = system.query_call_records(phone, *period)
+            assert bill["callCount"] == len(bill["calls"]) == len(records)
+            assert [c["startTime"] for c in bill["calls"]] == [r["startTime"] for r in records]
+
+
+def test_export_layouts_and_report(data_dir, users):
+    system = billing.BillingSystem()
+    bills = list(system.generate_bills(*MONTH))
+
+    jsonl = os.path.join(data_dir, "bills.jsonl")
+    report = system.export_bills(jsonl, *MONTH)
+    with open(jsonl, encoding="utf-8") as f:
+        assert [json.loads(line) for line in f] == bills
+    assert report["users"] == len(users) and report["output"] == jsonl
+    assert report["calls"] == sum(b["callCount"] for b in bills)
+    assert report["totalFee"] == round(sum(b["totalFee"] for b in bills), 2)
+
+    path = os.path.join(data_dir, "bills.csv")
+    system.export_bills(path, *MONTH)
+    with open(path, encoding="utf-8", newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert tuple(rows[0]) == billing.BILL_CSV_COLUMNS
+    totals = [r for r in rows if r["lineType"] == "total"]
+    assert [r["phoneNumber"] for r in totals] == [b["phoneNumber"] for b in bills]
+    assert [float(r["totalFee"]) for r in totals] == [b["totalFee"] for b in bills]
+    assert sum(r["lineType"] == "call" for r in rows) == report["calls"]
+
+    system.export_bills(path, *MONTH, itemized=False)
+    with open(path, encoding="utf-8", newline="") as f:
+        assert all(r["lineType"] == "total" for r in csv.DictReader(f))
+
+
+def test_cli_bills(data_dir, users, capsys):
+    billing.BillingSystem()
+    output = os.path.join(data_dir, "bills.jsonl")
+    billing_cli.main(["--format", "json", "bills", "--month", "2025-11", "--output", output, "--no-items"])
+    report = json.loads(capsys.readouterr().out)[0]
+    assert report["users"] == len(users) and report["output"] == output
+    with open(output, encoding="utf-8") as f:
+        bills = [json.loads(line) for line in f]
+    assert bills == list(billing.BillingSystem().generate_bills(*MONTH, itemized=False))
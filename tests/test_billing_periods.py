@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""计费周期查询：三种存储方式按 [起始, 结束) 统计的话费和话单相同，开始时间格式不对的通话不属于任何时间段；分页取出的话单与不分页时一致。"""
+
+import json
+import os
+
+import pytest
+
+import billing_cli
+from conftest import billing, make_calls, write_calls, write_reference_data
+
+PERIODS = [(None, None), ("2025-11-01", None), (None, "2025-11-15 12:00:00"),
+           ("2025-10-20", "2025-12-01"), ("2026-01-01", None)]
+
+
+@pytest.fixture
+def calls(data_dir):
+    users = write_reference_data(data_dir, users=10)
+    calls = make_calls(users, 400)
+    # 不按时间先后追加的通话，以及开始时间无法解析的通话
+    calls[50]["startTime"] = "2025-10-01 00:00:00"
+    calls[51]["startTime"] = "2025/11/02"
+    calls[52]["startTime"] = None
+    write_calls(data_dir, calls)
+    return calls
+
+
+def _expected(system, calls, phone, start, end):
+    lo = billing.normalize_period_bound(start)
+    hi = billing.normalize_period_bound(end)
+    picked = []
+    for call in calls:
+        if call["callerNumber"] != phone:
+            continue
+        if lo is not None or hi is not None:
+            t = call["startTime"]
+            if billing.pack_start_time(t) is None or (lo and t < lo) or (hi and t >= hi):
+                continue
+        picked.append(call)
+    local_sum = long_sum = 0.0
+    for call in picked:
+        fee = system.rate_call(call)
+        local_sum += fee["localFee"]
+        long_sum += fee["longDistanceFee"]
+    local_sum, long_sum = round(local_sum, 2), round(long_sum, 2)
+    return [c["callId"] for c in picked], (local_sum, long_sum, round(local_sum + long_sum, 2))
+
+
+def _systems(data_dir):
+    memory = billing.BillingSystem()
+    return [memory, billing.BillingSystem(in_memory=False),
+            billing.SqliteBillingSystem(db_path=os.path.join(data_dir, "billing.db"))]
+
+
+def test_period_queries_match_across_storages(data_dir, calls):
+    systems = _systems(data_dir)
+    by_id = {c["callId"]: c for c in calls}
+    for phone in sorted({c["callerNumber"] for c in calls}):
+        for start, end in PERIODS:
+            ids, sums = _expected(systems[0], calls, phone, start, end)
+            for system in systems:
+                assert system.query_fee_summary(phone, start, end)[1:] == sums
+                records = system.query_call_records(phone, start, end)
+                assert [(r["calleeNumber"], r["startTime"]) for r in records] == \
+                       [(by_id[i]["calleeNumber"], by_id[i]["startTime"]) for i in ids]
+
+
+@pytest.mark.parametrize("offset, limit", [(0, 7), (5, 7), (3, None), (1000, 10), (0, 0)])
+def test_paged_call_records(data_dir, calls, offset, limit):
+    phone = calls[0]["callerNumber"]
+    for system in _systems(data_dir):
+        for start, end in PERIODS:
+            records = system.query_call_records(phone, start, end)
+            stop = None if limit is None else offset + limit
+            assert system.query_call_records(phone, start, end, offset, limit) == records[offset:stop]
+            assert system.count_call_records(phone, start, end) == len(records)
+
+
+def test_billing_months(data_dir, calls):
+    for system in _systems(data_dir):
+        assert system.query_billing_months() == ["2025-10", "2025-11", "2025-12"]
+
+
+def test_month_period_and_bounds():
+    assert billing.month_period("2025-12") == ("2025-12-01 00:00:00", "2026-01-01 00:00:00")
+    assert billing.normalize_period_bound(" 2025-11-05 ") == "2025-11-05 00:00:00"
+    assert billing.normalize_period_bound("") is None
+    for bad in ("2025-13", "2025/11"):
+        with pytest.raises(ValueError):
+            billing.month_period(bad)
+    with pytest.raises(ValueError):
+        billing.normalize_period_bound("2025-11-5")
+
+
+def test_cli_month_option(data_dir, calls, capsys):
+    phone = calls[0]["callerNumber"]
+    expected = billing.BillingSystem().query_fee_summary(phone, *billing.month_period("2025-11"))
+    billing_cli.main(["--format", "json", "fee", phone, "--month", "2025-11"])
+    row = json.loads(capsys.readouterr().out)[0]
+    assert (row["periodStart"], row["periodEnd"]) == billing.month_period("2025-11")
+    assert (row["localFee"], row["longDistanceFee"], row["totalFee"]) == expected[1:]
+    with pytest.raises(SystemExit):
+        billing_cli.main(["fee", phone, "--from", "昨天"])
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""通话记录生成器的压测模式：同一种子生成的记录相同，追加写入的文本与 json.dump 的布局一致，计费系统只续读新增部分；
+last_call_index 在末尾记录很长时向前逐块查找。"""
+
+import importlib
+import json
+import os
+
+import pytest
+
+from conftest import billing, load_json, write_reference_data
+
+generator = importlib.import_module("随机通话记录生成")
+
+
+@pytest.fixture
+def users(data_dir, monkeypatch):
+    for name in ("USERS_FILE", "RATES_FILE", "CALLS_FILE", "CALLS_JSONL_FILE"):
+        monkeypatch.setattr(generator, name, getattr(billing, name))
+    return write_reference_data(data_dir, users=30)
+
+
+def _generate(*argv):
+    generator.main(["--from", "2025-11-01 00:00:00", "--days", "30", "--batch", "70"] + list(argv))
+
+
+@pytest.mark.parametrize("name", ["calls.json", "calls.jsonl"])
+def test_seeded_runs_are_reproducible(data_dir, users, name):
+    first = os.path.join(data_dir, "first-" + name)
+    second = os.path.join(data_dir, "second-" + name)
+    _generate("--count", "300", "--seed", "7", "--zipf", "1.2", "--output", first)
+    _generate("--count", "300", "--seed", "7", "--zipf", "1.2", "--output", second)
+    with open(first, "rb") as f, open(second, "rb") as g:
+        assert f.read() == g.read()
+
+
+def test_json_layout_and_incremental_billing(data_dir, users, rerates):
+    _generate("--count", "250", "--seed", "1")
+    records = load_json(billing.CALLS_FILE)["callRecords"]
+    assert [r["callId"] for r in records] == [f"C{i:04d}" for i in range(1, 251)]
+    with open(billing.CALLS_FILE, encoding="utf-8") as f:
+        assert f.read() == json.dumps({"callRecords": records}, ensure_ascii=False, indent=4)
+    assert all(r["callerNumber"] != r["calleeNumber"] for r in records)
+
+    system = billing.BillingSystem()
+    rerates.clear()
+    # 续写时 callId 接着文件中最后一条编号，计费系统只对新增部分计费
+    _generate("--count", "120", "--seed", "2")
+    assert system.compute_all_fees() == 120 and not rerates
+    assert load_json(billing.CALLS_FILE)["callRecords"][-1]["callId"] == "C0370"
+
+
+def test_jsonl_lines_match_json_dumps(data_dir, users):
+    path = os.path.join(data_dir, "calls.jsonl")
+    _generate("--count", "200", "--seed", "3", "--long-distance-ratio", "0.5", "--output", path)
+    with open(path, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert [json.dumps(json.loads(line), ensure_ascii=False) for line in lines] == lines
+    assert json.loads(lines[-1])["callId"] == "C0200"
+
+
+def test_last_call_index_scans_back_past_long_records(tmp_path):
+    path = str(tmp_path / "calls.jsonl")
+    assert generator.last_call_index(path) == 0
+    # 最后一条记录没有 callId 且远长于 TAIL_BYTES；逐字节改变它的长度，
+    # 前一条记录的 callId 会落在向前查找的某个块边界上
+    for size in range(3 * generator.TAIL_BYTES - 64, 3 * generator.TAIL_BYTES):
+        lines = [{"callId": "C0041"}, {"callId": "C12345"}, {"note": "x" * size}]
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("".join(json.dumps(line) + "\n" for line in lines))
+        assert generator.last_call_index(path) == 12345, size
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"callId": "X1", "note": "x" * 20000}) + "\n")
+    assert generator.last_call_index(path) == 0
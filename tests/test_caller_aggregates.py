@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""按主叫号码维护的话费合计和通话下标表，与逐条扫描全部费用、通话记录的查询结果相同。"""
+
+from conftest import append_calls, billing, make_calls, write_calls, write_reference_data
+
+FIELDS = ("callerNumber", "calleeNumber", "durationSeconds", "callType")
+
+
+def _scan_fee_summary(system, calls, phone):
+    local_sum = long_sum = 0.0
+    for fee in (system.rate_call(call) for call in calls):
+        if fee["callerNumber"] == phone:
+            local_sum += float(fee["localFee"])
+            long_sum += float(fee["longDistanceFee"])
+    local_sum, long_sum = round(local_sum, 2), round(long_sum, 2)
+    return system.get_user_name(phone), local_sum, long_sum, round(local_sum + long_sum, 2)
+
+
+def _check(system, users, calls):
+    for phone in [u["phoneNumber"] for u in users] + ["00000000000"]:
+        assert system.query_fee_summary(phone) == _scan_fee_summary(system, calls, phone)
+        found = [tuple(r[k] for k in FIELDS) for r in system.query_call_records(phone)]
+        assert found == [tuple(c.get(k, "local") for k in FIELDS) for c in calls if c["callerNumber"] == phone]
+
+
+def test_aggregates_match_full_scan(data_dir):
+    users = write_reference_data(data_dir, users=30)
+    calls = make_calls(users, 400)
+    calls_file = write_calls(data_dir, calls)
+    system = billing.BillingSystem()
+    _check(system, users, calls)
+
+    # 增量计费的一批、全量重算之后、重新启动之后
+    extra = make_calls(users, 50, 2, first=401)
+    append_calls(calls_file, extra)
+    calls += extra
+    system.compute_all_fees()
+    _check(system, users, calls)
+
+    system.compute_all_fees(full=True)
+    _check(system, users, calls)
+
+    extra = make_calls(users, 10, 3, first=451)
+    append_calls(calls_file, extra)
+    calls += extra
+    _check(billing.BillingSystem(), users, calls)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""命令行入口：不导入 tkinter，各子命令的输出格式，查询前只对新增通话计费、需要全量重算时提示先运行 rate。"""
+
+import csv
+import io
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import billing_cli
+from conftest import ROOT, append_calls, billing, dump_json, load_json, make_calls, write_calls, write_reference_data
+
+
+@pytest.fixture
+def users(data_dir):
+    users = write_reference_data(data_dir, users=20)
+    write_calls(data_dir, make_calls(users, 200))
+    return users
+
+
+def _run(capsys, *argv):
+    billing_cli.main(list(argv))
+    return capsys.readouterr()
+
+
+def test_import_does_not_load_tkinter():
+    code = "import sys, billing_cli; sys.exit('tkinter' in sys.modules)"
+    assert subprocess.run([sys.executable, "-c", code], cwd=ROOT).returncode == 0
+
+
+def test_fee_formats(data_dir, users, capsys):
+    phone = users[0]["phoneNumber"]
+    name, local_sum, long_sum, total_sum = billing.BillingSystem().query_fee_summary(phone)
+
+    row = json.loads(_run(capsys, "--format", "json", "fee", phone).out)[0]
+    assert row == {"phoneNumber": phone, "userName": name, "periodStart": None, "periodEnd": None,
+                   "localFee": round(local_sum, 2),
+                   "longDistanceFee": round(long_sum, 2), "totalFee": round(total_sum, 2)}
+
+    rows = list(csv.DictReader(io.StringIO(_run(capsys, "--format", "csv", "fee", phone).out)))
+    assert list(rows[0]) == list(billing_cli.FEE_COLUMNS) and rows[0]["userName"] == name
+
+    lines = _run(capsys, "fee", phone).out.splitlines()
+    assert lines[0].split("\t") == list(billing_cli.FEE_COLUMNS) and len(lines) == 2
+
+
+def test_calls_and_users(data_dir, users, capsys):
+    phone = users[1]["phoneNumber"]
+    rows = json.loads(_run(capsys, "--format", "json", "calls", phone).out)
+    assert rows == billing.BillingSystem().query_call_records(phone)
+    rows = json.loads(_run(capsys, "--format", "json", "users", users[2]["userName"][:1]).out)
+    assert users[2] in rows
+
+
+def test_queries_rate_only_new_calls(data_dir, users, capsys, rerates):
+    billing.BillingSystem()
+    rerates.clear()
+    append_calls(os.path.join(data_dir, "calls.json"), make_calls(users, 10, 2, first=201))
+    result = _run(capsys, "fee", users[0]["phoneNumber"])
+    assert result.err == "" and not rerates
+    assert len(load_json(billing.FEES_FILE)["fees"]) == 210
+
+    # 资费变化后查询不全量重算，按现有费用查询并提示运行 rate
+    rates = load_json(os.path.join(data_dir, "rates.json"))
+    rates["longDistanceRates"][0]["ratePerMinute"] = 1.5
+    dump_json(os.path.join(data_dir, "rates.json"), rates)
+    result = _run(capsys, "calls", users[0]["phoneNumber"])
+    assert "rate" in result.err and not rerates
+
+    row = json.loads(_run(capsys, "--format", "json", "rate").out)[0]
+    assert row["records"] == 210 and row["output"] == billing.FEES_FILE and len(rerates) == 1
+
+
+def test_rate_workers_default(data_dir, users, capsys, monkeypatch):
+    created = []
+    original = billing_cli.create_billing_system
+
+    def create(storage, workers=1, **kwargs):
+        created.append(workers)
+        return original(storage, workers=workers, **kwargs)
+
+    monkeypatch.setattr(billing_cli, "create_billing_system", create)
+    _run(capsys, "rate", "--full")
+    _run(capsys, "rate", "--full", "--workers", "3")
+    assert created == [1, 3]
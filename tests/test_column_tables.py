@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""按列存放的通话表和费用表：常规和不规则的记录都原样取回，全量重算和重新启动后的查询与写出的费用文件不变。"""
+
+import json
+
+import billing_bench
+from conftest import billing, load_json, make_calls, read_text, write_calls, write_reference_data
+
+
+def _exact(records):
+    """逐位比较用的文本：json.dumps 区分 0.0 和 -0.0、1 和 1.0，也保留键的顺序。"""
+    return json.dumps(list(records), ensure_ascii=False)
+
+
+def _odd_calls(users):
+    calls = make_calls(users, 12)
+    calls[0]["startTime"] = "2025-13-40 99:99:99"
+    calls[1]["startTime"] = None
+    calls[2]["durationSeconds"] = 2 ** 70
+    calls[3]["durationSeconds"] = 61.5
+    calls[4]["callId"] = 7
+    calls[5]["callerNumber"] = 13800000001
+    calls[6]["extra"] = {"note": "补录"}
+    calls[7] = dict(reversed(list(calls[7].items())))
+    del calls[8]["longDistanceAreaCode"]
+    return calls
+
+
+def test_tables_round_trip(data_dir):
+    users = write_reference_data(data_dir)
+    rater = billing.BillingSystem.for_rating({"users": users}, load_json(billing.RATES_FILE))
+    calls = make_calls(users, 30) + _odd_calls(users)
+    fees = rater.rate_calls(calls)
+    fees[1] = dict(fees[1], totalFee=99.0)
+    fees[2] = dict(fees[2], localFee=1)
+    fees[3] = dict(fees[3], callId="另一条")
+
+    call_table = billing.CallTable()
+    fee_table = billing.FeeTable(call_table)
+    for i in range(0, len(calls), 7):
+        call_table.extend(calls[i:i + 7])
+        fee_table.extend(fees[i:i + 7])
+    assert len(call_table) == len(fee_table) == len(calls)
+    assert _exact(call_table) == _exact(calls)
+    assert _exact(fee_table) == _exact(fees)
+    assert _exact(call_table[i] for i in range(len(calls))) == _exact(calls)
+
+
+def test_rerate_and_restart_with_odd_records(data_dir, rerates):
+    users = write_reference_data(data_dir)
+    calls = make_calls(users, 200) + _odd_calls(users)
+    write_calls(data_dir, calls)
+    system = billing.BillingSystem()
+    system.flush()
+    expected = json.dumps({"fees": [system.rate_call(call) for call in calls]}, ensure_ascii=False, indent=4)
+    assert read_text(billing.FEES_FILE) == expected
+
+    restarted = billing.BillingSystem()
+    assert len(rerates) == 1
+    assert _exact(restarted.fees) == _exact(system.fees)
+    for u in users:
+        phone = u["phoneNumber"]
+        assert restarted.query_call_records(phone) == system.query_call_records(phone)
+        assert restarted.query_fee_summary(phone) == system.query_fee_summary(phone)
+
+
+def test_indented_record_matches_json_dump():
+    records = [{"a": " 换行\n", "b": -0.0, "c": None, "d": 2 ** 70}, {"nested": {"k": [1, 2]}}, {}]
+    for record in records:
+        text = json.dumps({"fees": [record]}, ensure_ascii=False, indent=4)
+        assert billing.dump_indented_record(record) in text
+
+
+def test_memory_bench_reports_smaller_tables():
+    result = billing_bench.bench_memory(2000, user_count=200)
+    assert result["records"] == 2000
+    assert result["tableBytesPerRecord"] < result["dictBytesPerRecord"]
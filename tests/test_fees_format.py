@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""fees.json 的编码：compact / zlib 与 indent 内容相同，zlib 增量追加与整体重写解压后逐字节相同；后台写出与出错后的整体重写；转换为 JSON Lines。"""
+
+import gzip
+import importlib
+import json
+import os
+
+import pytest
+
+import billing_cli
+from conftest import append_calls, billing, make_calls, write_calls, write_reference_data
+
+
+@pytest.fixture
+def users(data_dir):
+    return write_reference_data(data_dir)
+
+
+def _fees_text(path):
+    """费用文件（解压后）的文本。"""
+    with billing.open_record_file(path) as f:
+        return f.read().decode("utf-8")
+
+
+def _rewritten_text(system, calls, encoding):
+    path = system.fees_file + ".expected"
+    billing.write_json_records(path, "fees", [system.rate_call(call) for call in calls], encoding)
+    return _fees_text(path)
+
+
+@pytest.mark.parametrize("encoding", billing.FEES_FORMATS)
+def test_formats_hold_same_records(data_dir, users, encoding):
+    calls = make_calls(users, 300)
+    write_calls(data_dir, calls)
+    system = billing.BillingSystem(fees_format=encoding)
+    system.flush()
+    fees = [system.rate_call(call) for call in calls]
+    assert json.loads(_fees_text(system.fees_file)) == {"fees": fees}
+    assert list(billing.RecordStream(system.fees_file, "fees")) == fees
+    if encoding == "zlib":
+        with gzip.open(system.fees_file, "rt", encoding="utf-8") as f:
+            assert json.load(f) == {"fees": fees}
+    if encoding == "indent":
+        assert _fees_text(system.fees_file) == json.dumps({"fees": fees}, ensure_ascii=False, indent=4)
+
+    # 换一种编码后，下一次整体重写即转换成新的编码
+    other = "compact" if encoding != "compact" else "zlib"
+    system = billing.BillingSystem(fees_format=other)
+    system.compute_all_fees(full=True)
+    system.flush()
+    assert _fees_text(system.fees_file) == _rewritten_text(system, calls, other)
+
+
+@pytest.mark.parametrize("encoding", billing.FEES_FORMATS)
+@pytest.mark.parametrize("in_memory", [True, False])
+def test_appends_match_full_rewrite(data_dir, users, rerates, encoding, in_memory):
+    calls = make_calls(users, 200)
+    calls_file = write_calls(data_dir, calls)
+    billing.BillingSystem(fees_format=encoding).flush()
+    system = billing.BillingSystem(fees_format=encoding, in_memory=in_memory)
+    for seed in (2, 3, 4):
+        extra = make_calls(users, 7, seed, first=len(calls) + 1)
+        append_calls(calls_file, extra)
+        calls += extra
+        assert system.compute_all_fees() == 7
+    system.flush()
+    assert len(rerates) == 1
+    assert _fees_text(system.fees_file) == _rewritten_text(system, calls, encoding)
+
+
+def test_zlib_append_adds_members_instead_of_rewriting(data_dir, users):
+    write_calls(data_dir, make_calls(users, 100))
+    system = billing.BillingSystem(fees_format="zlib")
+    system.flush()
+    with open(system.fees_file, "rb") as f:
+        before = f.read()
+    closing = billing.gzip_member(b"\n]}")
+    assert before.endswith(closing)
+
+    rows = [system.rate_call(call) for call in make_calls(users, 3, 2, first=101)]
+    assert billing.BillingSystem._append_json_rows(system.fees_file, rows, "zlib")
+    with open(system.fees_file, "rb") as f:
+        after = f.read()
+    # 原有的记录成员原样保留，只把结尾成员换成 新记录 + 结尾
+    assert after.startswith(before[:-len(closing)]) and after.endswith(closing)
+    assert json.loads(gzip.decompress(after))["fees"][-3:] == rows
+
+    # 空列表和不是这样写出的压缩文件都交给整体重写
+    billing.write_json_records(system.fees_file, "fees", [], "zlib")
+    assert not billing.BillingSystem._append_json_rows(system.fees_file, rows, "zlib")
+    with gzip.open(system.fees_file, "wt", encoding="utf-8") as f:
+        json.dump({"fees": rows}, f)
+    assert not billing.BillingSystem._append_json_rows(system.fees_file, rows, "zlib")
+
+
+def test_failed_write_is_reported_and_rewritten(data_dir, users, monkeypatch):
+    calls = make_calls(users, 100)
+    calls_file = write_calls(data_dir, calls)
+    system = billing.BillingSystem()
+    system.flush()
+
+    def broken(path, rows, encoding="indent"):
+        raise OSError("磁盘已满")
+
+    monkeypatch.setattr(billing.BillingSystem, "_append_json_rows", staticmethod(broken))
+    extra = make_calls(users, 5, 2, first=101)
+    append_calls(calls_file, extra)
+    system.compute_all_fees()
+    with pytest.raises(OSError):
+        system.flush()
+    monkeypatch.undo()
+
+    # 下一次写出不在可能残缺的文件上追加，而是整体重写
+    more = make_calls(users, 5, 3, first=106)
+    append_calls(calls_file, more)
+    system.compute_all_fees()
+    system.flush()
+    assert _fees_text(system.fees_file) == _rewritten_text(system, calls + extra + more, "indent")
+
+
+def test_convert_zlib_fees_to_jsonl(data_dir, users):
+    write_calls(data_dir, make_calls(users, 50))
+    system = billing.BillingSystem(fees_format="zlib")
+    system.flush()
+    converter = importlib.import_module("通话记录格式转换")
+    dst = os.path.join(data_dir, "converted.jsonl")
+    assert converter.convert_to_jsonl(system.fees_file, dst, "fees") == 50
+    with open(dst, encoding="utf-8") as f:
+        assert [json.loads(line) for line in f] == list(billing.RecordStream(system.fees_file, "fees"))
+
+
+def test_unknown_format_is_rejected(data_dir, users):
+    with pytest.raises(ValueError):
+        billing.BillingSystem(fees_format="zstd")
+
+
+def test_cli_fees_format(data_dir, users, capsys):
+    write_calls(data_dir, make_calls(users, 30))
+    billing_cli.main(["--fees-format", "zlib", "rate", "--full"])
+    capsys.readouterr()
+    with open(billing.FEES_FILE, "rb") as f:
+        assert f.read(2) == billing.GZIP_MAGIC
+    assert len(list(billing.RecordStream(billing.FEES_FILE, "fees"))) == 30
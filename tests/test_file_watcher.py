@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""文件变化检测：被监视的文件写入、原子替换后 wait 返回 True，其他文件的变化和超时返回 False；后台计费由文件变化触发。"""
+
+import os
+import threading
+import time
+
+import pytest
+
+from conftest import append_calls, billing, make_calls, write_calls, write_reference_data
+
+
+@pytest.fixture(params=["inotify", "poll"])
+def watcher_factory(request, monkeypatch):
+    if request.param == "poll":
+        monkeypatch.setattr(billing.FileChangeWatcher, "_open_inotify", lambda self: None)
+    watchers = []
+
+    def make(paths):
+        watcher = billing.FileChangeWatcher(paths)
+        if request.param == "inotify" and not watcher.uses_inotify:
+            pytest.skip("inotify 不可用")
+        watchers.append(watcher)
+        return watcher
+
+    yield make
+    for watcher in watchers:
+        watcher.close()
+
+
+def _write_later(path, text, delay=0.05):
+    def write():
+        time.sleep(delay)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    return thread
+
+
+def test_wait_sees_writes_and_renames(tmp_path, watcher_factory):
+    watched = str(tmp_path / "calls.json")
+    other = str(tmp_path / "fees.json")
+    with open(watched, "w", encoding="utf-8") as f:
+        f.write("{}")
+    watcher = watcher_factory([watched])
+
+    assert watcher.wait(0.3) is False
+    _write_later(other, "ignored").join()
+    assert watcher.wait(0.7) is False
+
+    thread = _write_later(watched, '{"callRecords": []}')
+    assert watcher.wait(5) is True
+    thread.join()
+
+    tmp = watched + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write('{"callRecords": [{}]}')
+    os.replace(tmp, watched)
+    assert watcher.wait(5) is True
+
+
+def test_wait_returns_when_stopped(tmp_path, watcher_factory):
+    watcher = watcher_factory([str(tmp_path / "calls.json")])
+    stop = threading.Event()
+    stop.set()
+    started = time.monotonic()
+    assert watcher.wait(10, stop) is False
+    assert time.monotonic() - started < 1
+
+
+def test_worker_rates_on_file_change(data_dir):
+    users = write_reference_data(data_dir)
+    calls_file = write_calls(data_dir, make_calls(users, 30))
+    system = billing.BillingSystem()
+    # 兜底间隔很长：第一轮之后的计费只能由文件变化触发
+    worker = billing.RatingWorker(system, interval=60)
+    worker.start()
+    try:
+        assert worker.status_queue.get(timeout=10).records == 0
+        append_calls(calls_file, make_calls(users, 6, 2, first=31))
+        rated = 0
+        while rated < 6:
+            rated += worker.status_queue.get(timeout=10).records
+    finally:
+        worker.stop()
+        worker.join(timeout=10)
+    assert not worker.is_alive()
+    assert len(system.fees) == 36
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""成绩核算的数据处理：不依赖 tkinter / openai 即可导入；(班级, 课程) 索引与逐条筛选的结果相同；按列计算的总评、等级和统计与逐条计算完全相同。"""
+
+import json
+import os
+import random
+import subprocess
+import sys
+
+import pytest
+
+import grade_core
+from conftest import ROOT
+
+
+def _sample_records():
+    with open(os.path.join(ROOT, "student_sample_data.json"), encoding="utf-8") as f:
+        records = json.load(f)
+    # 缺少班级或课程、取值不是字符串的记录
+    return records + [
+        {"course": "高等数学", "id": "X1", "daily": 60, "mid": 60, "final": 60},
+        {"class": "电科2303", "id": "X2", "daily": 70, "mid": 70, "final": 70},
+        {"class": 2303, "course": "高等数学", "id": "X3", "daily": 80, "mid": 80, "final": 80},
+        {"class": "", "course": "", "id": "X4"},
+    ]
+
+
+def test_import_does_not_load_gui_or_openai():
+    code = "import sys, grade_core; sys.exit('tkinter' in sys.modules or 'openai' in sys.modules)"
+    assert subprocess.run([sys.executable, "-c", code], cwd=ROOT).returncode == 0
+
+
+def test_index_matches_filtering():
+    records = _sample_records()
+    index, classes, courses = grade_core.build_record_index(records)
+
+    assert classes == {rec["class"] for rec in records if "class" in rec}
+    assert courses == {rec["course"] for rec in records if "course" in rec}
+    for cls in classes | {None, "没有这个班"}:
+        for cour in courses | {None}:
+            expected = [rec for rec in records if rec.get("class") == cls and rec.get("course") == cour]
+            group = index.get((cls, cour), [])
+            # 同样的记录对象、同样的先后顺序（计算结果要写回这些记录）
+            assert len(group) == len(expected) and all(a is b for a, b in zip(group, expected))
+    assert sum(len(group) for group in index.values()) == len(records)
+
+
+def test_empty_records():
+    assert grade_core.build_record_index([]) == ({}, set(), set())
+
+
+def _reference_grades(records):
+    """原来逐条计算的做法：总评、等级（if 链），以及按区间 lambda 统计各等级的人数。"""
+    totals, names = [], []
+    for rec in records:
+        try:
+            daily = float(rec.get("daily", 0))
+            mid = float(rec.get("mid", 0))
+            final = float(rec.get("final", 0))
+        except ValueError:
+            daily = mid = final = 0.0
+        total = round(0.3 * daily + 0.3 * mid + 0.4 * final, 2)
+        totals.append(total)
+        if total >= 90:
+            names.append("优")
+        elif total >= 80:
+            names.append("良")
+        elif total >= 70:
+            names.append("中")
+        elif total >= 60:
+            names.append("及格")
+        else:
+            names.append("不及格")
+    ranges = [lambda x: x < 60, lambda x: 60 <= x <= 69.9999, lambda x: 70 <= x <= 79.9999,
+              lambda x: 80 <= x <= 89.9999, lambda x: x >= 90]
+    counts = [0] * len(ranges)
+    for total in totals:
+        for level in (4, 3, 2, 1, 0):
+            if ranges[level](total):
+                counts[level] += 1
+                break
+    return totals, names, counts, sum(totals) / len(totals) if totals else 0.0
+
+
+def _random_records(rng, count):
+    odd = ["abc", "", "nan", "inf", "-inf", "59.995", " 88 ", 1e308]
+    records = []
+    for i in range(count):
+        rec = {"id": str(i)}
+        for key in ("daily", "mid", "final"):
+            choice = rng.random()
+            if choice < 0.05:
+                continue
+            if choice < 0.1:
+                rec[key] = rng.choice(odd)
+            elif choice < 0.3:
+                rec[key] = str(round(rng.uniform(0, 100), rng.randint(0, 3)))
+            else:
+                rec[key] = rng.choice([rng.randint(0, 100), round(rng.uniform(0, 100), 2)])
+        records.append(rec)
+    return records
+
+
+def _same(a, b):
+    """逐项相同（NaN 与 NaN 算相同）。"""
+    return len(a) == len(b) and all(x == y or (x != x and y != y) for x, y in zip(a, b))
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_compute_grades_matches_per_record(monkeypatch, use_numpy):
+    if use_numpy:
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(grade_core, "np", None)
+    rng = random.Random(1)
+    batches = [_random_records(rng, rng.randint(0, 80)) for _ in range(100)]
+    # 整数成绩的网格：覆盖每一个等级边界附近的总评
+    batches.append([{"daily": d, "mid": m, "final": f}
+                    for d in range(0, 101, 4) for m in range(0, 101, 4) for f in range(0, 101, 2)])
+    batches.append(_sample_records())
+    # 总评为 NaN（正负无穷相加）：等级为不及格，但不计入任何等级的人数
+    batches.append([{"daily": "inf", "mid": "-inf", "final": 0}, {"daily": 95, "mid": 90, "final": 92}])
+    for records in batches:
+        stats = grade_core.compute_grades(records)
+        totals, names, counts, average = _reference_grades(records)
+        assert _same(stats.totals, totals)
+        assert [grade_core.LEVEL_NAMES[level] for level in stats.levels] == names
+        assert stats.counts == counts
+        assert _same([stats.average], [average])
+
+
+def test_get_level():
+    cases = {-1: "不及格", 0: "不及格", 59.99: "不及格", 60: "及格", 69.99: "及格", 70: "中",
+             80: "良", 89.99: "良", 90: "优", 100: "优", 120: "优",
+             float("inf"): "优", float("-inf"): "不及格", float("nan"): "不及格"}
+    for total, name in cases.items():
+        assert grade_core.get_level(total) == name
+    assert grade_core.level_index(float("nan")) == 0
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""增量计费：只对新追加的通话记录计费，fees.json 与全量重算写出的逐字节相同；重新启动后从保存的位置续读。"""
+
+import json
+
+import pytest
+
+from conftest import (append_calls, billing, expected_fees_text, load_json, make_calls, read_text, write_calls,
+                      write_reference_data)
+
+
+@pytest.fixture
+def users(data_dir):
+    return write_reference_data(data_dir)
+
+
+def test_appended_calls_are_rated_incrementally(data_dir, users, rerates):
+    calls = make_calls(users, 300)
+    calls_file = write_calls(data_dir, calls)
+    system = billing.BillingSystem()
+    assert len(rerates) == 1
+
+    for seed in (2, 3):
+        extra = make_calls(users, 20, seed, first=len(calls) + 1)
+        append_calls(calls_file, extra)
+        calls += extra
+        system.compute_all_fees()
+    system.compute_all_fees()
+    system.flush()
+    assert len(rerates) == 1
+    assert read_text(billing.FEES_FILE) == expected_fees_text(system, calls)
+
+
+def test_restart_resumes_from_saved_cursor(data_dir, users, rerates):
+    calls = make_calls(users, 200)
+    calls_file = write_calls(data_dir, calls)
+    billing.BillingSystem().compute_all_fees()
+
+    # 停机期间追加的通话在重新启动时补算，之后仍然只续读新记录
+    downtime = make_calls(users, 15, 2, first=201)
+    append_calls(calls_file, downtime)
+    system = billing.BillingSystem()
+    more = make_calls(users, 10, 3, first=216)
+    append_calls(calls_file, more)
+    system.compute_all_fees()
+    system.flush()
+
+    assert len(rerates) == 1
+    assert read_text(billing.FEES_FILE) == expected_fees_text(system, calls + downtime + more)
+
+
+def test_changed_rates_trigger_full_rerate(data_dir, users, rerates):
+    calls = make_calls(users, 100)
+    write_calls(data_dir, calls)
+    billing.BillingSystem().flush()
+
+    with open(billing.RATES_FILE, encoding="utf-8") as f:
+        rates = json.load(f)
+    rates["longDistanceRates"][0]["ratePerMinute"] += 0.1
+    with open(billing.RATES_FILE, "w", encoding="utf-8") as f:
+        json.dump(rates, f, ensure_ascii=False, indent=4)
+
+    system = billing.BillingSystem()
+    system.compute_all_fees()
+    system.flush()
+    assert len(rerates) == 2
+    assert read_text(billing.FEES_FILE) == expected_fees_text(system, calls)
+
+
+def test_touched_fees_file_is_not_trusted(data_dir, users, rerates):
+    calls = make_calls(users, 100)
+    write_calls(data_dir, calls)
+    billing.BillingSystem().flush()
+    with open(billing.FEES_FILE, "a", encoding="utf-8") as f:
+        f.write(" ")
+
+    system = billing.BillingSystem()
+    system.compute_all_fees()
+    system.flush()
+    assert len(rerates) == 2
+    assert read_text(billing.FEES_FILE) == expected_fees_text(system, calls)
+
+
+def test_rewritten_calls_prefix_triggers_full_rerate(data_dir, users, rerates):
+    calls = make_calls(users, 100)
+    calls_file = write_calls(data_dir, calls)
+    system = billing.BillingSystem()
+    calls[10]["durationSeconds"] += 1000
+    write_calls(data_dir, calls)
+    append_calls(calls_file, make_calls(users, 1, 2, first=101))
+
+    system.compute_all_fees()
+    assert len(rerates) == 2
+
+
+@pytest.mark.parametrize("shape", ["non-ascii-id", "long-record"])
+def test_unusual_last_record_does_not_force_full_rerate(data_dir, users, rerates, shape):
+    calls = make_calls(users, 5)
+    if shape == "non-ascii-id":
+        # 写出的 calls.json 中非 ASCII 字符不转义
+        for i, call in enumerate(calls):
+            call["callId"] = f"通话{i}"
+    else:
+        # 最后一条记录比校验字节（CALLS_TAIL_CHECK_BYTES）还长
+        calls[-1]["note"] = "备注" * billing.CALLS_TAIL_CHECK_BYTES
+    calls_file = write_calls(data_dir, calls)
+    system = billing.BillingSystem()
+
+    extra = make_calls(users, 1, 2, first=6)
+    append_calls(calls_file, extra)
+    system.compute_all_fees()
+    system.compute_all_fees()
+    assert len(rerates) == 1
+
+    # 重新启动后同样续读
+    append_calls(calls_file, make_calls(users, 1, 3, first=7))
+    system = billing.BillingSystem()
+    system.compute_all_fees()
+    system.flush()
+    assert len(rerates) == 1
+    assert read_text(billing.FEES_FILE) == expected_fees_text(system, load_json(calls_file)["callRecords"])
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""JSON Lines 存储：增量计费写出的 fees.jsonl 与全量重算相同；没写完的最后一行留到下次；auto 按 calls.jsonl 是否存在选择格式。"""
+
+import json
+
+import pytest
+
+from conftest import billing, make_calls, write_calls, write_reference_data
+
+
+@pytest.fixture
+def users(data_dir):
+    return write_reference_data(data_dir)
+
+
+def _append_lines(path, calls, partial=""):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("".join(json.dumps(c, ensure_ascii=False) + "\n" for c in calls))
+        f.write(partial)
+
+
+def _fees_lines(system, calls):
+    return [system.rate_call(call) for call in calls]
+
+
+def _read_lines(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_jsonl_incremental_matches_full_rerate(data_dir, users, rerates):
+    calls = make_calls(users, 200)
+    _append_lines(billing.CALLS_JSONL_FILE, calls)
+    system = billing.BillingSystem()
+    assert system.storage == "jsonl"
+
+    for seed in (2, 3):
+        extra = make_calls(users, 25, seed, first=len(calls) + 1)
+        _append_lines(billing.CALLS_JSONL_FILE, extra)
+        calls += extra
+        system.compute_all_fees()
+    system.flush()
+    assert len(rerates) == 1
+    assert _read_lines(billing.FEES_JSONL_FILE) == _fees_lines(system, calls)
+
+    system.compute_all_fees(full=True)
+    system.flush()
+    assert _read_lines(billing.FEES_JSONL_FILE) == _fees_lines(system, calls)
+
+
+def test_unfinished_last_line_is_read_later(data_dir, users, rerates):
+    calls = make_calls(users, 20)
+    _append_lines(billing.CALLS_JSONL_FILE, calls)
+    system = billing.BillingSystem()
+
+    extra = make_calls(users, 2, 2, first=21)
+    line = json.dumps(extra[1], ensure_ascii=False) + "\n"
+    _append_lines(billing.CALLS_JSONL_FILE, extra[:1], partial=line[:10])
+    system.compute_all_fees()
+    assert len(system.fees) == 21
+
+    with open(billing.CALLS_JSONL_FILE, "a", encoding="utf-8") as f:
+        f.write(line[10:])
+    system.compute_all_fees()
+    system.flush()
+    assert len(rerates) == 1
+    assert _read_lines(billing.FEES_JSONL_FILE) == _fees_lines(system, calls + extra)
+
+
+def test_jsonl_restart_resumes_from_saved_cursor(data_dir, users, rerates):
+    calls = make_calls(users, 100)
+    _append_lines(billing.CALLS_JSONL_FILE, calls)
+    billing.BillingSystem()
+
+    downtime = make_calls(users, 10, 2, first=101)
+    _append_lines(billing.CALLS_JSONL_FILE, downtime)
+    system = billing.BillingSystem()
+    system.compute_all_fees()
+    system.flush()
+    assert len(rerates) == 1
+    assert _read_lines(billing.FEES_JSONL_FILE) == _fees_lines(system, calls + downtime)
+
+
+def test_auto_detects_storage(data_dir, users):
+    write_calls(data_dir, make_calls(users, 5))
+    assert billing.BillingSystem().storage == "json"
+    _append_lines(billing.CALLS_JSONL_FILE, make_calls(users, 5))
+    assert billing.BillingSystem().storage == "jsonl"
+    assert billing.BillingSystem(storage="json").storage == "json"
+    with pytest.raises(ValueError):
+        billing.BillingSystem(storage="xml")
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""按手机号、区号、姓名建立的索引与原来逐个扫描 users / rates 的结果相同，资料文件变化后随之重建。"""
+
+import os
+
+from conftest import billing, dump_json, make_calls, write_calls, write_reference_data
+
+
+def _linear_user_name(users, phone_number):
+    for u in users:
+        if u.get("phoneNumber") == phone_number:
+            return u.get("userName", "未知用户")
+    return "未知用户"
+
+
+def _linear_rate(rates, area_code):
+    if not area_code:
+        return 0.0
+    for r in rates:
+        if r.get("areaCode") == area_code:
+            return float(r.get("ratePerMinute", 0.0))
+    return 0.0
+
+
+def _linear_find(users, name):
+    name = name.strip()
+    return [u for u in users if name and name in u.get("userName", "")]
+
+
+def _check(system, users, rates):
+    for phone in [u["phoneNumber"] for u in users] + ["00000000000", None]:
+        assert system.get_user_name(phone) == _linear_user_name(users, phone)
+    for code in [r["areaCode"] for r in rates] + ["999", "", None]:
+        assert system.get_rate(code) == _linear_rate(rates, code)
+    for name in {u["userName"][:k] for u in users for k in (1, 2)} | {" 张 ", "", "不存在"}:
+        assert system.find_users_by_name(name) == _linear_find(users, name)
+
+
+def test_indexes_match_linear_scan(data_dir):
+    users = write_reference_data(data_dir, users=200)
+    # 号码重复时取第一个用户，区号重复时取第一个费率，与线性查找相同
+    users.append(dict(users[3], userId="DUP", userName="重复号码"))
+    dump_json(billing.USERS_FILE, {"users": users})
+    rates = [{"areaCode": "010", "areaName": "北京", "ratePerMinute": 0.6},
+             {"areaCode": "010", "areaName": "重复", "ratePerMinute": 9.9},
+             {"areaCode": "021", "areaName": "上海", "ratePerMinute": "0.65"}]
+    dump_json(billing.RATES_FILE, {"longDistanceRates": rates})
+    write_calls(data_dir, make_calls(users, 20))
+    _check(billing.BillingSystem(), users, rates)
+
+
+def test_indexes_follow_changed_reference_files(data_dir):
+    users = write_reference_data(data_dir, users=100)
+    write_calls(data_dir, make_calls(users, 20))
+    system = billing.BillingSystem()
+
+    users = users[30:] + [{"userId": "N1", "userName": "新用户", "phoneNumber": "13900000000"}]
+    dump_json(billing.USERS_FILE, {"users": users})
+    rates = [{"areaCode": "010", "areaName": "北京", "ratePerMinute": 1.5}]
+    dump_json(billing.RATES_FILE, {"longDistanceRates": rates})
+    for path in (billing.USERS_FILE, billing.RATES_FILE):
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    system.compute_all_fees()
+    _check(system, users, rates)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""耗时统计：计费和查询按阶段计数，剖析方式的解析，--metrics 输出 JSON 报告，reset 清空统计。"""
+
+import json
+import os
+
+import pytest
+
+import billing_cli
+from conftest import append_calls, billing, make_calls, write_calls, write_reference_data
+
+
+def _stages(system):
+    return {row["stage"]: row for row in system.metrics.snapshot()}
+
+
+@pytest.fixture
+def users(data_dir):
+    users = write_reference_data(data_dir, users=20)
+    write_calls(data_dir, make_calls(users, 200))
+    return users
+
+
+@pytest.mark.parametrize("in_memory", [True, False])
+def test_stages_count_rating_and_queries(data_dir, users, in_memory):
+    billing.BillingSystem()
+    system = billing.BillingSystem(in_memory=in_memory)
+    system.metrics.reset()
+    append_calls(billing.CALLS_FILE, make_calls(users, 15, 2, first=201))
+    assert system.compute_all_fees() == 15
+    phone = users[0]["phoneNumber"]
+    system.query_fee_summary(phone)
+    system.query_fee_summary(phone)
+    records = system.query_call_records(phone)
+    # 内存模式下费用文件由后台线程写出，写完才计入 writeFees
+    system.flush()
+
+    stages = _stages(system)
+    assert stages["computeAllFees"]["calls"] == 1 and stages["computeAllFees"]["records"] == 15
+    assert stages["rateCalls"]["records"] == 15
+    assert stages["writeFees"]["records"] == 15
+    assert stages["queryFeeSummary"]["calls"] == 2
+    assert stages["queryCallRecords"]["records"] == len(records)
+    if not in_memory:
+        # 流式模式在第一次话费查询时才读费用文件建立合计
+        assert stages["indexFees"]["calls"] == 1 and stages["indexFees"]["records"] == 215
+    assert all(row["totalMs"] >= row["maxMs"] >= 0 for row in stages.values())
+
+    system.metrics.reset()
+    assert system.metrics.snapshot() == []
+
+
+def test_full_rerate_times_parse_and_write(data_dir, users):
+    system = billing.BillingSystem()
+    system.compute_all_fees(full=True)
+    system.flush()
+    stages = _stages(system)
+    assert stages["parseCalls"]["records"] >= 200
+    assert stages["writeFees"]["records"] >= 200
+
+
+def test_sqlite_stages(data_dir, users):
+    system = billing.SqliteBillingSystem(db_path=os.path.join(data_dir, "billing.db"))
+    system.metrics.reset()
+    append_calls(billing.CALLS_FILE, make_calls(users, 10, 2, first=201))
+    system.compute_all_fees()
+    stages = _stages(system)
+    assert stages["insertCalls"]["records"] == 10 and stages["writeFees"]["records"] == 10
+
+
+def test_parse_profile_modes():
+    assert billing.parse_profile_modes(None) == set()
+    assert billing.parse_profile_modes("") == set()
+    assert billing.parse_profile_modes("cprofile") == {"cprofile"}
+    assert billing.parse_profile_modes(" all ") == set(billing.PROFILE_MODES)
+    with pytest.raises(ValueError):
+        billing.parse_profile_modes("cprofile,perf")
+
+
+def test_cprofile_report(data_dir, users):
+    system = billing.BillingSystem(profile={"cprofile"})
+    system.metrics.reset()
+    system.query_fee_summary(users[0]["phoneNumber"])
+    report = system.metrics.report()
+    assert report["profile"] == ["cprofile"]
+    assert "query_fee_summary" in report["cprofile"]
+
+
+def test_cli_writes_metrics(data_dir, users, capsys, tmp_path, monkeypatch):
+    monkeypatch.delenv(billing.PROFILE_ENV, raising=False)
+    billing.BillingSystem()
+    phone = users[0]["phoneNumber"]
+    billing_cli.main(["--format", "json", "--metrics", "-", "fee", phone])
+    result = capsys.readouterr()
+    assert json.loads(result.out)[0]["phoneNumber"] == phone
+    report = json.loads(result.err)
+    assert report["profile"] == []
+    assert {"rateNewCalls", "queryFeeSummary"} <= {row["stage"] for row in report["stages"]}
+
+    path = str(tmp_path / "metrics.json")
+    billing_cli.main(["--metrics", path, "calls", phone])
+    with open(path, encoding="utf-8") as f:
+        assert "queryCallRecords" in {row["stage"] for row in json.load(f)["stages"]}
+
+    # 没有 --metrics 也没有打开剖析时不输出统计
+    billing_cli.main(["users", "张"])
+    assert capsys.readouterr().err == ""
+
+    with pytest.raises(SystemExit):
+        billing_cli.main(["--profile", "perf", "users", "张"])
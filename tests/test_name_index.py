@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""姓名子串索引：NameIndex 和 find_users_by_name 的结果与逐个姓名做子串匹配完全一致，增量维护后也是如此。"""
+
+import os
+import random
+
+import pytest
+
+from conftest import billing, dump_json, make_calls, write_calls, write_reference_data
+
+# 字很少的字母表：各个两字组都出现但并不依次相连（如在 "张三张" 中查 "三张三"）的情况很常见
+ALPHABET = "张三李四王五"
+
+
+def _names(rng, count):
+    return ["".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 5))) for _ in range(count)]
+
+
+def _queries(rng, names):
+    queries = {name[i:j] for name in names for i in range(len(name)) for j in range(i + 1, len(name) + 1)}
+    queries.update(_names(rng, 200))
+    return sorted(queries)
+
+
+def _linear_names(names, text):
+    return {name for name in names if text and text in name}
+
+
+def _linear_find(users, text, limit=None):
+    text = text.strip()
+    found = [u for u in users if text and text in u.get("userName", "")]
+    return found if limit is None else found[:limit]
+
+
+def test_search_matches_substring_scan():
+    rng = random.Random(1)
+    names = _names(rng, 300)
+    index = billing.NameIndex(names)
+    assert len(index) == len(set(names))
+    for text in _queries(rng, names) + [""]:
+        assert index.search(text) == _linear_names(names, text), text
+
+
+def test_search_after_add_and_discard():
+    rng = random.Random(2)
+    names = set(_names(rng, 200))
+    index = billing.NameIndex(names)
+    for _ in range(300):
+        name = _names(rng, 1)[0]
+        if rng.random() < 0.5:
+            index.add(name)
+            names.add(name)
+        else:
+            index.discard(name)
+            names.discard(name)
+    assert index.names == names
+    for text in _queries(rng, names):
+        assert index.search(text) == _linear_names(names, text), text
+
+
+@pytest.fixture
+def users(data_dir):
+    rng = random.Random(3)
+    users = write_reference_data(data_dir, users=1000)
+    for u in users:
+        u["userName"] = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(1, 4)))
+    dump_json(billing.USERS_FILE, {"users": users})
+    write_calls(data_dir, make_calls(users, 20))
+    return users
+
+
+@pytest.mark.parametrize("limit", [None, 1, 5, 10000])
+def test_find_users_by_name_keeps_file_order(users, limit):
+    system = billing.BillingSystem()
+    names = [u["userName"] for u in users]
+    for text in _queries(random.Random(4), names[:50]) + [" 张 ", ""]:
+        assert system.find_users_by_name(text, limit) == _linear_find(users, text, limit), text
+
+
+def test_index_follows_changed_users_file(users):
+    system = billing.BillingSystem()
+    # 去掉一部分用户、改掉一些姓名、再加入同名用户
+    users = users[100:] + [dict(u, userName=u["userName"] + "五", userId=f"N{i}") for i, u in enumerate(users[:50])]
+    users[0] = dict(users[0], userName="王王王")
+    dump_json(billing.USERS_FILE, {"users": users})
+    stat = os.stat(billing.USERS_FILE)
+    os.utime(billing.USERS_FILE, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    system.compute_all_fees()
+    assert system._name_index.names == {u["userName"] for u in users}
+    names = [u["userName"] for u in users]
+    for text in _queries(random.Random(5), names[:50]) + ["王王王"]:
+        assert system.find_users_by_name(text) == _linear_find(users, text), text
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""多进程分片计费：费用记录、话费合计和写出的费用文件与单进程计费完全相同；--workers 启动参数传给计费系统。"""
+
+import importlib
+import os
+
+import pytest
+
+from conftest import billing, make_calls, read_text, write_calls, write_reference_data
+
+
+@pytest.fixture
+def users(data_dir, monkeypatch):
+    # 测试数据不大，把启用进程池的门槛降低
+    monkeypatch.setattr(billing, "PARALLEL_MIN_RECORDS", 100)
+    return write_reference_data(data_dir, users=60)
+
+
+def test_shards_match_sequential_rating(data_dir, users):
+    calls = make_calls(users, 3000)
+    write_calls(data_dir, calls)
+    system = billing.BillingSystem(workers=2)
+    with system.open_rating_pool() as pool:
+        rows = system.rate_calls_parallel(calls, pool)
+    assert rows == system.rate_calls(calls)
+
+
+def test_parallel_full_rerate_writes_same_fees(data_dir, users):
+    write_calls(data_dir, make_calls(users, 2000))
+    sequential = billing.BillingSystem()
+    sequential.flush()
+    expected = read_text(billing.FEES_FILE)
+
+    parallel = billing.BillingSystem(workers=3)
+    assert parallel.compute_all_fees(full=True) == 2000
+    parallel.flush()
+    assert read_text(billing.FEES_FILE) == expected
+    for u in users:
+        phone = u["phoneNumber"]
+        assert parallel.query_fee_summary(phone) == sequential.query_fee_summary(phone)
+        assert parallel.query_call_records(phone) == sequential.query_call_records(phone)
+
+
+def test_parallel_sqlite_rerate(data_dir, users):
+    write_calls(data_dir, make_calls(users, 1500))
+    files = billing.BillingSystem()
+    files.flush()
+    db = billing.SqliteBillingSystem(db_path=os.path.join(data_dir, "billing.db"), workers=2)
+    # 第二次全量重算走按批从 calls 表取出、分片计费的路径
+    db.compute_all_fees(full=True)
+    export = os.path.join(data_dir, "export.json")
+    db.export_json(export)
+    assert read_text(export) == read_text(files.fees_file)
+
+
+def test_main_passes_workers(monkeypatch):
+    started = []
+
+    class FakeApp:
+        def __init__(self, storage, workers, profile=None, fees_format=None):
+            started.append((storage, workers))
+
+        def mainloop(self):
+            pass
+
+    # 图形界面脚本的文件名不是合法的标识符，用 importlib 导入（导入时只定义函数和类，不会打开窗口）
+    gui = importlib.import_module("P23000626-B2")
+    monkeypatch.setattr(gui, "BillingApp", FakeApp)
+    gui.main(["--storage", "jsonl", "--workers", "4"])
+    gui.main([])
+    assert started == [("jsonl", 4), (billing.BILLING_STORAGE, 1)]
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""后台计费线程：compute_all_fees 返回计费条数，RatingWorker 每轮发布 RatingStatus，计费时查询不会看到合并了一半的批次。"""
+
+import os
+import threading
+
+from conftest import append_calls, billing, dump_json, load_json, make_calls, write_calls, write_reference_data
+
+
+def test_compute_all_fees_returns_rated_count(data_dir):
+    users = write_reference_data(data_dir)
+    calls_file = write_calls(data_dir, make_calls(users, 50))
+    system = billing.BillingSystem()
+    assert system.compute_all_fees() == 0
+    append_calls(calls_file, make_calls(users, 7, 2, first=51))
+    assert system.compute_all_fees() == 7
+    assert system.compute_all_fees(full=True) == 57
+
+
+def test_rate_once_reports_status_and_errors(data_dir, monkeypatch):
+    users = write_reference_data(data_dir)
+    calls_file = write_calls(data_dir, make_calls(users, 20))
+    system = billing.BillingSystem()
+    worker = billing.RatingWorker(system)
+
+    append_calls(calls_file, make_calls(users, 5, 2, first=21))
+    status = worker.rate_once()
+    assert status.records == 5 and status.error is None
+    assert status.lag >= 0.0 and status.records_per_sec >= 0.0
+
+    def broken(full=False):
+        raise RuntimeError("磁盘已满")
+
+    monkeypatch.setattr(system, "compute_all_fees", broken)
+    status = worker.rate_once()
+    assert status.records == 0 and status.error == "磁盘已满"
+
+
+def test_worker_thread_rates_appended_calls(data_dir):
+    users = write_reference_data(data_dir)
+    calls = make_calls(users, 100)
+    calls_file = write_calls(data_dir, calls)
+    system = billing.BillingSystem()
+    phone = users[0]["phoneNumber"]
+    totals = set()
+    stop = threading.Event()
+
+    def query():
+        while not stop.is_set():
+            totals.add(system.query_fee_summary(phone))
+
+    reader = threading.Thread(target=query)
+    reader.start()
+    worker = billing.RatingWorker(system, interval=0.01)
+    worker.start()
+    # 原子替换写出，计费线程不会读到写了一半的文件
+    extra = make_calls(users, 400, 2, first=101)
+    dump_json(calls_file + ".new", {"callRecords": load_json(calls_file)["callRecords"] + extra})
+    os.replace(calls_file + ".new", calls_file)
+    rated = 0
+    while rated < len(extra):
+        rated += worker.status_queue.get(timeout=10).records
+    worker.stop()
+    worker.join(timeout=10)
+    stop.set()
+    reader.join()
+
+    assert not worker.is_alive()
+    # 查询只会看到追加前或追加后的合计
+    expected = billing.BillingSystem().query_fee_summary(phone)
+    assert system.query_fee_summary(phone) == expected
+    assert totals <= {expected, _summary_of(system, users, calls, phone)}
+
+
+def _summary_of(system, users, calls, phone):
+    local_sum = long_sum = 0.0
+    for fee in (system.rate_call(c) for c in calls):
+        if fee["callerNumber"] == phone:
+            local_sum += fee["localFee"]
+            long_sum += fee["longDistanceFee"]
+    local_sum, long_sum = round(local_sum, 2), round(long_sum, 2)
+    return system.get_user_name(phone), local_sum, long_sum, round(local_sum + long_sum, 2)
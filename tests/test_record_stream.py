@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""RecordStream 在读缓冲区边界、JSON 文件结尾和未写完的 JSON Lines 行处的解析结果与 json.load 一致；持锁读取时只读到取快照时已提交的记录。"""
+
+import importlib
+import json
+
+import pytest
+
+from conftest import billing
+
+# 多字节字符、字符串中的 "]}"、转义和嵌套值都可能被读缓冲区切开
+RECORDS = [
+    {"callId": i, "userName": "张三" * (i % 4), "note": 'a]}"\\\n' * (i % 3), "nested": {"k": [i, None, 1.5]},
+     "flag": i % 2 == 0}
+    for i in range(60)
+]
+CHUNK_SIZES = [1, 7, 64, billing.STREAM_CHUNK_SIZE]
+
+
+def _write(tmp_path, name, records):
+    path = str(tmp_path / name)
+    billing.write_json_records(path, "records", records)
+    return path
+
+
+def test_write_matches_json_dump(tmp_path):
+    for records in (RECORDS, []):
+        path = _write(tmp_path, "a.json", iter(records))
+        with open(path, encoding="utf-8") as f:
+            assert f.read() == json.dumps({"records": records}, ensure_ascii=False, indent=4)
+
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+@pytest.mark.parametrize("name", ["a.json", "a.jsonl"])
+def test_stream_matches_json_load(tmp_path, chunk_size, name):
+    path = _write(tmp_path, name, RECORDS)
+    assert list(billing.RecordStream(path, "records", chunk_size=chunk_size)) == RECORDS
+
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+def test_end_offset_and_tail_point_at_last_record(tmp_path, chunk_size):
+    path = _write(tmp_path, "a.json", RECORDS)
+    stream = billing.RecordStream(path, "records", tail_size=32, chunk_size=chunk_size)
+    list(stream)
+    with open(path, "rb") as f:
+        data = f.read()
+    assert data[:stream.end_offset].endswith(b"}")
+    assert data[stream.end_offset:] == b"\n    ]\n}"
+    assert stream.tail == data[stream.end_offset - 32:stream.end_offset]
+
+
+def test_empty_array(tmp_path):
+    path = _write(tmp_path, "a.json", [])
+    stream = billing.RecordStream(path, "records", chunk_size=1)
+    assert list(stream) == []
+    with open(path, "rb") as f:
+        assert f.read()[:stream.end_offset].endswith(b"[")
+
+
+def test_array_followed_by_other_keys_cannot_be_appended(tmp_path):
+    path = str(tmp_path / "a.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"records": RECORDS[:3], "other": 1}, f)
+    stream = billing.RecordStream(path, "records", chunk_size=7)
+    assert list(stream) == RECORDS[:3]
+    assert stream.end_offset is None
+
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+def test_unfinished_jsonl_line_is_left_for_later(tmp_path, chunk_size):
+    path = _write(tmp_path, "a.jsonl", RECORDS[:5])
+    with open(path, "rb") as f:
+        complete = len(f.read())
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"callId": 99, "userName": "李')
+    stream = billing.RecordStream(path, chunk_size=chunk_size)
+    assert list(stream) == RECORDS[:5]
+    assert stream.end_offset == complete
+
+
+@pytest.mark.parametrize("name", ["calls.json", "calls.jsonl"])
+def test_locked_stream_reads_snapshot_while_writer_appends(tmp_path, name):
+    generator = importlib.import_module("随机通话记录生成")
+    jsonl = name.endswith(".jsonl")
+    path = str(tmp_path / name)
+
+    def append(records):
+        texts = [json.dumps(r, ensure_ascii=False) if jsonl else billing.dump_indented_record(r) for r in records]
+        generator.append_texts(path, texts, jsonl)
+
+    append(RECORDS[:20])
+    stream = iter(billing.RecordStream(path, "callRecords", chunk_size=64, locked=True))
+    seen = [next(stream)]
+    # 读到一半时写入方持排他锁追加（JSON 文件的结尾 "]}" 被原处改写）：读取方不持锁，不会挡住写入方，
+    # 已开始的遍历只读到取快照时的内容
+    append(RECORDS[20:30])
+    seen.extend(stream)
+    assert seen == RECORDS[:20]
+    assert list(billing.RecordStream(path, "callRecords", chunk_size=64, locked=True)) == RECORDS[:30]
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""SQLite 存储：查询结果与文件存储相同，导出的费用文件逐字节相同，取值原样保存，重新启动后从保存的位置续读。"""
+
+import json
+import os
+
+import pytest
+
+from conftest import append_calls, billing, make_calls, read_text, write_calls, write_reference_data
+
+
+@pytest.fixture
+def users(data_dir):
+    return write_reference_data(data_dir, users=40)
+
+
+@pytest.fixture
+def db_path(data_dir):
+    return os.path.join(data_dir, "billing.db")
+
+
+@pytest.fixture
+def sqlite_rerates(monkeypatch):
+    counter = []
+    original = billing.SqliteBillingSystem._rerate_all_calls
+
+    def counted(self, *args, **kwargs):
+        counter.append(1)
+        return original(self, *args, **kwargs)
+
+    monkeypatch.setattr(billing.SqliteBillingSystem, "_rerate_all_calls", counted)
+    return counter
+
+
+def _check_same(db, files, users, path):
+    for phone in [u["phoneNumber"] for u in users] + ["00000000000"]:
+        assert db.query_fee_summary(phone) == files.query_fee_summary(phone)
+        assert db.query_call_records(phone) == files.query_call_records(phone)
+    db.export_json(path)
+    files.flush()
+    assert read_text(path) == read_text(files.fees_file)
+
+
+def test_sqlite_matches_file_storage(data_dir, users, db_path, sqlite_rerates):
+    calls = make_calls(users, 300)
+    calls_file = write_calls(data_dir, calls)
+    db = billing.SqliteBillingSystem(db_path=db_path)
+    files = billing.BillingSystem()
+    export = os.path.join(data_dir, "export.json")
+    _check_same(db, files, users, export)
+
+    for seed in (2, 3):
+        append_calls(calls_file, make_calls(users, 30, seed, first=301 + 30 * (seed - 2)))
+        db.compute_all_fees()
+        files.compute_all_fees()
+        _check_same(db, files, users, export)
+    assert len(sqlite_rerates) == 1
+
+    # 重新启动后从 meta 表中的位置续读，不再全量重算
+    append_calls(calls_file, make_calls(users, 5, 4, first=361))
+    db = billing.SqliteBillingSystem(db_path=db_path)
+    db.compute_all_fees()
+    files.compute_all_fees()
+    assert len(sqlite_rerates) == 1
+    _check_same(db, files, users, export)
+
+    db.import_json()
+    _check_same(db, files, users, export)
+
+
+def test_values_are_stored_losslessly(data_dir, users, db_path):
+    calls = make_calls(users, 8)
+    calls[0]["callId"] = 5
+    calls[1]["callId"] = True
+    calls[2]["callId"] = {"batch": 1, "seq": [1, 2]}
+    calls[3]["durationSeconds"] = 120.0
+    calls[4]["durationSeconds"] = 2 ** 70
+    calls[5]["callerNumber"] = 13800000001
+    calls[-1]["callId"] = 2 ** 80
+    calls_file = write_calls(data_dir, calls)
+
+    files = billing.BillingSystem()
+    db = billing.SqliteBillingSystem(db_path=db_path)
+    _check_same(db, files, users, os.path.join(data_dir, "export.json"))
+
+    # 超出 64 位的 lastCallId 在重新启动后仍能对上续读位置
+    append_calls(calls_file, make_calls(users, 2, 2, first=9))
+    db = billing.SqliteBillingSystem(db_path=db_path)
+    assert db._last_call_id == 2 ** 80
+    db.compute_all_fees()
+    files.compute_all_fees()
+    _check_same(db, files, users, os.path.join(data_dir, "export.json"))
+
+
+def test_fee_summary_sums_in_call_order(data_dir, users, db_path):
+    # 先有一笔巨额费用、再有大量小额费用时，按通话顺序逐条相加的结果（小额费用被舍入掉）
+    # 与文件存储的话费合计完全一致，不受 SQLite SUM 求和方式的影响
+    calls = make_calls(users[:2], 2000)
+    calls[0]["durationSeconds"] = 2 ** 60
+    write_calls(data_dir, calls)
+    files = billing.BillingSystem()
+    db = billing.SqliteBillingSystem(db_path=db_path)
+    for u in users[:2]:
+        assert db.query_fee_summary(u["phoneNumber"]) == files.query_fee_summary(u["phoneNumber"])
+        # 按计费周期查询时同样按通话顺序相加
+        period = ("2025-01-01", "2026-01-01")
+        assert db.query_fee_summary(u["phoneNumber"], *period) == files.query_fee_summary(u["phoneNumber"], *period)
+
+
+def test_jsonl_export_layout(data_dir, users, db_path):
+    calls = make_calls(users, 20)
+    with open(billing.CALLS_JSONL_FILE, "w", encoding="utf-8") as f:
+        f.write("".join(json.dumps(c, ensure_ascii=False) + "\n" for c in calls))
+    files = billing.BillingSystem()
+    db = billing.SqliteBillingSystem(db_path=db_path)
+    assert db.storage == "jsonl"
+    _check_same(db, files, users, os.path.join(data_dir, "export.jsonl"))
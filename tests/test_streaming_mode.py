@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""流式模式（in_memory=False）：写出的费用文件和查询结果与内存模式相同，话费合计在第一次话费查询时才建立。"""
+
+import pytest
+
+from conftest import append_calls, billing, make_calls, read_text, write_calls, write_reference_data
+
+
+@pytest.fixture
+def users(data_dir, monkeypatch):
+    # 批量小一些，全量重算要分好几批读取和写出
+    monkeypatch.setattr(billing, "RATING_BATCH_SIZE", 64)
+    return write_reference_data(data_dir, users=30)
+
+
+def _check_same(streaming, memory, users):
+    for phone in [u["phoneNumber"] for u in users] + ["00000000000"]:
+        assert streaming.query_fee_summary(phone) == memory.query_fee_summary(phone)
+        assert streaming.query_call_records(phone) == memory.query_call_records(phone)
+
+
+@pytest.mark.parametrize("storage", ["json", "jsonl"])
+def test_streaming_matches_in_memory(data_dir, users, storage, rerates):
+    calls = make_calls(users, 500)
+    if storage == "jsonl":
+        billing.write_jsonl_atomic(billing.CALLS_JSONL_FILE, calls)
+        calls_file = None
+    else:
+        calls_file = write_calls(data_dir, calls)
+
+    streaming = billing.BillingSystem(storage, in_memory=False)
+    # 还没有费用文件时启动不计费，第一次 compute_all_fees 全量重算
+    assert not rerates
+    assert streaming.compute_all_fees() == 500
+    fees_text = read_text(streaming.fees_file)
+    memory = billing.BillingSystem(storage)
+    assert read_text(memory.fees_file) == fees_text
+    _check_same(streaming, memory, users)
+
+    extra = make_calls(users, 40, 2, first=501)
+    if calls_file:
+        append_calls(calls_file, extra)
+    else:
+        billing.append_jsonl(billing.CALLS_JSONL_FILE, extra)
+    assert streaming.compute_all_fees() == 40
+    # 两个计费系统共用同一个费用文件：由流式模式追加新费用，内存模式重新启动后从计费状态续读
+    memory = billing.BillingSystem(storage)
+    assert len(rerates) == 1
+    _check_same(streaming, memory, users)
+    assert list(memory.fees) == [memory.rate_call(call) for call in calls + extra]
+
+
+def test_fee_totals_built_on_first_fee_query(data_dir, users, monkeypatch):
+    calls_file = write_calls(data_dir, make_calls(users, 200))
+    memory = billing.BillingSystem()
+    expected = memory.query_call_records(users[0]["phoneNumber"])
+
+    scans = []
+    original = billing.BillingSystem._index_fees
+
+    def counted(totals, rows):
+        rows = list(rows)
+        scans.append(len(rows))
+        return original(totals, rows)
+
+    monkeypatch.setattr(billing.BillingSystem, "_index_fees", staticmethod(counted))
+    streaming = billing.BillingSystem(in_memory=False)
+    # 计费状态有效：启动时既不重算，也不扫描费用文件
+    assert streaming.query_call_records(users[0]["phoneNumber"]) == expected
+    assert scans == []
+
+    # 合计还没建立时计费的新记录，建立合计时从费用文件中读到，只算一次
+    append_calls(calls_file, make_calls(users, 20, 2, first=201))
+    assert streaming.compute_all_fees() == 20
+    assert scans == []
+    memory = billing.BillingSystem()
+    scans.clear()
+    _check_same(streaming, memory, users)
+    assert scans == [220]
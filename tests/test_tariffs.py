@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""资费方案：没有 tariffs.json 时费用与原来的固定规则逐位相同；分档、峰谷时段和按用户选择的套餐；
+带缓存的 rated 与舍入 fees 的结果相同；定义有误时保留原来的数据和索引。"""
+
+import json
+
+import pytest
+
+from conftest import billing, dump_json, make_calls, write_calls, write_reference_data
+
+NIGHT = {
+    "local": {"baseMinutes": 3, "baseFee": 0.5,
+              "tiers": [{"uptoMinutes": 9, "blockMinutes": 3, "blockFee": 0.2},
+                        {"blockMinutes": 3, "blockFee": 0.1}]},
+    "longDistance": {"tiers": [{"uptoMinutes": 10, "multiplier": 1.0}, {"multiplier": 0.5}]},
+    "offPeak": {"from": "22:00", "to": "07:00", "localMultiplier": 0.5, "longDistanceMultiplier": 0.5},
+}
+
+
+def _fixed_rule(system, call):
+    """资费方案引入之前 rate_call 的写法。"""
+    minutes = -(-int(call["durationSeconds"]) // 60)
+    long_fee = 0.0
+    if call["callType"] == "long-distance":
+        long_fee = system.get_rate(call["longDistanceAreaCode"]) * minutes
+    return round(billing.calc_local_fee(minutes), 2), round(long_fee, 2)
+
+
+@pytest.fixture
+def users(data_dir):
+    users = write_reference_data(data_dir, users=20)
+    write_calls(data_dir, make_calls(users, 50))
+    return users
+
+
+def test_default_plan_matches_fixed_rule(users):
+    system = billing.BillingSystem()
+    calls = make_calls(users, 3 * billing.BATCH_RATING_MIN_RECORDS, 2)
+    rows = system.rate_calls(calls)
+    assert rows == [system.rate_call(call) for call in calls]
+    assert [(r["localFee"], r["longDistanceFee"]) for r in rows] == [_fixed_rule(system, c) for c in calls]
+
+
+def test_tiers_and_off_peak(users):
+    dump_json(billing.TARIFFS_FILE, {"plans": {"night": NIGHT}})
+    users[0]["plan"] = "night"
+    dump_json(billing.USERS_FILE, {"users": users})
+    system = billing.BillingSystem()
+    call = {"callerNumber": users[0]["phoneNumber"], "callType": "long-distance",
+            "longDistanceAreaCode": "010", "durationSeconds": 14 * 60, "startTime": "2025-11-01 12:00:00"}
+    # 本地：0.5 + 2 档 × 0.2 + 2 档 × 0.1；长途：10 分钟 × 0.6 + 4 分钟 × 0.6 × 0.5
+    fee = system.rate_call(call)
+    assert (fee["localFee"], fee["longDistanceFee"]) == (round(0.5 + 0.4 + 0.2, 2), round(6.0 + 1.2, 2))
+    fee = system.rate_call(dict(call, startTime="2025-11-01 23:30:00"))
+    assert (fee["localFee"], fee["longDistanceFee"]) == (round(1.1 * 0.5, 2), round(7.2 * 0.5, 2))
+    # 其他用户仍按默认套餐，批量计费退回逐条计算
+    other = dict(call, callerNumber=users[1]["phoneNumber"])
+    assert (system.rate_call(other)["localFee"], system.rate_call(other)["longDistanceFee"]) == _fixed_rule(system, other)
+    calls = make_calls(users, 2 * billing.BATCH_RATING_MIN_RECORDS, 3)
+    assert system.rate_calls(calls) == [system.rate_call(c) for c in calls]
+
+
+def test_digest_unchanged_without_tariffs(users):
+    digest = billing.BillingSystem()._reference_digest
+    dump_json(billing.TARIFFS_FILE, {})
+    assert billing.BillingSystem()._reference_digest == digest
+    dump_json(billing.TARIFFS_FILE, {"plans": {"night": NIGHT}})
+    assert billing.BillingSystem()._reference_digest != digest
+
+
+@pytest.mark.parametrize("spec", [{}, NIGHT])
+def test_memoized_rating_matches_rounded_fees(spec):
+    plan = billing.compile_tariff_plan("p", spec)
+    limit = billing.FEE_TABLE_MAX_MINUTES
+    # 表外的负数和超长通话直接计算；表内的按需延长，跨过延长边界的顺序打乱
+    minutes = [-61, -1, 0, 1, 59, 60, 61, 500, 120, 3000, limit - 1, limit, limit + 1, 2 ** 60 + 1]
+    for start_time in ("2025-11-01 12:00:00", "2025-11-01 23:00:00", None):
+        call = {"startTime": start_time}
+        off_peak = start_time is not None and start_time[11:13] == "23" and spec is NIGHT
+        for m in minutes:
+            for rate, area in ((None, None), (0.6, "010"), (-0.0, "099"), (0.001, "098")):
+                local_fee, long_fee = plan.fees(m, rate, off_peak)
+                local_fee, long_fee = round(local_fee, 2), round(long_fee, 2)
+                expected = (local_fee, long_fee, round(local_fee + long_fee, 2))
+                # repr 区分 0.0 和 -0.0
+                assert repr(plan.rated(m, rate, area, call)) == repr(expected)
+
+
+def test_minutes_round_up_with_integers(users):
+    system = billing.BillingSystem()
+    calls = make_calls(users, billing.BATCH_RATING_MIN_RECORDS, 4)
+    # 时长很大时按浮点数除以 60 会先舍入，向上取整后少算 1 分钟（如 60 * 2**48 + 1 秒）
+    durations = [60 * 2 ** 48 + 1, 60 * 2 ** 55 + 1, 2 ** 53 + 1, 2 ** 63 - 1, -61, 0, 60, 61]
+    for call, duration in zip(calls, durations):
+        call.update(durationSeconds=duration, callType="long-distance", longDistanceAreaCode="010")
+    rows = system.rate_calls(calls)
+    assert rows == [system.rate_call(call) for call in calls]
+    for row, duration in zip(rows, durations):
+        assert row["longDistanceFee"] == round(0.6 * -(-duration // 60), 2)
+
+
+@pytest.mark.parametrize("tariffs", [[], {"plans": []}, {"plans": {"p": []}}, {"plans": {"p": {"local": 1}}},
+                                     {"plans": {"p": {"offPeak": "22:00"}}},
+                                     {"plans": {"p": {"longDistance": {"tiers": [1]}}}},
+                                     {"plans": {"p": {"local": {"tiers": [{"uptoMinutes": 2}, {}]}}}}])
+def test_invalid_tariffs_raise_value_error(tariffs):
+    with pytest.raises(ValueError):
+        billing.compile_tariffs(tariffs)
+
+
+def test_invalid_tariffs_keep_previous_indexes(users, rerates):
+    system = billing.BillingSystem()
+    rerates.clear()
+    users.append({"userId": "N1", "userName": "新用户", "phoneNumber": "13900000000"})
+    dump_json(billing.USERS_FILE, {"users": users})
+    with open(billing.TARIFFS_FILE, "w", encoding="utf-8") as f:
+        json.dump({"plans": {"p": {"local": []}}}, f)
+    for _ in range(2):
+        # 每一轮都重新报告错误，查询仍使用原来的数据和索引
+        with pytest.raises(ValueError):
+            system.compute_all_fees()
+        assert system.find_users_by_name("新用户") == []
+        assert system.get_user_name("13900000000") == "未知用户"
+    dump_json(billing.TARIFFS_FILE, {"plans": {"night": NIGHT}})
+    system.compute_all_fees()
+    assert system.get_user_name("13900000000") == "新用户" and len(rerates) == 1
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+一次性格式转换：把 calls.json / fees.json 转换为 JSON Lines 文件 calls.jsonl / fees.jsonl。
+
+- calls.json 的布局为 {"callRecords": [...]}，fees.json 的布局为 {"fees": [...]}
+- 转换后每行一条记录，计费系统和实时通话生成器检测到 calls.jsonl 后会自动改用 JSONL 格式，
+  新记录只追加写入，不再整体重写文件
+- 先写临时文件再原子替换，转换中途中断也不会留下写了一半的目标文件
+- 逐条流式读取，不把整个文件读进内存；按 billing_core.file_lock 的约定，转换期间对源文件持共享锁、
+  对目标文件持排他锁，实时通话生成器不会在转换中途追加记录
+- 原来的 .json 文件保留不动；以 zlib 编码（gzip 压缩）写出的 fees.json 按文件头自动识别
+"""
+
+import os
+
+from billing_core import RecordStream, file_lock, write_jsonl_atomic
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CALLS_FILE = os.path.join(BASE_DIR, "calls.json")
+FEES_FILE = os.path.join(BASE_DIR, "fees.json")
+CALLS_JSONL_FILE = os.path.join(BASE_DIR, "calls.jsonl")
+FEES_JSONL_FILE = os.path.join(BASE_DIR, "fees.jsonl")
+
+
+def convert_to_jsonl(src, dst, key):
+    """把 {key: [...]} 布局的 JSON 文件转换为 JSON Lines 文件，返回转换的记录条数。"""
+    count = 0
+
+    def counted(records):
+        nonlocal count
+        for record in records:
+            count += 1
+            yield record
+
+    with file_lock(src), file_lock(dst, exclusive=True):
+        write_jsonl_atomic(dst, counted(RecordStream(src, key)))
+    return count
+
+
+if __name__ == "__main__":
+    for src, dst, key in [
+        (CALLS_FILE, CALLS_JSONL_FILE, "callRecords"),
+        (FEES_FILE, FEES_JSONL_FILE, "fees"),
+    ]:
+        if not os.path.exists(src):
+            print(f"[跳过] 未找到 {src}")
+            continue
+        count = convert_to_jsonl(src, dst, key)
+        print(f"[完成] {src} → {dst}，共 {count} 条记录")
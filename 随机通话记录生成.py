@@ -3,26 +3,60 @@
 实时通话记录生成器：每隔随机时间生成一条通话记录，追加到 calls.json 中。
 
 与计费 GUI 搭配使用：
-- 计费 GUI 每 5 秒自动重算话费
+- 计费 GUI 的后台计费线程发现通话记录文件变化后，只对新追加的记录计费
 - 本脚本负责源数据 calls.json 的“实时”增长
+
+如果目录下存在 calls.jsonl（可用“通话记录格式转换.py”生成），
+则改为每条记录一行追加写入 calls.jsonl。
+calls.json 也不再整体重写，新记录插入到文件末尾的 "]}" 之前。
+
+写入时按 billing_core.file_lock 的约定持有排他锁（calls.json.lock / calls.jsonl.lock），
+计费系统持共享锁读取，不会读到写了一半的记录。
+
+压测模式（带参数运行）：
+- --count N       尽快生成 N 条通话记录后退出，开始时间从 --from 起均匀分布在 --days 天内
+- --rate R        按每秒 R 条的速率持续生成，开始时间为当前时间；可用 --duration 或 --count 限定
+- --seed          随机种子，种子与其余参数相同时生成的记录完全相同（--rate 模式下开始时间除外）
+- --zipf S        主叫号码按 Zipf 分布倾斜（S 越大越集中在少数用户），默认 0 即均匀分布
+- --long-distance-ratio  长途通话所占比例，默认 0.3
+- 批量生成时记录攒够一批（--batch 条）后一次追加写入，按速率生成时每 0.2 秒追加写入一次：calls.jsonl 追加若干行，
+  calls.json 只改写文件末尾的 "]}" 并在其前面插入新记录，已有内容不会重写，
+  计费系统仍能只续读新增的部分
+
+用法示例：
+    python 随机通话记录生成.py --count 1000000 --seed 42 --zipf 1.1
+    python 随机通话记录生成.py --rate 5000 --duration 60 --output calls.jsonl
 """
 
+import argparse
+import itertools
 import json
 import os
 import random
+import re
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
+
+from billing_core import SNAPSHOT_TAIL_BYTES, dump_indented_record, file_lock
 
 # ===== 基本路径设置 =====
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 USERS_FILE = os.path.join(BASE_DIR, "users.json")
 RATES_FILE = os.path.join(BASE_DIR, "rates.json")
 CALLS_FILE = os.path.join(BASE_DIR, "calls.json")
+CALLS_JSONL_FILE = os.path.join(BASE_DIR, "calls.jsonl")
 
 # ===== 生成间隔（秒）范围，可以根据需要修改 =====
 MIN_INTERVAL = 2    # 每条通话之间最短间隔（秒）
 MAX_INTERVAL = 10   # 每条通话之间最长间隔（秒）
 
+# ===== 压测模式的默认参数 =====
+DEFAULT_BATCH_SIZE = 10000         # 每次追加写入的记录条数
+DEFAULT_LONG_DISTANCE_RATIO = 0.3  # 长途通话所占比例
+RATE_TICK = 0.2                    # 按速率生成时每隔多少秒补齐一次应生成的记录
+TAIL_BYTES = 4096                  # 查找文件末尾的 "]}" 和最后一个 callId 时读取的字节数
+CALL_ID_OVERLAP = 64               # 向前逐块查找 callId 时相邻两块重叠的字节数，不短于一个 "callId" 键值对
+
 
 # ===== 一些初始化工具 =====
 
@@ -62,9 +96,9 @@ def load_json(path, default=None):
         return json.load(f)
 
 
-def save_json(path, data):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+def use_jsonl():
+    """存在 calls.jsonl 时使用 JSON Lines 格式，与计费系统的自动检测保持一致。"""
+    return os.path.exists(CALLS_JSONL_FILE)
 
 
 # ===== 随机生成通话相关的工具 =====
@@ -102,43 +136,272 @@ def random_other_user_phone(users, caller_number):
     return caller_number
 
 
+# ===== 压测模式：批量生成通话记录 =====
+
+# 一条通话记录在 calls.jsonl 中的一行，与 json.dumps(record, ensure_ascii=False) 的结果相同
+JSONL_TEMPLATE = ('{"callId": "C%04d", "callerNumber": %s, "calleeNumber": %s, "startTime": "%s", '
+                  '"durationSeconds": %d, "callType": "%s", "longDistanceAreaCode": %s}')
+# 一条通话记录在 calls.json 中的文本，与 json.dump(..., ensure_ascii=False, indent=4) 写出的相同
+JSON_TEMPLATE = ('        {\n'
+                 '            "callId": "C%04d",\n'
+                 '            "callerNumber": %s,\n'
+                 '            "calleeNumber": %s,\n'
+                 '            "startTime": "%s",\n'
+                 '            "durationSeconds": %d,\n'
+                 '            "callType": "%s",\n'
+                 '            "longDistanceAreaCode": %s\n'
+                 '        }')
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class TrafficGenerator:
+    """
+    按固定随机种子生成通话记录文本，供压测使用。
+    - 主叫号码按 Zipf 分布抽取：先用种子打乱用户顺序，排第 k 位的用户权重为 1 / k^zipf
+    - 被叫号码在除主叫外的用户中均匀抽取，长途通话的区号在 rates.json 的区号中均匀抽取
+    - 号码、区号事先编码成 JSON 字符串，每条记录只做一次字符串格式化，不逐条调用 json.dumps
+    """
+
+    def __init__(self, users, area_codes, seed=None, zipf=0.0,
+                 long_distance_ratio=DEFAULT_LONG_DISTANCE_RATIO, next_index=1, jsonl=True):
+        self.rng = random.Random(seed)
+        phones = [u.get("phoneNumber") for u in users if u.get("phoneNumber")]
+        self.rng.shuffle(phones)
+        self.phones = [json.dumps(p, ensure_ascii=False) for p in phones]
+        self.cum_weights = list(itertools.accumulate(1.0 / rank ** zipf for rank in range(1, len(phones) + 1)))
+        self.area_codes = [json.dumps(code, ensure_ascii=False) for code in area_codes]
+        self.long_distance_ratio = long_distance_ratio
+        self.next_index = next_index
+        self.template = JSONL_TEMPLATE if jsonl else JSON_TEMPLATE
+
+    def generate(self, start_times):
+        """按给出的开始时间（每条一个）生成同样多条记录，返回各条记录的文本。"""
+        rng = self.rng
+        random_ = rng.random
+        phones = self.phones
+        area_codes = self.area_codes
+        area_count = len(area_codes)
+        other_count = max(1, len(phones) - 1)
+        ratio = self.long_distance_ratio
+        template = self.template
+        callers = rng.choices(range(len(phones)), cum_weights=self.cum_weights, k=len(start_times))
+        texts = []
+        index = self.next_index
+        for caller, start_time in zip(callers, start_times):
+            # 被叫在除主叫外的用户中抽取；只有一个用户时只能自己给自己打
+            callee = int(random_() * other_count)
+            if callee >= caller and len(phones) > 1:
+                callee += 1
+            if random_() < ratio:
+                call_type, area_code = "long-distance", area_codes[int(random_() * area_count)]
+            else:
+                call_type, area_code = "local", "null"
+            r = random_()
+            texts.append(template % (index, phones[caller], phones[callee], start_time,
+                                     int(10 + r * r * (600 - 10)), call_type, area_code))
+            index += 1
+        self.next_index = index
+        return texts
+
+
+CALL_ID_PATTERN = re.compile(rb'"callId": "C(\d+)"')
+
+
+def last_call_index(path):
+    """
+    读取文件中最后一个 "Cnnnn" 形式的 callId 序号，文件不存在或没有这样的记录时返回 0。
+    先读末尾 TAIL_BYTES 字节；找不到（如最后几条记录特别长）时向前逐块查找，块长每次加倍，
+    相邻两块重叠 CALL_ID_OVERLAP 字节，被块边界切开的 callId 也能找到。
+    """
+    try:
+        with file_lock(path), open(path, "rb") as f:
+            end = f.seek(0, os.SEEK_END)
+            block = TAIL_BYTES
+            while end > 0:
+                start = max(0, end - block)
+                f.seek(start)
+                ids = CALL_ID_PATTERN.findall(f.read(end - start))
+                if ids:
+                    return int(ids[-1])
+                if start == 0:
+                    break
+                end = start + CALL_ID_OVERLAP
+                block *= 2
+    except OSError:
+        pass
+    return 0
+
+
+def append_json_texts(path, texts):
+    """
+    把若干条记录文本插入 {"callRecords": [...]} 文件的列表末尾。
+    只截掉并重写文件末尾的 "]}"（在最后 SNAPSHOT_TAIL_BYTES 个字节以内），前面已有的内容不动；
+    文件不存在时新建。调用方需持有排他锁。
+    """
+    if not texts:
+        return
+    body = ",\n".join(texts)
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write('{\n    "callRecords": [\n' + body + "\n    ]\n}")
+        return
+    with open(path, "r+b") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - TAIL_BYTES))
+        start = f.tell()
+        tail = f.read()
+        closing = tail.rstrip()
+        if not closing.endswith(b"}") or not closing[:-1].rstrip().endswith(b"]"):
+            raise ValueError(f"{path} 的结尾不是 {{\"callRecords\": [...]}} 的格式，无法追加")
+        # 列表最后一条记录（或空列表的 "["）之后的位置
+        last = closing[:-1].rstrip()[:-1].rstrip()
+        separator = "\n" if last.endswith(b"[") else ",\n"
+        # file_lock 的约定：原处改写的只能是最后 SNAPSHOT_TAIL_BYTES 个字节，否则持锁读取的快照会读到改写后的内容
+        assert size - (start + len(last)) <= SNAPSHOT_TAIL_BYTES, "截断位置超出了读取方快照保存的文件末尾"
+        f.seek(start + len(last))
+        f.truncate()
+        f.write((separator + body + "\n    ]\n}").encode("utf-8"))
+
+
+def append_texts(path, texts, jsonl):
+    """持排他锁把一批记录文本写入通话记录文件，计费系统要么读到整批记录，要么一条也读不到。"""
+    with file_lock(path, exclusive=True):
+        if jsonl:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("".join(text + "\n" for text in texts))
+        else:
+            append_json_texts(path, texts)
+
+
+def simulated_start_times(rng, since, days, count):
+    """
+    批量生成时的开始时间：从 since 起按泊松过程递增，平均间隔为 days 天 / count，
+    即 count 条通话大致均匀分布在这段时间内。
+    日期部分每天只格式化一次，时分秒直接拼接，不逐条调用 strftime。
+    """
+    midnight = since.replace(hour=0, minute=0, second=0, microsecond=0)
+    offset = float((since - midnight).seconds)
+    rate = max(1, count) / (days * 86400.0)
+    expovariate = rng.expovariate
+    day = None
+    date_text = ""
+    for _ in range(count):
+        offset += expovariate(rate)
+        days_passed, second = divmod(int(offset), 86400)
+        if days_passed != day:
+            day = days_passed
+            date_text = (midnight + timedelta(days=day)).strftime("%Y-%m-%d")
+        minutes, second = divmod(second, 60)
+        yield "%s %02d:%02d:%02d" % (date_text, minutes // 60, minutes % 60, second)
+
+
+def default_since(days):
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=days)
+
+
+def prepare_load_test(args):
+    """确定输出文件和格式，读入用户与区号，返回 (输出文件, 是否 JSONL, TrafficGenerator)。"""
+    init_sample_users_and_rates()
+    output = args.output or (CALLS_JSONL_FILE if use_jsonl() else CALLS_FILE)
+    jsonl = output.endswith(".jsonl")
+    users = load_json(USERS_FILE, default={"users": []}).get("users", [])
+    rate_items = load_json(RATES_FILE, default={"longDistanceRates": []}).get("longDistanceRates", [])
+    area_codes = [r["areaCode"] for r in rate_items] if rate_items else ["010"]
+    generator = TrafficGenerator(users, area_codes, seed=args.seed, zipf=args.zipf,
+                                 long_distance_ratio=args.long_distance_ratio,
+                                 next_index=last_call_index(output) + 1, jsonl=jsonl)
+    return output, jsonl, generator
+
+
+def bulk_generate_calls(args):
+    """尽快生成 args.count 条通话记录，每攒够一批追加写入一次。"""
+    output, jsonl, generator = prepare_load_test(args)
+    if not generator.phones:
+        print("users.json 中没有用户信息，无法生成通话记录。")
+        return
+    since = datetime.strptime(args.since, TIME_FORMAT) if args.since else default_since(args.days)
+    # 开始时间用另一个由种子派生的随机数序列，与号码、时长的抽取互不相关
+    time_seed = None if args.seed is None else f"{args.seed}:startTime"
+    start_times = simulated_start_times(random.Random(time_seed), since, args.days, args.count)
+
+    print(f"===== 批量生成 {args.count} 条通话记录到 {output} =====")
+    started = time.perf_counter()
+    written = 0
+    while written < args.count:
+        count = min(args.batch, args.count - written)
+        append_texts(output, generator.generate(list(itertools.islice(start_times, count))), jsonl)
+        written += count
+        seconds = time.perf_counter() - started
+        print(f"\r已写入 {written} 条，{written / max(seconds, 1e-9):.0f} 条/秒", end="", flush=True)
+    seconds = time.perf_counter() - started
+    print(f"\n完成：{written} 条，用时 {seconds:.2f} 秒，平均 {written / max(seconds, 1e-9):.0f} 条/秒")
+
+
+def rate_generate_calls(args):
+    """按每秒 args.rate 条的速率持续生成，每 RATE_TICK 秒把这段时间应生成的记录一次追加写入；Ctrl + C 停止。"""
+    output, jsonl, generator = prepare_load_test(args)
+    if not generator.phones:
+        print("users.json 中没有用户信息，无法生成通话记录。")
+        return
+
+    print(f"===== 按每秒 {args.rate} 条生成通话记录到 {output}，按 Ctrl + C 停止 =====")
+    started = last_report = time.perf_counter()
+    written = 0
+    try:
+        while args.count is None or written < args.count:
+            now = time.perf_counter()
+            elapsed = now - started
+            if args.duration is not None:
+                elapsed = min(elapsed, args.duration)
+            due = int(elapsed * args.rate) - written
+            if args.count is not None:
+                due = min(due, args.count - written)
+            if due > 0:
+                append_texts(output, generator.generate([current_time_str()] * due), jsonl)
+                written += due
+            if args.duration is not None and elapsed >= args.duration:
+                break
+            if now - last_report >= 1.0:
+                last_report = now
+                print(f"\r已写入 {written} 条，{written / max(elapsed, 1e-9):.0f} 条/秒", end="", flush=True)
+            time.sleep(max(0.0, RATE_TICK - (time.perf_counter() - now)))
+    except KeyboardInterrupt:
+        pass
+    seconds = time.perf_counter() - started
+    print(f"\n已停止：共写入 {written} 条，平均 {written / max(seconds, 1e-9):.0f} 条/秒，数据保存在：{output}")
+
+
 # ===== 主逻辑：实时生成通话记录 =====
 
 def prepare_environment():
-    """确保用户、费率文件存在，并加载数据；同时加载/初始化 calls.json。"""
+    """确保用户、费率文件存在并加载数据；下一个 callId 序号只读通话记录文件的末尾得到，不加载已有记录。"""
     init_sample_users_and_rates()
 
     users_data = load_json(USERS_FILE, default={"users": []})
     rates_data = load_json(RATES_FILE, default={"longDistanceRates": []})
-    calls_data = load_json(CALLS_FILE, default={"callRecords": []})
 
     users = users_data.get("users", [])
     rate_items = rates_data.get("longDistanceRates", [])
     area_codes = [r["areaCode"] for r in rate_items] if rate_items else ["010"]
-    call_records = calls_data.get("callRecords", [])
-
-    # 根据现有记录确定下一个 callId 序号
-    next_index = 1
-    if call_records:
-        last_id = call_records[-1].get("callId", "")
-        try:
-            num_part = int(last_id.strip("C"))
-            next_index = num_part + 1
-        except Exception:
-            next_index = len(call_records) + 1
 
-    print(f"[init] 当前已有通话记录 {len(call_records)} 条，下一个 callId 将从 C{next_index:04d} 开始。")
+    next_index = last_call_index(CALLS_JSONL_FILE if use_jsonl() else CALLS_FILE) + 1
+    print(f"[init] 下一个 callId 将从 C{next_index:04d} 开始。")
 
-    return users, area_codes, call_records, next_index
+    return users, area_codes, next_index
 
 
 def realtime_generate_calls():
     """
-    无限循环，每隔随机时间生成一条新通话记录，写入 calls.json。
+    无限循环，每隔随机时间生成一条新通话记录，追加到 calls.json（或 calls.jsonl）末尾。
     按 Ctrl + C 可以终止。
     所有号码（主叫 & 被叫）均来自 users.json。
     """
-    users, area_codes, call_records, next_index = prepare_environment()
+    users, area_codes, next_index = prepare_environment()
+    generated = 0
+    jsonl = use_jsonl()
+    calls_file = CALLS_JSONL_FILE if jsonl else CALLS_FILE
 
     if not users:
         print("users.json 中没有用户信息，无法生成通话记录。")
@@ -187,9 +450,10 @@ def realtime_generate_calls():
                 "longDistanceAreaCode": area_code
             }
 
-            # 3. 加入内存列表，并写回 calls.json
-            call_records.append(new_record)
-            save_json(CALLS_FILE, {"callRecords": call_records})
+            # 3. 追加到通话记录文件末尾（已有内容不重写）
+            text = json.dumps(new_record, ensure_ascii=False) if jsonl else dump_indented_record(new_record)
+            append_texts(calls_file, [text], jsonl)
+            generated += 1
 
             # 4. 在终端打印一行日志
             print(f"[新增通话] {call_id} | 主叫: {caller_number} | 被叫: {callee_number} | "
@@ -199,9 +463,47 @@ def realtime_generate_calls():
 
     except KeyboardInterrupt:
         print("\n===== 已停止实时通话模拟 =====")
-        print(f"最终总通话记录条数：{len(call_records)}")
-        print(f"数据保存在：{CALLS_FILE}")
+        print(f"本次共生成通话记录 {generated} 条")
+        print(f"数据保存在：{calls_file}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="通话记录生成器；不带参数时每隔几秒生成一条（实时模式）")
+    parser.add_argument("--count", type=int, help="生成的记录条数；不带 --rate 时尽快生成后退出")
+    parser.add_argument("--rate", type=float, help="每秒生成的记录条数，持续生成直到 Ctrl + C")
+    parser.add_argument("--duration", type=float, help="按速率生成时持续的秒数")
+    parser.add_argument("--seed", type=int, help="随机种子，用于复现同样的记录")
+    parser.add_argument("--zipf", type=float, default=0.0, help="主叫号码的 Zipf 倾斜指数，默认 0 即均匀")
+    parser.add_argument("--long-distance-ratio", type=float, default=DEFAULT_LONG_DISTANCE_RATIO,
+                        help="长途通话所占比例（0~1）")
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH_SIZE, help="每次追加写入的记录条数")
+    parser.add_argument("--output", help="输出文件（.jsonl 结尾时按 JSON Lines 追加），默认与实时模式相同")
+    parser.add_argument("--from", dest="since", help="批量生成时最早的开始时间，格式 YYYY-MM-DD HH:MM:SS，"
+                                                     "默认为 --days 天前的零点")
+    parser.add_argument("--days", type=float, default=30, help="批量生成的通话分布在多少天内")
+    args = parser.parse_args(argv)
+
+    if args.count is not None and args.count < 0:
+        parser.error("--count 不能为负数")
+    if args.rate is not None and args.rate <= 0:
+        parser.error("--rate 必须大于 0")
+    if not 0.0 <= args.long_distance_ratio <= 1.0:
+        parser.error("--long-distance-ratio 应在 0 到 1 之间")
+    if args.batch <= 0 or args.days <= 0:
+        parser.error("--batch 与 --days 必须大于 0")
+    if args.since:
+        try:
+            datetime.strptime(args.since, TIME_FORMAT)
+        except ValueError:
+            parser.error("--from 的格式应为 YYYY-MM-DD HH:MM:SS")
+
+    if args.rate is not None:
+        rate_generate_calls(args)
+    elif args.count is not None:
+        bulk_generate_calls(args)
+    else:
+        realtime_generate_calls()
 
 
 if __name__ == "__main__":
-    realtime_generate_calls()
+    main()